@@ -0,0 +1,34 @@
+"""
+Compares two result files of `benchmarks.run`, e.g. of two commits.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return {(result['name'], result.get('rows')): result for result in json.load(file)['results']}
+
+def compare(before: dict, after: dict, metrics=('p50_ms', 'p99_ms', 'peak_bytes')) -> list:
+    """
+    Returns one line per benchmark present in both files, with the after/before ratio of each metric.
+    """
+    lines = []
+    for key in sorted(before.keys() & after.keys(), key=lambda key: (key[0], key[1] or 0)):
+        ratios = [
+            "{metric} {ratio:6.2f}x".format(metric=metric, ratio=after[key][metric] / before[key][metric])
+            if before[key][metric] else "{metric}    n/a".format(metric=metric)
+            for metric in metrics
+        ]
+        lines.append("{name:<28} {rows:>9}  {ratios}".format(name=key[0], rows=key[1] or '', ratios="  ".join(ratios)))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    arguments = parser.parse_args()
+    print("\n".join(compare(load(arguments.before), load(arguments.after))))
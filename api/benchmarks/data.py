@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+SUBJECTS = ['BDD', 'Docker', 'Kubernetes', 'Machine Learning', 'Automation', 'Streaming de données', 'Classification', 'Systèmes distribués']
+USES = ['Test de positionnement', 'Test de validation', 'Total Bootcamp']
+CORRECTS = ['A', 'B', 'C', 'D', 'A,B', 'B,C', 'A,C', 'A,D', 'B,D']
+
+
+# Question bank sizes of the benchmark suite
+SIZES = {'1k': 1_000, '100k': 100_000, '1M': 1_000_000}
+
+
+def _names(real, prefix: str, count: int) -> list:
+    return (real + [f"{prefix} {i}" for i in range(len(real), count)])[:count]
+
+def synthetic_questions(rows: int, seed: int = 0, subjects: int = len(SUBJECTS), uses: int = len(USES)) -> pd.DataFrame:
+    """
+    Generates a question bank shaped like the real one: few subjects, uses and correct answers,
+    distinct question texts, and mostly empty responseD and remark.
+
+    Args:
+        rows (int): The number of questions.
+        seed (int): Seed of the generator, so that runs are comparable.
+        subjects (int): The number of distinct subjects.
+        uses (int): The number of distinct uses.
+
+    Returns:
+        pd.DataFrame: The questions, as `pd.read_csv` would return them.
+    """
+    rng = np.random.default_rng(seed)
+    subject_names = np.array(_names(SUBJECTS, 'Subject', subjects), dtype=object)
+    use_names = np.array(_names(USES, 'Use', uses), dtype=object)
+    numbers = np.arange(rows).astype(str)
+    responses = {
+        column: np.char.add(f"Réponse {column[-1]} ", numbers).astype(object)
+        for column in ('responseA', 'responseB', 'responseC')
+    }
+    response_d = np.char.add("Réponse D ", numbers).astype(object)
+    response_d[rng.random(rows) < 0.8] = np.nan
+    return pd.DataFrame({
+        'question': np.char.add("Question synthétique numéro ", numbers).astype(object),
+        'subject': subject_names[rng.integers(len(subject_names), size=rows)],
+        'use': use_names[rng.integers(len(use_names), size=rows)],
+        'correct': np.array(CORRECTS, dtype=object)[rng.integers(len(CORRECTS), size=rows)],
+        **responses,
+        'responseD': response_d,
+        'remark': np.full(rows, np.nan, dtype=object),
+    })
+
+def write_synthetic_csv(path: str, rows: int, seed: int = 0, subjects: int = len(SUBJECTS), uses: int = len(USES)) -> str:
+    synthetic_questions(rows, seed, subjects, uses).to_csv(path, index=False)
+    return path
@@ -0,0 +1,67 @@
+"""
+Bytes per question held by the in-memory store, and bytes allocated to serve one draw.
+
+    python -m benchmarks.memory --rows 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import timeit
+import tracemalloc
+import pandas as pd
+from benchmarks.data import write_synthetic_csv
+from csv_management import convert_df_to_CSVQuestion_List
+from question_index import QuestionIndex
+from question_store import QuestionColumns, question_rows, resident_bytes
+
+
+def peak_bytes(function) -> int:
+    """
+    Returns the peak memory allocated while `function` runs, above what was allocated before.
+    """
+    function()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        function()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+def seconds_per_call(function, repeat: int = 200) -> float:
+    return timeit.timeit(function, number=repeat) / repeat
+
+def run(rows: int, draw: int = 20) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        # Parsed from a file, like the repository does
+        df = pd.read_csv(write_synthetic_csv(os.path.join(directory, 'questions.csv'), rows))
+    # The frame read_csv returns, and the one the repository publishes over its column buffers
+    stored = QuestionColumns(df).frame()
+
+    index = QuestionIndex.from_dataframe(stored)
+    labels = next(iter(index.buckets.values()))[:draw]
+    draws = {
+        'dataframe_rows': lambda: convert_df_to_CSVQuestion_List(stored.loc[labels]),
+        'question_rows': lambda: [row.to_model() for row in question_rows(stored, labels)],
+        'question_rows_without_models': lambda: [row.to_dict() for row in question_rows(stored, labels)],
+    }
+    return {
+        'rows': rows,
+        'bytes_per_row': {
+            'csv_parsed': resident_bytes(df) / rows,
+            'categorical': resident_bytes(stored) / rows,
+        },
+        'draw': {
+            'questions': draw,
+            'peak_bytes': {name: peak_bytes(function) for name, function in draws.items()},
+            'seconds': {name: seconds_per_call(function) for name, function in draws.items()},
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    arguments = parser.parse_args()
+    print(json.dumps(run(arguments.rows), indent=2))
@@ -0,0 +1,180 @@
+"""
+Benchmark suite of the question retrieval, write and auth paths, with JSON output.
+
+    python -m benchmarks.run --sizes 1k 100k --output before.json
+    python -m benchmarks.run --sizes 1M --only get_questions
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from typing import Iterator, List
+from unittest.mock import patch
+import pandas as pd
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasicCredentials
+from fastapi.testclient import TestClient
+from benchmarks.data import SIZES, SUBJECTS, USES, write_synthetic_csv
+from benchmarks.harness import measure
+from csv_management import get_questions
+from models import CSVQuestion, QuestionKey, QuizSpec
+from repository.question import CSVQuestionRepository
+from response_cache import ResponseCache
+
+USER, PASSWORD = 'alice', 'wonderland'
+
+
+def enabled(arguments: argparse.Namespace, name: str) -> bool:
+    return not arguments.only or any(selected in name for selected in arguments.only)
+
+def question_benchmarks(rows: int, arguments: argparse.Namespace, directory: str) -> Iterator[dict]:
+    path = write_synthetic_csv(os.path.join(directory, f"questions-{rows}.csv"), rows,
+                               subjects=arguments.subjects, uses=arguments.uses)
+    # No background compaction, so that removals measure the tombstoning alone
+    repository = CSVQuestionRepository(path, compaction_threshold=1.0)
+    repository.load()
+    use = repository.get_uses()[0]
+    subjects = repository.get_subjects()[:2]
+    draw = min(20, repository.index.count(use, subjects))
+    labels = {'rows': rows}
+    df, index = repository.snapshot()
+
+    if enabled(arguments, 'get_questions'):
+        yield measure('get_questions', lambda: get_questions(use, subjects, draw, df, index),
+                      arguments.iterations, **labels)
+    if enabled(arguments, 'get_questions_balanced'):
+        weights = [1.0] * len(subjects)
+        yield measure('get_questions_balanced', lambda: get_questions(use, subjects, draw, df, index, weights=weights),
+                      arguments.iterations, **labels)
+    if enabled(arguments, 'find_questions_json'):
+        cache = ResponseCache()
+        yield measure('find_questions_json', lambda: cache.questions(repository, use, subjects, draw),
+                      arguments.iterations, **labels)
+    if enabled(arguments, 'search_questions'):
+        # The first search builds the index, outside of the timings
+        repository.search(df['question'].iloc[0], 20)
+        queries = itertools.cycle(df['question'].iloc[:100].tolist())
+        yield measure('search_questions', lambda: repository.search(next(queries), 20),
+                      arguments.iterations, **labels)
+    if enabled(arguments, 'find_near_duplicates'):
+        # The first lookup builds the index, outside of the timings
+        candidates = itertools.cycle([QuestionKey(**row) for row in df[['question', 'subject']].iloc[:100].to_dict('records')])
+        repository.find_near_duplicates(next(candidates))
+        yield measure('find_near_duplicates', lambda: repository.find_near_duplicates(next(candidates)),
+                      arguments.iterations, **labels)
+    if enabled(arguments, 'list_questions'):
+        # A page from the middle of the bank, as a mirror resuming from its cursor
+        middle = int(df.index[len(df) // 2])
+        yield measure('list_questions', lambda: repository.list_question_ids(middle, 100, use),
+                      arguments.iterations, **labels)
+    if enabled(arguments, 'export_first_chunk'):
+        # Time to the first chunk of an export, which does not grow with the bank
+        yield measure('export_first_chunk', lambda: next(repository.iter_question_rows(use)),
+                      arguments.iterations, **labels)
+    if enabled(arguments, 'add_question'):
+        added = itertools.count()
+        yield measure('add_question', lambda: repository.add(CSVQuestion(
+            question=f"Benchmark question {next(added)}", subject=subjects[0], use=use, correct='A',
+            responseA='A1', responseB='A2', responseC='A3',
+        )), arguments.write_iterations, **labels)
+    if enabled(arguments, 'remove_question'):
+        existing = iter(df[['question', 'subject']].itertuples(index=False))
+        yield measure('remove_question', lambda: repository.remove(QuestionKey(**next(existing)._asdict())),
+                      arguments.write_iterations, **labels)
+    yield from endpoint_benchmarks(repository, use, subjects, draw, arguments, labels)
+
+def endpoint_benchmarks(repository: CSVQuestionRepository, use: str, subjects: List[str], draw: int,
+                        arguments: argparse.Namespace, labels: dict) -> Iterator[dict]:
+    from main import app
+    client = TestClient(app)
+    token = client.get("/api-v1/auth/login", auth=(USER, PASSWORD)).json()['access_token']
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"use": use, "subjects": subjects, "num_questions": draw}
+    with patch('service.question.question_repository', repository):
+        if enabled(arguments, 'http_get_questions'):
+            yield measure('http_get_questions', lambda: client.get("/api-v1/questions/", params=params, headers=headers),
+                          arguments.iterations, **labels)
+        if enabled(arguments, 'quiz_batch'):
+            from service.question import generate_quiz_batch
+            quizzes = [QuizSpec(use=use, subjects=subjects, num_questions=draw)] * 100
+            yield measure('quiz_batch_100', lambda: b''.join(generate_quiz_batch(quizzes)),
+                          arguments.iterations, **labels)
+        if enabled(arguments, 'http_get_subjects'):
+            yield measure('http_get_subjects', lambda: client.get("/api-v1/questions/subjects/"),
+                          arguments.iterations, **labels)
+
+def auth_benchmarks(arguments: argparse.Namespace) -> Iterator[dict]:
+    from controller.question import authenticate_user
+    from service.auth import AuthService, credential_cache
+
+    if enabled(arguments, 'authenticate_user_cached'):
+        yield measure('authenticate_user_cached', lambda: AuthService.authenticate_user(USER, PASSWORD), arguments.iterations)
+    if enabled(arguments, 'authenticate_user_bcrypt'):
+        yield measure('authenticate_user_bcrypt', lambda: AuthService.authenticate_user(USER, PASSWORD),
+                      arguments.hash_iterations, warmup=1, setup=credential_cache.clear, memory_iterations=1)
+
+    token = AuthService.issue_token(USER)
+    if enabled(arguments, 'verify_token'):
+        yield measure('verify_token', lambda: AuthService.verify_token(token), arguments.iterations)
+
+    loop = asyncio.new_event_loop()
+    bearer = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    basic = HTTPBasicCredentials(username=USER, password=PASSWORD)
+    try:
+        if enabled(arguments, 'dependency_bearer'):
+            yield measure('dependency_bearer', lambda: loop.run_until_complete(authenticate_user(bearer, None)),
+                          arguments.iterations)
+        if enabled(arguments, 'dependency_basic'):
+            yield measure('dependency_basic_cached', lambda: loop.run_until_complete(authenticate_user(None, basic)),
+                          arguments.iterations)
+    finally:
+        loop.close()
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+    }
+
+def run(arguments: argparse.Namespace) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks = [auth_benchmarks(arguments)]
+        benchmarks += [question_benchmarks(SIZES[size], arguments, directory) for size in arguments.sizes]
+        for result in itertools.chain.from_iterable(benchmarks):
+            print("{name:<28} {rows:>9} p50 {p50_ms:9.3f} ms  p99 {p99_ms:9.3f} ms  {throughput_per_s:10.1f}/s".format(
+                **{'rows': '', **result}), file=sys.stderr)
+            results.append(result)
+    return {'meta': {**metadata(), 'arguments': vars(arguments)}, 'results': results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['1k', '100k'])
+    parser.add_argument('--subjects', type=int, default=len(SUBJECTS), help="distinct subjects in the synthetic bank")
+    parser.add_argument('--uses', type=int, default=len(USES), help="distinct uses in the synthetic bank")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--write-iterations', type=int, default=50)
+    parser.add_argument('--hash-iterations', type=int, default=5)
+    parser.add_argument('--only', nargs='+', help="only run the benchmarks whose name contains one of these")
+    parser.add_argument('--output', help="file to write the JSON results to, instead of stdout")
+    arguments = parser.parse_args()
+
+    report = json.dumps(run(arguments), indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(report)
+    else:
+        print(report)
@@ -1,13 +1,13 @@
 from fastapi import Depends, HTTPException, status, APIRouter
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from typing import Annotated
-from service.auth import AuthService
+from service.auth import AuthService, ACCESS_TOKEN_TTL
 
 router = APIRouter()
 security = HTTPBasic()
 
-@router.get("/login", tags=["Authentication"], summary="Login Endpoint", description="Authenticate user with username and password.")
-def get_current_username(
+@router.get("/login", tags=["Authentication"], summary="Login Endpoint", description="Authenticate user with username and password and issue an access token.")
+async def get_current_username(
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
 ):
     """
@@ -15,12 +15,20 @@ def get_current_username(
 
     - **username**: User's username
     - **password**: User's password
+
+    The returned access token can be sent as `Authorization: Bearer <token>` on the
+    question endpoints until it expires, instead of the username and password.
     """
 
-    if not AuthService.authenticate_user(credentials.username, credentials.password):
+    if not await AuthService.authenticate_user_async(credentials.username, credentials.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Basic"},
         )
-    return {"username": credentials.username}
\ No newline at end of file
+    return {
+        "username": credentials.username,
+        "access_token": AuthService.issue_token(credentials.username),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_TTL,
+    }
\ No newline at end of file
@@ -1,63 +1,123 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from service.question import find_questions, create_question, get_subjects, get_uses
-from models import CSVQuestion
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
+from service.question import find_questions_json_async, create_question_async, delete_questions_async, export_questions_async, find_near_duplicates_async, generate_quiz_batch_async, get_subjects_json_async, get_uses_json_async, import_questions_async, list_questions_json_async, search_questions_json_async, to_near_duplicates
+from response_cache import EncodedResponse, etag_matches
+import csv_management
+from csv_management import CSV_MEDIA_TYPES, EXPORT_MEDIA_TYPES, NDJSON_MEDIA_TYPES
+from models import BulkImportResult, CSVQuestion, NearDuplicate, QuestionKey, QuestionPage, QuizBatch, SearchResults
+from near_duplicates import NearDuplicateError
 from service.auth import AuthService
 
 router = APIRouter()
-security = HTTPBasic()
+# Both schemes are optional so a bearer token can be tried first, with HTTP Basic as the fallback
+security = HTTPBasic(auto_error=False)
+bearer = HTTPBearer(auto_error=False)
 
 
-def authenticate_user(credentials: HTTPBasicCredentials = Depends(security)):
+def require_credentials(credentials: Optional[HTTPBasicCredentials]) -> HTTPBasicCredentials:
     """
-    Authenticates a regular user based on provided credentials.
+    Ensures HTTP basic credentials were sent when no bearer token was provided.
+
+    Raises:
+        HTTPException: If no credentials were provided at all.
+    """
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Basic"})
+    return credentials
+
+async def authenticate_user(
+        token: Optional[HTTPAuthorizationCredentials] = Depends(bearer),
+        credentials: Optional[HTTPBasicCredentials] = Depends(security)
+    ):
+    """
+    Authenticates a regular user based on a bearer access token or provided credentials.
 
     Args:
+        token (HTTPAuthorizationCredentials): The bearer access token issued by /auth/login.
         credentials (HTTPBasicCredentials): The HTTP basic authentication credentials.
 
     Raises:
-        HTTPException: If the provided credentials are invalid.
+        HTTPException: If the provided token or credentials are invalid.
 
     Returns:
         str: The username if authentication is successful.
     """
-    if not AuthService.authenticate_user(credentials.username, credentials.password):
+    if token is not None:
+        username = AuthService.verify_token(token.credentials)
+        if username is None:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        return username
+
+    credentials = require_credentials(credentials)
+    if not await AuthService.authenticate_user_async(credentials.username, credentials.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     return credentials.username
 
-def authenticate_admin(credentials: HTTPBasicCredentials = Depends(security)):
+async def authenticate_admin(
+        token: Optional[HTTPAuthorizationCredentials] = Depends(bearer),
+        credentials: Optional[HTTPBasicCredentials] = Depends(security)
+    ):
     """
-    Authenticates an admin user based on provided credentials.
+    Authenticates an admin user based on a bearer access token or provided credentials.
 
     Args:
+        token (HTTPAuthorizationCredentials): The bearer access token issued by /auth/login.
         credentials (HTTPBasicCredentials): The HTTP basic authentication credentials.
 
     Raises:
-        HTTPException: If the provided credentials are invalid or if the user is not an admin.
+        HTTPException: If the provided token or credentials are invalid or if the user is not an admin.
 
     Returns:
         str: The username if authentication is successful.
     """
-    if not AuthService.is_admin(credentials.username, credentials.password):
+    if token is not None:
+        username = AuthService.verify_token(token.credentials, admin=True)
+        if username is None:
+            raise HTTPException(status_code=401, detail="Invalid admin credentials")
+        return username
+
+    credentials = require_credentials(credentials)
+    if not await AuthService.is_admin_async(credentials.username, credentials.password):
         raise HTTPException(status_code=401, detail="Invalid admin credentials")
     return credentials.username
 
+def json_response(request: Request, encoded: EncodedResponse) -> Response:
+    """
+    Sends pre-encoded JSON with its ETag, or an empty 304 if the client already has it.
+    """
+    headers = {"ETag": encoded.etag}
+    if etag_matches(request.headers.get("if-none-match"), encoded.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=encoded.body, media_type="application/json", headers=headers)
+
 
 @router.get("/", response_model=List[CSVQuestion], tags=['Questions, Authentication'])
-def get_questions(
+async def get_questions(
+        request: Request,
         use: str, 
         subjects: List[str] = Query(...), 
         num_questions: int = Query(5, gt=0, le=20), 
+        seed: Optional[int] = Query(None, ge=0, description="Seed of the random draw, to get a reproducible quiz"),
+        balanced: bool = Query(False, description="Split the questions evenly across the subjects"),
+        weights: Optional[List[float]] = Query(None, description="Share of each subject, in the order of `subjects`; implies a balanced draw"),
         username: str = Depends(authenticate_user)
     ):
     """
     Fetches questions based on the specified criteria.
 
+    By default the questions are drawn uniformly from all the requested subjects together.
+    With `balanced` or `weights`, each subject gets its quota of `num_questions`, and the
+    request fails with the per-subject counts if a subject cannot fill its quota.
+
     Args:
         use (str): Use of the questions (e.g., "Exam", "Quiz").
         subjects [str]: list of subjects.
         num_questions (int): Number of questions to fetch.
+        seed (Optional[int]): Seed of the random draw; the same seed gives the same quiz.
+        balanced (bool): Whether to split the questions evenly across the subjects.
+        weights (Optional[List[float]]): Relative share of each subject, one per subject.
         username (str): The username of the authenticated user.
 
     Returns:
@@ -67,14 +127,123 @@ def get_questions(
         HTTPException: If there is an error in fetching the questions.
     """
     try:
-        questions = find_questions(use, subjects, num_questions)
-        return questions
+        if balanced and weights is None:
+            weights = [1.0] * len(subjects)
+        return json_response(request, await find_questions_json_async(use, subjects, num_questions, seed, weights))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/search", response_model=SearchResults, tags=['Questions, Authentication'])
+async def search_questions(
+        request: Request,
+        q: str = Query(..., min_length=1, max_length=500, description="Words to look for in the questions, answers and remarks"),
+        limit: int = Query(20, gt=0, le=100),
+        offset: int = Query(0, ge=0),
+        username: str = Depends(authenticate_user)
+    ):
+    """
+    Searches the questions by their text, e.g. to check for duplicates before adding one.
+
+    A question matches when every word of `q` appears in its text, answers or remark,
+    whatever the accents and the case. The best matches come first, words found in the
+    question text counting more than in the answers and in the remark.
+
+    Args:
+        q (str): The words to look for.
+        limit (int): The maximum number of questions to return.
+        offset (int): The number of best matches to skip, for pagination.
+        username (str): The username of the authenticated user.
+
+    Returns:
+        SearchResults: The total number of matches and the requested page of questions.
+    """
+    return json_response(request, await search_questions_json_async(q, limit, offset))
+
+@router.get("/all", response_model=QuestionPage, tags=['Questions, Authentication'])
+async def list_questions(
+        request: Request,
+        cursor: Optional[str] = Query(None, description="The `next_cursor` of the previous page"),
+        limit: int = Query(100, gt=0, le=1000),
+        use: Optional[str] = None,
+        subjects: Optional[List[str]] = Query(None),
+        username: str = Depends(authenticate_admin)
+    ):
+    """
+    Lists the questions page by page, e.g. to mirror the bank.
+
+    Pages are walked with the `next_cursor` of each page, which is null after the last one.
+    Unlike an offset, a cursor neither skips nor repeats questions when questions are added
+    or removed meanwhile; a cursor that can no longer be resumed is rejected with a 400.
+
+    Args:
+        cursor (Optional[str]): The cursor of the page, none for the first page.
+        limit (int): The maximum number of questions of the page.
+        use (Optional[str]): Only list the questions of this use.
+        subjects (Optional[List[str]]): Only list the questions of these subjects.
+        username (str): The username of the authenticated admin user.
+
+    Returns:
+        QuestionPage: The questions of the page and the cursor of the next one.
+    """
+    try:
+        return json_response(request, await list_questions_json_async(cursor, limit, use, subjects))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/export", tags=['Questions, Authentication'], response_class=StreamingResponse)
+async def export_questions(
+        format: Literal['csv', 'ndjson', 'parquet'] = Query('csv'),
+        use: Optional[str] = None,
+        subjects: Optional[List[str]] = Query(None),
+        username: str = Depends(authenticate_admin)
+    ):
+    """
+    Downloads the questions as a CSV, NDJSON or Parquet file, streamed as it is read so that
+    the download starts at once and the server memory does not grow with the bank.
+
+    Args:
+        format (str): The file format; Parquet is only available when pyarrow is installed.
+        use (Optional[str]): Only export the questions of this use.
+        subjects (Optional[List[str]]): Only export the questions of these subjects.
+        username (str): The username of the authenticated admin user.
+
+    Returns:
+        StreamingResponse: The file of the questions.
+    """
+    if format == 'parquet' and csv_management.pyarrow is None:
+        raise HTTPException(status_code=501, detail="Parquet exports are not available on this server")
+    try:
+        parts = await export_questions_async(format, use, subjects)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    headers = {"Content-Disposition": 'attachment; filename="questions.{format}"'.format(format=format)}
+    return StreamingResponse(parts, media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
+
+@router.post("/batch", tags=['Questions, Authentication'], response_class=StreamingResponse)
+async def get_quiz_batch(
+        batch: QuizBatch,
+        username: str = Depends(authenticate_user)
+    ):
+    """
+    Draws the questions of many quizzes in one request, e.g. one quiz per student of a class.
+
+    The response is NDJSON, streamed as the quizzes are built: one line per quiz, in request
+    order, either {"index": i, "questions": [...]} or {"index": i, "error": "..."} when that
+    quiz cannot be drawn (unknown use or subject, not enough questions).
+
+    Args:
+        batch (QuizBatch): The quizzes, each with a use, subjects, a number of questions and an optional seed.
+        username (str): The username of the authenticated user.
+
+    Returns:
+        StreamingResponse: The NDJSON lines of the quizzes.
+    """
+    return StreamingResponse(generate_quiz_batch_async(batch.quizzes), media_type="application/x-ndjson")
 
 @router.post("/", response_model=CSVQuestion, tags=["Questions, Authentication"])
-def add_question(
+async def add_question(
         question: CSVQuestion,
+        allow_near_duplicates: bool = Query(False, description="Add the question even if a nearly identical one of the same subject exists"),
         username: str = Depends(authenticate_admin)
     ):
     """
@@ -82,36 +251,116 @@ def add_question(
 
     Args:
         question (CSVQuestion): The new question to add.
+        allow_near_duplicates (bool): Whether to add the question even if it has near duplicates.
         username (str): The username of the authenticated admin user.
 
     Returns:
         CSVQuestion: The added question.
 
     Raises:
-        HTTPException: If there is an error in adding the question.
+        HTTPException: 409 with the similar questions if the question has near duplicates,
+        400 if there is another error in adding the question.
     """
     try:
-        create_question(question)
+        await create_question_async(question, allow_near_duplicates)
         return question
+    except NearDuplicateError as e:
+        duplicates = [duplicate.model_dump() for duplicate in to_near_duplicates(e.duplicates)]
+        raise HTTPException(status_code=409, detail={"message": str(e), "near_duplicates": duplicates})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/near-duplicates", response_model=List[NearDuplicate], tags=["Questions, Authentication"])
+async def get_near_duplicates(
+        question: str,
+        subject: str,
+        username: str = Depends(authenticate_admin)
+    ):
+    """
+    Lists the stored questions of a subject that are nearly identical to a question text,
+    e.g. reworded or punctuated differently, to check for duplicates before adding it.
+
+    Args:
+        question (str): The question text to check.
+        subject (str): The subject of the question.
+        username (str): The username of the authenticated admin user.
+
+    Returns:
+        List[NearDuplicate]: The similar questions with their similarity, most similar first.
+    """
+    return await find_near_duplicates_async(QuestionKey(question=question, subject=subject))
+
+@router.post("/import", response_model=BulkImportResult, tags=["Questions, Authentication"])
+async def import_questions(
+        request: Request,
+        skip_invalid: bool = Query(False, description="Import the valid rows even if some rows are invalid"),
+        username: str = Depends(authenticate_admin)
+    ):
+    """
+    Imports questions in bulk from a CSV (text/csv) or NDJSON (application/x-ndjson) request body.
+
+    Args:
+        request (Request): The request, whose body is the uploaded file.
+        skip_invalid (bool): Whether to import the valid rows when some rows are invalid.
+        username (str): The username of the authenticated admin user.
+
+    Returns:
+        BulkImportResult: The number of imported questions and the errors of the rejected rows.
+
+    Raises:
+        HTTPException: 415 if the media type is not supported, 400 if the file cannot be parsed
+        or if some rows are invalid and `skip_invalid` is not set; nothing is imported then.
+    """
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type not in CSV_MEDIA_TYPES + NDJSON_MEDIA_TYPES:
+        raise HTTPException(status_code=415, detail="Unsupported media type, send text/csv or application/x-ndjson")
+    try:
+        result = await import_questions_async(await request.body(), media_type, skip_invalid)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result.errors and not skip_invalid:
+        raise HTTPException(status_code=400, detail=result.model_dump())
+    return result
+
+@router.delete("/", tags=["Questions, Authentication"])
+async def remove_questions(
+        questions: List[QuestionKey],
+        username: str = Depends(authenticate_admin)
+    ):
+    """
+    Deletes questions identified by their question text and subject.
+
+    Args:
+        questions (List[QuestionKey]): The questions to delete.
+        username (str): The username of the authenticated admin user.
+
+    Returns:
+        dict: The number of deleted questions.
+
+    Raises:
+        HTTPException: If one of the questions does not exist; nothing is deleted then.
+    """
+    try:
+        return {"deleted": await delete_questions_async(questions)}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
 @router.get("/subjects/", response_model=List[str], tags=["Questions"])
-def get_unique_subjects():
+async def get_unique_subjects(request: Request):
     """
     Fetches unique subjects.
 
     Returns:
         List[str]: A list of unique subjects.
     """
-    return get_subjects()
+    return json_response(request, await get_subjects_json_async())
 
 @router.get("/uses/", response_model=List[str], tags=["Questions"])
-def get_unique_uses():
+async def get_unique_uses(request: Request):
     """
     Fetches unique uses.
 
     Returns:
         List[str]: A list of unique uses.
     """
-    return get_uses()
+    return json_response(request, await get_uses_json_async())
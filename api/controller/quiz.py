@@ -0,0 +1,71 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from controller.question import authenticate_user
+from models import QuizQuestions, QuizSessionInfo, QuizSessionRequest
+from service.quiz import end_session, next_questions_async, start_session_async
+
+router = APIRouter()
+
+
+@router.post("/sessions", status_code=201, response_model=QuizSessionInfo, tags=["Quiz"])
+async def create_session(
+        criteria: QuizSessionRequest,
+        username: str = Depends(authenticate_user)
+    ):
+    """
+    Starts a quiz session over the questions matching a use and subjects. The session hands
+    out its questions in a random order, without ever repeating one.
+
+    Args:
+        criteria (QuizSessionRequest): The use, the subjects and an optional seed of the shuffle.
+        username (str): The username of the authenticated user.
+
+    Returns:
+        QuizSessionInfo: The session id and the number of questions it can hand out.
+
+    Raises:
+        HTTPException: If the use or a subject is unknown.
+    """
+    try:
+        return await start_session_async(username, criteria.use, criteria.subjects, criteria.seed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/sessions/{session_id}/next", response_model=QuizQuestions, tags=["Quiz"])
+async def get_next_questions(
+        session_id: str,
+        num_questions: int = Query(5, gt=0, le=20),
+        username: str = Depends(authenticate_user)
+    ):
+    """
+    Hands out the next questions of a quiz session.
+
+    Args:
+        session_id (str): The id returned when the session was started.
+        num_questions (int): Number of questions to fetch; fewer are returned once the session runs out.
+        username (str): The username of the authenticated user.
+
+    Returns:
+        QuizQuestions: The questions and how many the session has left.
+
+    Raises:
+        HTTPException: If the user has no such session, or it expired.
+    """
+    questions = await next_questions_async(username, session_id, num_questions)
+    if questions is None:
+        raise HTTPException(status_code=404, detail="Quiz session not found")
+    return questions
+
+@router.delete("/sessions/{session_id}", status_code=204, tags=["Quiz"])
+async def delete_session(
+        session_id: str,
+        username: str = Depends(authenticate_user)
+    ):
+    """
+    Ends a quiz session.
+
+    Raises:
+        HTTPException: If the user has no such session, or it expired.
+    """
+    if not end_session(username, session_id):
+        raise HTTPException(status_code=404, detail="Quiz session not found")
+    return Response(status_code=204)
@@ -1,22 +1,108 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import tempfile
+import numpy as np
 import pandas as pd
-from typing import List
-from models import CSVQuestion
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from models import CSVQuestion, ImportReport, RowError
+from question_index import QuestionIndex, allocate_quotas, sample_labels, sample_quota_labels
+from metrics import stage
+from question_store import QuestionColumns, question_rows
+from response_cache import encode_json
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet exports are only offered when pyarrow is installed
+    pyarrow = None
 
-def load_csv(url: str,  destination: str):
+# Shared generator for unseeded draws; numpy generators are safe to share between threads
+_rng = np.random.default_rng()
+
+
+# Nombre de lignes lues à la fois en mode streaming
+IMPORT_CHUNK_SIZE = 10_000
+
+def clean_questions(df: pd.DataFrame, report: Optional[ImportReport] = None) -> pd.DataFrame:
+    """
+    Corrige les erreurs de typographie et retire les questions sans réponse correcte.
+    Les règles sont appliquées avec un seul filtrage, sans copie intermédiaire.
+
+    Args:
+        df (pd.DataFrame): Les questions telles que téléchargées (ou un bloc de celles-ci).
+        report (Optional[ImportReport]): Le rapport où compter les lignes acceptées, corrigées et rejetées.
+
+    Returns:
+        pd.DataFrame: Les questions nettoyées, sans NaN.
+    """
+    if report is None:
+        report = ImportReport()
+    typos = df['subject'] == 'Sytèmes distribués'
+    df.loc[typos, 'subject'] = 'Systèmes distribués'  # Correction des erreurs de typographie
+    missing = df['correct'].isna()  # Lignes où 'correct' est NaN
+    empty = ~missing & (df['correct'] == "")  # Lignes où 'correct' est une chaîne de charactèr vide
+    kept = ~(missing | empty)
+
+    report.read += len(df)
+    report.correct('subject_typo', int((typos & kept).sum()))
+    report.reject('missing_correct', int(missing.sum()))
+    report.reject('empty_correct', int(empty.sum()))
+    report.accepted += int(kept.sum())
+    return df[kept].fillna('')  # Remplacer les NaN par des chaînes vides
+
+def stream_questions(url: str, report: ImportReport, chunksize: int = IMPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Lit la source par blocs de `chunksize` lignes et nettoie chaque bloc, de sorte que la
+    mémoire utilisée ne dépend pas de la taille du fichier.
+
+    Args:
+        url (str): L'URL ou le chemin de la source.
+        report (ImportReport): Le rapport complété au fil des blocs.
+        chunksize (int): Le nombre de lignes par bloc.
+
+    Yields:
+        pd.DataFrame: Les blocs nettoyés.
+    """
+    with pd.read_csv(url, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield clean_questions(chunk, report)
+
+def load_csv(url: str,  destination: str, chunksize: Optional[int] = None) -> ImportReport:
     """
     Charge les données à partir de l'URL spécifiée et les enregistre dans le fichier de destination.
+    Avec `chunksize`, la source est traitée et écrite bloc par bloc.
     
     Args:
         url (str): L'URL à partir de laquelle charger les données.
         destination (str): Le chemin du fichier de destination.
+        chunksize (Optional[int]): Le nombre de lignes par bloc, ou None pour tout charger en une fois.
+
+    Returns:
+        ImportReport: Les lignes acceptées, corrigées et rejetées par règle.
+    """
+    report = ImportReport()
+    if chunksize is None:
+        compact_csv(clean_questions(pd.read_csv(url), report), destination)
+    else:
+        write_csv_chunks(stream_questions(url, report, chunksize), destination)
+    return report
+
+def replace_csv(df: pd.DataFrame, destination: str):
     """
-    df = pd.read_csv(url)
-    df['subject'] = df['subject'].replace({'Sytèmes distribués': 'Systèmes distribués'}) # Correction des erreurs de typographie
-    df = df.dropna(subset=['correct'])  # Retire les lignes où 'correct' est NaN
-    df = df[df['correct'] != ""]  # Retire les lignes où 'correct' est une chaîne de charactèr vide
-    df = df.fillna('')  # Remplacer les NaN par des chaînes vides
-    df.to_csv(destination, index=False)
+    Replaces the destination file with the DataFrame and drops its deletion log,
+    whose positions refer to the previous file.
+
+    Args:
+        df (pd.DataFrame): The DataFrame containing the questions.
+        destination (str): The path to the destination file.
+    """
+    compact_csv(df, destination)
+    log_path = deletion_log_path(destination)
+    if os.path.exists(log_path):
+        os.remove(log_path)
 
 
 def verify_question_subject_and_subject_existence(question: CSVQuestion, df: pd.DataFrame) -> bool:
@@ -90,8 +176,7 @@ def convert_df_to_CSVQuestion_List(df: pd.DataFrame):
     Returns:
         List[CSVQuestion]: A list of CSVQuestion objects.
     """
-    df=df.fillna('')
-    df['remark'] = df['remark'].fillna('')
+    df=df.astype(object).fillna('')
 
     df_list = [CSVQuestion(**row) for row in df.to_dict(orient='records')]
     return df_list
@@ -108,7 +193,128 @@ def convert_CSVQuestion_List_to_dict_list(df_list: List[CSVQuestion]):
     """
     return [q.model_dump() for q in df_list]
 
-def get_questions(use: str, subjects: List[str], num_questions: int, df: pd.DataFrame) -> List[CSVQuestion]:
+def subject_quotas(subjects: List[str], num_questions: int, weights: Optional[List[float]] = None) -> Dict[str, int]:
+    """
+    Splits `num_questions` across the distinct subjects, equally or in proportion to `weights`.
+
+    Args:
+        subjects (List[str]): The requested subjects; the weights of a repeated subject add up.
+        num_questions (int): The number of questions to split.
+        weights (Optional[List[float]]): One non-negative weight per subject, equal weights if not provided.
+
+    Raises:
+        ValueError: If the weights do not match the subjects or are not valid.
+
+    Returns:
+        Dict[str, int]: The number of questions to draw per subject.
+    """
+    if weights is None:
+        weights = [1.0] * len(subjects)
+    if len(weights) != len(subjects):
+        raise ValueError("Expected one weight per subject, got {weights} weights for {subjects} subjects".format(weights=len(weights), subjects=len(subjects)))
+    if not all(np.isfinite(weight) and weight >= 0 for weight in weights) or not sum(weights):
+        raise ValueError("Subject weights must be non-negative numbers, not all zero")
+    shares: Dict[str, float] = {}
+    for subject, weight in zip(subjects, weights):
+        shares[subject] = shares.get(subject, 0.0) + weight
+    return dict(zip(shares, allocate_quotas(num_questions, list(shares.values()))))
+
+def check_quotas(quotas: Dict[str, int], available: Dict[str, int]):
+    """
+    Fails fast when a subject has fewer questions than its quota, reporting every subject.
+
+    Raises:
+        ValueError: If a quota cannot be met.
+    """
+    if any(available.get(subject, 0) < quota for subject, quota in quotas.items()):
+        raise ValueError("Not enough questions available for the specified criteria. Questions available per subject: {available}, requested per subject: {quotas}".format(
+            available={subject: available.get(subject, 0) for subject in quotas}, quotas=quotas))
+
+def check_criteria(use: Optional[str], subjects: Optional[List[str]], index: QuestionIndex):
+    """
+    Checks that the use and every subject exist in the index; a None filter is not checked.
+
+    Raises:
+        ValueError: If the use or a subject is unknown.
+    """
+    if use is not None and not index.has_use(use):
+        raise ValueError("The use you provide is not available. Availables Uses are: {uses}".format(uses=list(index.uses)))
+    if subjects is not None and not index.has_subjects(subjects):
+        raise ValueError("The subjects you provide are not available. Availables Subjects are: {subjects}".format(subjects=list(index.subjects)))
+
+def question_candidates(use: str, subjects: List[str], index: QuestionIndex) -> List[np.ndarray]:
+    """
+    Validates the criteria and returns the read-only label buckets of the matching questions.
+
+    Raises:
+        ValueError: If the use or a subject is unknown.
+    """
+    check_criteria(use, subjects, index)
+    return index.candidates(use, subjects)
+
+def check_available(candidates: List[np.ndarray], num_questions: int):
+    """
+    Checks that the candidate buckets hold at least `num_questions` questions.
+
+    Raises:
+        ValueError: If the candidate buckets hold fewer than `num_questions` questions.
+    """
+    available = sum(len(bucket) for bucket in candidates)
+    if available < num_questions:
+        raise ValueError("Not enough questions available for the specified criteria. Number of questions available: {questions}".format(questions=available))
+
+def _seeded(seed: Optional[int]) -> np.random.Generator:
+    return np.random.default_rng(seed) if seed is not None else _rng
+
+def sample_question_labels(use: str, subjects: List[str], num_questions: int, index: QuestionIndex, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> np.ndarray:
+    """
+    Validates the criteria against the index and draws the row labels of `num_questions` matching questions.
+
+    Without `weights` the questions are drawn uniformly from the union of the subjects. With
+    `weights` (one per subject, equal weights for an even split) each subject gets its quota
+    of `num_questions`, drawn from its own (use, subject) bucket.
+
+    Args:
+        use (str): The 'use' value to filter questions.
+        subjects (List[str]): The list of subjects to filter questions.
+        num_questions (int): The number of questions to draw.
+        index (QuestionIndex): The (use, subject) index of the DataFrame.
+        seed (Optional[int]): Seed of the random draw; the same seed on the same data gives the same labels.
+        weights (Optional[List[float]]): Relative share of each subject, for a balanced draw.
+
+    Raises:
+        ValueError: If the use or a subject is unknown, if the weights are not valid or if there are not enough questions.
+
+    Returns:
+        np.ndarray: The drawn row labels, in draw order.
+    """
+    with stage("validate"):
+        check_criteria(use, subjects, index)
+        if weights is not None:
+            quotas = subject_quotas(subjects, num_questions, weights)
+            buckets = [index.buckets.get((use, subject)) for subject in quotas]
+            check_quotas(quotas, {subject: len(bucket) if bucket is not None else 0 for subject, bucket in zip(quotas, buckets)})
+        else:
+            candidates = index.candidates(use, subjects)
+            check_available(candidates, num_questions)
+
+    with stage("sample"):
+        if weights is not None:
+            return sample_quota_labels(buckets, list(quotas.values()), _seeded(seed))
+        return sample_labels(candidates, num_questions, _seeded(seed))
+
+def draw_question_labels(candidates: List[np.ndarray], num_questions: int, seed: Optional[int] = None) -> np.ndarray:
+    """
+    Draws `num_questions` labels from candidates that were already resolved for a use and
+    subjects, exactly like the uniform draw of `sample_question_labels` with the same seed.
+
+    Raises:
+        ValueError: If there are not enough questions.
+    """
+    check_available(candidates, num_questions)
+    return sample_labels(candidates, num_questions, _seeded(seed))
+
+def get_questions(use: str, subjects: List[str], num_questions: int, df: pd.DataFrame, index: Optional[QuestionIndex] = None, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> List[CSVQuestion]:
     """
     Retrieves a specified number of questions based on 'use' and subjects from the DataFrame.
 
@@ -117,59 +323,480 @@ def get_questions(use: str, subjects: List[str], num_questions: int, df: pd.Data
         subjects (List[str]): The list of subjects to filter questions.
         num_questions (int): The number of questions to retrieve.
         df (pd.DataFrame): The DataFrame containing the questions.
+        index (Optional[QuestionIndex]): The (use, subject) index of the DataFrame, built on the fly if not provided.
+        seed (Optional[int]): Seed of the random draw; the same seed on the same data gives the same questions.
+        weights (Optional[List[float]]): Relative share of each subject, for a balanced draw (see `sample_question_labels`).
 
     Returns:
         List[CSVQuestion]: A list of CSVQuestion objects.
     """
-    if not verify_use_existence(use, df):
-        raise ValueError("The use you provide is not available. Availables Uses are: {uses}".format(uses=df['use'].unique()))
-    if not verify_subject_existence(subjects, df):
-        raise ValueError("The subjects you provide are not available. Availables Subjects are: {subjects}".format(subjects=df['subject'].unique()))
-    
-    filtered_questions = df[(df['use'] == use) & (df['subject'].isin(subjects))]
-    if len(filtered_questions) < num_questions:
-        raise ValueError("Not enough questions available for the specified criteria. Number of questions available: {questions}".format(questions=len(filtered_questions)))
-    
-    filtered_questions = filtered_questions.sample(n=num_questions)
-    filtered_questions_list = convert_df_to_CSVQuestion_List(filtered_questions)
-    return filtered_questions_list
+    if index is None:
+        index = QuestionIndex.from_dataframe(df)
+
+    # Only the drawn rows are read, straight from the columns, and turned into models
+    labels = sample_question_labels(use, subjects, num_questions, index, seed, weights)
+    with stage("build"):
+        return [row.to_model() for row in question_rows(df, labels)]
+
+def get_question_rows(labels: List[int], df: pd.DataFrame) -> List[dict]:
+    """
+    Reads rows as plain dicts with the CSVQuestion fields, without building the models.
+
+    Args:
+        labels (List[int]): The row labels to read.
+        df (pd.DataFrame): The DataFrame containing the questions.
+
+    Returns:
+        List[dict]: One dict per label, in the order of `labels`.
+    """
+    return [row.to_dict() for row in question_rows(df, labels)]
+
+# Nombre de questions lues à la fois par un export
+EXPORT_CHUNK_SIZE = 5_000
+
+def listing_buckets(use: Optional[str], subjects: Optional[List[str]], index: QuestionIndex) -> List[np.ndarray]:
+    """
+    Validates the optional filters and returns the read-only label buckets of the matching questions.
+
+    Raises:
+        ValueError: If the use or a subject is unknown.
+    """
+    check_criteria(use, subjects, index)
+    subjects = set(subjects) if subjects is not None else None
+    # A copy of the items, since a writer may add a bucket meanwhile
+    return [bucket for (bucket_use, subject), bucket in list(index.buckets.items())
+            if (use is None or bucket_use == use) and (subjects is None or subject in subjects)]
+
+def labels_after(buckets: List[np.ndarray], after: int, limit: int) -> np.ndarray:
+    """
+    Returns the `limit` smallest labels greater than `after` from sorted label buckets.
+    Each bucket is cut by binary search, so the cost depends on `limit`, not on the bucket sizes.
+    """
+    parts = [bucket[np.searchsorted(bucket, after, side='right'):][:limit] for bucket in buckets]
+    if not parts:
+        return np.empty(0, dtype=np.int64)
+    return np.sort(np.concatenate(parts))[:limit]
+
+def row_anchor(question: str, subject: str) -> str:
+    """
+    Returns a short digest of a question key, kept in listing cursors to recognize the last
+    row listed even if the ids were renumbered since.
+    """
+    return hashlib.blake2b("{question}\0{subject}".format(question=question, subject=subject).encode('utf-8'), digest_size=8).hexdigest()
+
+def check_anchor(label: int, anchor: str, df: pd.DataFrame):
+    """
+    Checks that the row at `label` is still the one a cursor was made from. A compaction
+    renumbers the rows, and a listing resumed from a renumbered label would skip or repeat rows.
+
+    Raises:
+        ValueError: If the row at `label` is another question.
+    """
+    if label not in df.index or row_anchor(df.at[label, 'question'], df.at[label, 'subject']) != anchor:
+        raise ValueError("The cursor is no longer valid since the questions were reorganized, restart the listing without a cursor")
+
+def encode_cursor(after: int, anchor: str) -> str:
+    """
+    Encodes the position of a listing after the row of id `after` as an opaque cursor.
+    """
+    return base64.urlsafe_b64encode("{after}:{anchor}".format(after=after, anchor=anchor).encode('ascii')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """
+    Decodes a cursor made by `encode_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        after, anchor = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii').split(':')
+        return int(after), anchor
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid cursor: {cursor}".format(cursor=cursor))
+
+# Media types accepted by `parse_questions`
+CSV_MEDIA_TYPES = ('text/csv', 'application/csv')
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+REQUIRED_FIELDS = [name for name, field in CSVQuestion.model_fields.items() if field.is_required()]
+# Media types of the formats produced by `encode_export`
+EXPORT_MEDIA_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+def _as_text(column: pd.Series) -> pd.Series:
+    if pd.api.types.infer_dtype(column, skipna=True) in ('string', 'empty'):
+        return column
+    return column.astype(str).where(column.notna())
+
+def parse_questions(body: bytes, media_type: str) -> pd.DataFrame:
+    """
+    Parses an uploaded CSV or NDJSON file of questions into a DataFrame with the CSVQuestion columns.
+    Every value is read as a string; missing values are left as NaN so that validation can
+    report them per row.
+
+    Args:
+        body (bytes): The uploaded file.
+        media_type (str): Its media type, one of CSV_MEDIA_TYPES or NDJSON_MEDIA_TYPES.
+
+    Raises:
+        ValueError: If the file cannot be parsed or lacks a required column.
+
+    Returns:
+        pd.DataFrame: One row per uploaded question.
+    """
+    fields = list(CSVQuestion.model_fields)
+    if not body.strip():
+        return pd.DataFrame(columns=fields)
+    try:
+        if media_type in CSV_MEDIA_TYPES:
+            batch = pd.read_csv(io.BytesIO(body), dtype=str, keep_default_na=False, na_values=[])
+        elif media_type in NDJSON_MEDIA_TYPES:
+            batch = pd.read_json(io.BytesIO(body), lines=True, dtype=False, convert_dates=False)
+            # Values of other JSON types are read as text, as they would be from a CSV file
+            batch = batch.apply(_as_text)
+        else:
+            raise ValueError("Unsupported media type: {media_type}".format(media_type=media_type))
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise ValueError("The uploaded file cannot be parsed: {error}".format(error=e))
+    missing = [field for field in REQUIRED_FIELDS if field not in batch.columns]
+    if missing:
+        raise ValueError("Missing columns: {columns}".format(columns=missing))
+    batch = batch.reindex(columns=fields).reset_index(drop=True)
+    optional = [field for field in fields if field not in REQUIRED_FIELDS]
+    batch[optional] = batch[optional].fillna('')
+    return batch
+
+def _csv_export(chunks: Iterable[List[dict]]) -> Iterator[bytes]:
+    fields = list(CSVQuestion.model_fields)
+    header = True
+    for rows in chunks:
+        yield pd.DataFrame(rows, columns=fields).to_csv(index=False, header=header).encode('utf-8')
+        header = False
+    if header:
+        yield pd.DataFrame(columns=fields).to_csv(index=False).encode('utf-8')
+
+def _ndjson_export(chunks: Iterable[List[dict]]) -> Iterator[bytes]:
+    for rows in chunks:
+        yield b''.join(encode_json(row) + b'\n' for row in rows)
+
+
+class _ParquetSink(io.RawIOBase):
+    # Write-only file collecting what the Parquet writer produced since the last drain
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _parquet_export(chunks: Iterable[List[dict]]) -> Iterator[bytes]:
+    schema = pyarrow.schema([(field, pyarrow.string()) for field in CSVQuestion.model_fields])
+    sink = _ParquetSink()
+    # One row group per chunk, sent as soon as it is written
+    with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+        for rows in chunks:
+            writer.write_table(pyarrow.Table.from_pylist(rows, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+def encode_export(chunks: Iterable[List[dict]], format: str) -> Iterator[bytes]:
+    """
+    Encodes chunks of question rows into a file of the given format, a chunk at a time,
+    so that an export is sent as it is read and never held in memory at once.
+
+    Args:
+        chunks (Iterable[List[dict]]): The rows, as plain dicts of the CSVQuestion fields.
+        format (str): One of EXPORT_MEDIA_TYPES.
+
+    Raises:
+        ValueError: If the format is unknown, or is Parquet without pyarrow installed.
+
+    Returns:
+        Iterator[bytes]: The successive parts of the file.
+    """
+    if format == 'csv':
+        return _csv_export(chunks)
+    if format == 'ndjson':
+        return _ndjson_export(chunks)
+    if format == 'parquet':
+        if pyarrow is None:
+            raise ValueError("Parquet exports need the pyarrow package, which is not installed")
+        return _parquet_export(chunks)
+    raise ValueError("Unknown export format: {format}".format(format=format))
+
+def _text_mask(column: pd.Series) -> np.ndarray:
+    # Cells are only looked at one by one in object columns that do not hold only strings
+    if column.dtype != object:
+        return column.isna().to_numpy()
+    if pd.api.types.infer_dtype(column, skipna=True) in ('string', 'empty'):
+        return np.ones(len(column), dtype=bool)
+    return column.isna().to_numpy() | (column.map(type) == str).to_numpy()
+
+def validate_questions(batch: pd.DataFrame, exists: Callable[[List[Tuple[str, str]]], np.ndarray]) -> Tuple[np.ndarray, List[RowError]]:
+    """
+    Validates a batch of questions with one vectorized check per rule.
+
+    Args:
+        batch (pd.DataFrame): The questions, as returned by `parse_questions`.
+        exists (Callable): Tells, for a list of (question, subject) keys, which ones are already stored.
+
+    Returns:
+        Tuple[np.ndarray, List[RowError]]: The mask of valid rows and the errors of the invalid ones.
+    """
+    rules = []
+    for field in REQUIRED_FIELDS:
+        rules.append((batch[field].isna().to_numpy(), "Field required: {field}".format(field=field)))
+    non_string = ~np.logical_and.reduce([_text_mask(batch[field]) for field in batch.columns])
+    rules.append((non_string, "Fields must be strings"))
+    keyed = ~(batch['question'].isna() | batch['subject'].isna()).to_numpy()
+    rules.append(((batch['correct'] == "").to_numpy(), "Question correct answer can't be empty"))
+    rules.append((keyed & batch.duplicated(['question', 'subject']).to_numpy(), "Question is repeated in the upload"))
+
+    # Hash join of the batch keys against the stored keys
+    positions = np.flatnonzero(keyed)
+    stored = np.zeros(len(batch), dtype=bool)
+    if len(positions):
+        keys = list(zip(batch['question'].to_numpy()[positions], batch['subject'].to_numpy()[positions]))
+        stored[positions] = exists(keys)
+    rules.append((stored, "Question already exists"))
+
+    invalid = np.logical_or.reduce([mask for mask, _ in rules]) if len(batch) else np.zeros(0, dtype=bool)
+    errors = []
+    for position in np.flatnonzero(invalid):
+        question, subject = batch.at[position, 'question'], batch.at[position, 'subject']
+        errors.append(RowError(
+            row=int(position) + 1,
+            question=question if isinstance(question, str) else None,
+            subject=subject if isinstance(subject, str) else None,
+            errors=[message for mask, message in rules if mask[position]],
+        ))
+    return ~invalid, errors
+
+def _question_exists(question: CSVQuestion, df: pd.DataFrame, index: Optional[QuestionIndex]) -> bool:
+    if index is not None:
+        return index.find(question.question, question.subject) is not None
+    return verify_question_subject_and_subject_existence(question, df)
+
+def append_csv(rows: pd.DataFrame, destination: str):
+    """
+    Appends rows to the destination file in a single write followed by one fsync.
+    The header is written too if the file does not exist yet.
+
+    Args:
+        rows (pd.DataFrame): The rows to append, with the same columns as the destination file.
+        destination (str): The path to the destination file.
+    """
+    is_new_file = not os.path.exists(destination)
+    data = rows.to_csv(index=False, header=is_new_file)
+    with open(destination, 'wb' if is_new_file else 'rb+') as file:
+        # Make sure the first appended row does not end up on the last line of the file
+        file.seek(0, os.SEEK_END)
+        if file.tell() > 0:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                data = '\n' + data
+        file.write(data.encode('utf-8'))
+        file.flush()
+        os.fsync(file.fileno())
+
+def write_csv_chunks(chunks: Iterable[pd.DataFrame], destination: str):
+    """
+    Writes DataFrames one after the other to the destination file, replacing it atomically: the
+    data is written to a temporary file in the same directory which then replaces the destination,
+    so readers see either the old or the new file, never a partial one.
 
-def add_question(question: CSVQuestion, df: pd.DataFrame, destination: str):
+    Args:
+        chunks (Iterable[pd.DataFrame]): The DataFrames to write, which share the same columns.
+        destination (str): The path to the destination file.
+    """
+    directory, name = os.path.split(os.path.abspath(destination))
+    fd, temporary = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as file:
+            for position, chunk in enumerate(chunks):
+                chunk.to_csv(file, index=False, header=position == 0)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, destination)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+def compact_csv(df: pd.DataFrame, destination: str):
     """
-    Adds a new question to the DataFrame and saves it to the destination file.
+    Rewrites the destination file from the DataFrame, replacing it atomically.
+
+    Args:
+        df (pd.DataFrame): The DataFrame containing the questions.
+        destination (str): The path to the destination file.
+    """
+    write_csv_chunks([df], destination)
+
+def _write_new_rows(df: pd.DataFrame, new_rows: pd.DataFrame, destination: str):
+    if os.path.exists(destination):
+        append_csv(new_rows, destination)
+    else:
+        compact_csv(pd.concat([df, new_rows]), destination)
+
+def _next_label(df: pd.DataFrame) -> int:
+    # New questions get fresh labels so the existing labels stay valid for the index
+    return int(df.index.max()) + 1 if len(df) else 0
+
+def add_question(question: CSVQuestion, df: pd.DataFrame, destination: str, index: Optional[QuestionIndex] = None, columns: Optional[QuestionColumns] = None) -> pd.DataFrame:
+    """
+    Appends a new question to the destination file and returns a new DataFrame including it.
+    The DataFrame passed in is left unchanged.
 
     Args:
         question (CSVQuestion): The question to add.
         df (pd.DataFrame): The DataFrame containing the questions.
         destination (str): The path to the destination file.
+        index (Optional[QuestionIndex]): The index of the DataFrame, updated with the new row.
+        columns (Optional[QuestionColumns]): The buffers `df` was published from; the row is
+            written past their end instead of copying the DataFrame.
+
+    Returns:
+        pd.DataFrame: The DataFrame with the new question.
         
     Raises:
         ValueError: If the question already exists in the DataFrame or if the correct answer is empty.
     """
-    if verify_question_subject_and_subject_existence(question, df):
+    if _question_exists(question, df, index):
          raise ValueError("Question already exists")
     
     if verify_question_correct_existence(question, df):
          raise ValueError("Question correct answer can't be empty")
     
-    # Convert the new question to a dictionary and add it to the DataFrame
-    new_row = pd.DataFrame([question.model_dump()])
-    df = pd.concat([df, new_row], ignore_index=True)
-    df.to_csv(destination, index=False)
+    return _append_questions([question], df, destination, index, columns)
+
+def add_questions(questions: List[CSVQuestion], df: pd.DataFrame, destination: str, index: Optional[QuestionIndex] = None, columns: Optional[QuestionColumns] = None) -> pd.DataFrame:
+    """
+    Adds several questions and appends them to the destination file in one write.
+    Either all the questions are added or none of them.
 
-# TODO: should be tested
-def remove_question(question: CSVQuestion, df: pd.DataFrame, destination: str):
+    Args:
+        questions (List[CSVQuestion]): The questions to add.
+        df (pd.DataFrame): The DataFrame containing the questions.
+        destination (str): The path to the destination file.
+        index (Optional[QuestionIndex]): The index of the DataFrame, updated with the new rows.
+        columns (Optional[QuestionColumns]): The buffers `df` was published from, see `add_question`.
+
+    Returns:
+        pd.DataFrame: A new DataFrame containing the added questions.
+
+    Raises:
+        ValueError: If a question already exists, is repeated in the batch or has an empty correct answer.
+    """
+    seen = set()
+    for question in questions:
+        key = (question.question, question.subject)
+        if key in seen or _question_exists(question, df, index):
+            raise ValueError("Question already exists: {question}".format(question=question.question))
+        if verify_question_correct_existence(question, df):
+            raise ValueError("Question correct answer can't be empty: {question}".format(question=question.question))
+        seen.add(key)
+
+    if not questions:
+        return df
+    return _append_questions(questions, df, destination, index, columns)
+
+def _append_questions(questions: List[CSVQuestion], df: pd.DataFrame, destination: str, index: Optional[QuestionIndex], columns: Optional[QuestionColumns]) -> pd.DataFrame:
+    first_label = _next_label(df)
+    labels = list(range(first_label, first_label + len(questions)))
+    rows = [question.model_dump() for question in questions]
+    new_rows = pd.DataFrame(rows, index=labels, columns=df.columns)
+    # The file is written first, so a failed write leaves the DataFrame and index untouched
+    _write_new_rows(df, new_rows, destination)
+    if columns is not None:
+        # Buffers publish frames labelled by position
+        df = columns.append(rows, len(df))
+    else:
+        df = pd.concat([df, new_rows])
+    if index is not None:
+        for label, question in zip(labels, questions):
+            index.add(label, question.question, question.subject, question.use)
+    return df
+
+def deletion_log_path(destination: str) -> str:
+    """
+    Returns the path of the deletion log kept next to the destination file.
     """
-    Deletes a question from the DataFrame and saves the updated DataFrame to the destination file.
+    return f"{destination}.deleted"
+
+def _find_labels(questions: List[CSVQuestion], index: QuestionIndex) -> List[int]:
+    labels = []
+    for question in questions:
+        label = index.find(question.question, question.subject)
+        if label is None or label in labels:
+            raise ValueError("Question does not exist: {question}".format(question=question.question))
+        labels.append(label)
+    return labels
+
+def remove_questions(questions: List[CSVQuestion], df: pd.DataFrame, destination: str, index: QuestionIndex) -> int:
+    """
+    Tombstones several questions: they are removed from the index, so `get_questions` stops
+    returning them immediately, and their positions are appended to the deletion log in one
+    write. The rows stay in the DataFrame and the destination file until `compact_csv` runs.
+    Either all the questions are removed or none of them.
+
+    Args:
+        questions (List[CSVQuestion]): The questions to delete.
+        df (pd.DataFrame): The DataFrame containing the questions.
+        destination (str): The path to the destination file.
+        index (QuestionIndex): The index of the DataFrame.
+
+    Returns:
+        int: The number of deleted questions.
+
+    Raises:
+        ValueError: If a question does not exist or is repeated in the batch.
+    """
+    labels = _find_labels(questions, index)
+    if not labels:
+        return 0
+
+    # Read by position: a label and column selection with .loc copies whole columns
+    rows = question_rows(df, labels)
+    log = pd.DataFrame({'position': labels, 'question': [row.question for row in rows], 'subject': [row.subject for row in rows]})
+    append_csv(log, deletion_log_path(destination))
+    for label, row in zip(labels, rows):
+        index.remove(label, row.question, row.subject, row.use)
+    return len(labels)
+
+def remove_question(question: CSVQuestion, df: pd.DataFrame, destination: str, index: Optional[QuestionIndex] = None):
+    """
+    Deletes a question. With an index the question is tombstoned (see `remove_questions`);
+    otherwise it is dropped from the DataFrame and the destination file is rewritten.
 
     Args:
         question (CSVQuestion): The question to delete.
         df (pd.DataFrame): The DataFrame containing the questions.
         destination (str): The path to the destination file.
+        index (Optional[QuestionIndex]): The index of the DataFrame, updated with the removal.
 
     Raises:
         ValueError: If the question does not exist in the DataFrame.
     """
+    if index is not None:
+        remove_questions([question], df, destination, index)
+        return True
+
     if not verify_question_subject_and_subject_existence(question, df):
         raise ValueError("Question does not exist")
 
@@ -180,7 +807,44 @@ def remove_question(question: CSVQuestion, df: pd.DataFrame, destination: str):
     df.drop(index_to_delete, inplace=True)
 
     # Save the updated DataFrame to the destination file
-    df.to_csv(destination, index=False)
+    compact_csv(df, destination)
     
     return True
 
+def apply_deletion_log(df: pd.DataFrame, destination: str, index: QuestionIndex):
+    """
+    Tombstones the rows listed in the deletion log of the destination file.
+    An entry is only applied if the row at its position still holds the same question,
+    so a log left over from a replaced file is ignored.
+
+    Args:
+        df (pd.DataFrame): The DataFrame loaded from the destination file.
+        destination (str): The path to the destination file.
+        index (QuestionIndex): The index of the DataFrame.
+    """
+    log_path = deletion_log_path(destination)
+    if not os.path.exists(log_path):
+        return
+    deleted = pd.read_csv(log_path, keep_default_na=False)
+    for position, question, subject in deleted[['position', 'question', 'subject']].itertuples(index=False):
+        if position in df.index and df.at[position, 'question'] == question and df.at[position, 'subject'] == subject:
+            index.remove(position, question, subject, df.at[position, 'use'])
+
+def compact_questions(df: pd.DataFrame, destination: str, index: QuestionIndex) -> pd.DataFrame:
+    """
+    Drops the tombstoned rows, rewrites the destination file atomically and clears the deletion log.
+
+    Args:
+        df (pd.DataFrame): The DataFrame containing the questions.
+        destination (str): The path to the destination file.
+        index (QuestionIndex): The index of the DataFrame.
+
+    Returns:
+        pd.DataFrame: The compacted DataFrame, relabelled from 0 so labels match file positions again.
+    """
+    df = df.drop(index=list(index.tombstones)).reset_index(drop=True)
+    compact_csv(df, destination)
+    log_path = deletion_log_path(destination)
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    return df
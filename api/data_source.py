@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Callable, NamedTuple, Optional
+import requests
+
+
+class FetchedFile(NamedTuple):
+    path: str
+    changed: bool
+
+
+def _write_atomically(path: str, data: bytes):
+    directory, name = os.path.split(path)
+    fd, temporary = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+class CSVSource:
+    """
+    Local content-addressed cache of a remote CSV file.
+
+    Downloaded bodies are stored as `<sha256>.csv` in `cache_dir`, and `index.json` maps the
+    URL to the digest of its current body together with the ETag and Last-Modified
+    validators the server sent. `refresh` revalidates with a conditional request, so an
+    unchanged file costs a 304 and no download. The cached copy stays usable offline, and
+    a new body only replaces it once `refresh` accepted it.
+    """
+
+    def __init__(self, url: str, cache_dir: str, timeout: float = 10.0, session: Optional[requests.Session] = None):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.index_path = os.path.join(cache_dir, 'index.json')
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self.index_path, encoding='utf-8') as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _entry(self) -> Optional[dict]:
+        entry = self._read_index().get(self.url)
+        if entry is None or not os.path.isfile(self._blob_path(entry['sha256'])):
+            return None
+        return entry
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.csv")
+
+    def cached_path(self) -> Optional[str]:
+        """
+        Returns the path of the cached copy of the URL, or None if it was never downloaded.
+        """
+        entry = self._entry()
+        return self._blob_path(entry['sha256']) if entry else None
+
+    def refresh(self, on_change: Optional[Callable[[str], None]] = None) -> FetchedFile:
+        """
+        Revalidates the cached copy with the server and downloads the file only if it changed.
+
+        Args:
+            on_change (Optional[Callable]): Called with the path of a changed body before it
+                becomes the cached copy, e.g. to parse it; if it raises, the body is dropped
+                and the previous copy stays the cached one.
+
+        Raises:
+            requests.RequestException: If the server cannot be reached or answers with an error.
+
+        Returns:
+            FetchedFile: The path of the current copy and whether its content changed.
+        """
+        entry = self._entry()
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and entry is not None:
+            return FetchedFile(self._blob_path(entry['sha256']), False)
+        response.raise_for_status()
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        changed = entry is None or entry['sha256'] != digest
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if not os.path.isfile(self._blob_path(digest)):
+            _write_atomically(self._blob_path(digest), response.content)
+        if changed and on_change is not None:
+            try:
+                on_change(self._blob_path(digest))
+            except BaseException:
+                if digest not in {e['sha256'] for e in self._read_index().values()}:
+                    os.remove(self._blob_path(digest))
+                raise
+
+        index = self._read_index()
+        index[self.url] = {
+            'sha256': digest,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        _write_atomically(self.index_path, json.dumps(index, indent=2).encode())
+        if entry is not None and entry['sha256'] != digest and entry['sha256'] not in {e['sha256'] for e in index.values()}:
+            os.remove(self._blob_path(entry['sha256']))
+        return FetchedFile(self._blob_path(digest), changed)
@@ -0,0 +1,41 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+# Password hashing gets its own threads so a burst of logins cannot delay disk I/O, and neither
+# of them takes threads from Starlette's pool
+HASHING_WORKERS = int(os.environ.get("QCM_HASHING_WORKERS", "2"))
+IO_WORKERS = int(os.environ.get("QCM_IO_WORKERS", "4"))
+
+hashing_executor = ThreadPoolExecutor(max_workers=HASHING_WORKERS, thread_name_prefix="qcm-hashing")
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="qcm-io")
+
+
+async def run_in(executor: ThreadPoolExecutor, func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a blocking call on `executor` and waits for it without blocking the event loop.
+
+    Args:
+        executor (ThreadPoolExecutor): The executor to run the call on.
+        func (Callable): The blocking function.
+
+    Returns:
+        The result of `func(*args, **kwargs)`.
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+def queue_depth(executor: ThreadPoolExecutor) -> int:
+    """
+    Returns the number of calls submitted to `executor` that no thread picked up yet.
+    """
+    return executor._work_queue.qsize()
+
+async def run_hashing(func: Callable[..., T], *args, **kwargs) -> T:
+    return await run_in(hashing_executor, func, *args, **kwargs)
+
+async def run_io(func: Callable[..., T], *args, **kwargs) -> T:
+    return await run_in(io_executor, func, *args, **kwargs)
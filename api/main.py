@@ -1,16 +1,73 @@
+import asyncio
+import logging
 import os.path
-from fastapi import FastAPI, HTTPException
+import pandas as pd
+import requests
+import metrics
+from fastapi import FastAPI, HTTPException, Response
 from contextlib import asynccontextmanager
-from csv_management import load_csv
-from controller import auth, question
+from csv_management import clean_questions, replace_csv
+from models import ImportReport
+from controller import auth, question, quiz
+from data_source import CSVSource
+from executor import hashing_executor, io_executor, queue_depth, run_io
+from service.question import question_repository
+from repository.question import CSVQuestionRepository
+from repository.sqlite_question import SQLiteQuestionRepository, migrate_csv
+from service.auth import users_db
+
+logger = logging.getLogger(__name__)
 
 csv_url = "https://dst-de.s3.eu-west-3.amazonaws.com/fastapi_fr/questions.csv"
 path = 'data/data.csv'
+# Both copies of the questions are written from a single download
+destinations = [path, f"tests/{path}"]
+# Downloaded copies of csv_url, revalidated with the server at startup
+cache_dir = 'data/cache'
+
+def publish(csv_file: str):
+    """
+    Parses a downloaded questions file once and writes every destination from the same frame.
+    The file served by the question repository is replaced through the repository, so
+    concurrent writers are serialized with it and the new data is picked up right away.
+    """
+    report = ImportReport()
+    df = clean_questions(pd.read_csv(csv_file), report)
+    logger.info("Imported questions from %s: %s", csv_file, report)
+    for destination in destinations:
+        if isinstance(question_repository, CSVQuestionRepository) and os.path.abspath(destination) == os.path.abspath(question_repository.path):
+            question_repository.replace(df)
+        else:
+            replace_csv(df, destination)
+
+def refresh(source: CSVSource) -> bool:
+    """
+    Revalidates the cached questions with the server and publishes them if they changed.
+    A file that cannot be published is not cached, so the previous copy keeps being served.
+
+    Returns:
+        bool: False if the server could not be reached or sent a file that cannot be parsed, True otherwise.
+    """
+    try:
+        source.refresh(on_change=publish)
+    except requests.RequestException as e:
+        logger.warning("Could not refresh the questions from %s: %s", source.url, e)
+        return False
+    except (ValueError, KeyError) as e:
+        # pandas' parser errors are ValueErrors, a missing column is a KeyError
+        logger.warning("Could not publish the questions downloaded from %s: %s", source.url, e)
+        return False
+    return True
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Asynchronous context manager to load CSV data into the application during startup.
+    The questions and users are then parsed once into their in-memory repositories.
+
+    When a cached copy of the questions exists it is served immediately and revalidated
+    with the server in the background; otherwise the first download is awaited. If the
+    server is unreachable, the existing data files are served as they are.
 
     Parameters:
     - app (FastAPI): The FastAPI application instance.
@@ -22,9 +79,23 @@ async def lifespan(app: FastAPI):
     async with lifespan(app):
         # Load CSV data into the application
     """
-    load_csv(csv_url, path)
-    load_csv(csv_url, f"tests/{path}")
+    source = CSVSource(csv_url, cache_dir)
+    cached = source.cached_path()
+    refresh_task = None
+    if cached is not None:
+        await run_io(publish, cached)
+        refresh_task = asyncio.create_task(run_io(refresh, source))
+    elif not await run_io(refresh, source) and not os.path.isfile(path):
+        raise RuntimeError("No questions available: {url} could not be downloaded and {path} does not exist".format(url=csv_url, path=path))
+
+    question_repository.load()
+    if isinstance(question_repository, SQLiteQuestionRepository) and not len(question_repository):
+        migrate_csv(path, question_repository)
+    users_db.load()
+    app.state.refresh_task = refresh_task
     yield
+    if refresh_task is not None:
+        await refresh_task
 
 app = FastAPI(
                 lifespan=lifespan,
@@ -33,6 +104,10 @@ app = FastAPI(
                         'name': 'Questions',
                         'description': 'Operations related to questions in the QCM'
                     },
+                    {
+                        'name': 'Quiz',
+                        'description': 'Quiz sessions handing out questions without repeats'
+                    },
                     {
                         'name': 'Health',
                         'description': 'health check operations'
@@ -44,26 +119,73 @@ app = FastAPI(
                 ]
             )
 
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 prefix = "/api-v1"
 
+@app.get(f"{prefix}/healthcheck/live", tags=["Health"], summary="Liveness Endpoint", description="Check that the API process is up and its event loop responsive.")
+async def liveness_check():
+    """
+    Check that the API process is alive. Nothing is read, so it never fails while the event loop runs.
+
+    Returns:
+    - dict: {"status": "ok"}.
+    """
+    return {"status": "ok"}
+
+@app.get(f"{prefix}/healthcheck/ready", tags=["Health"], summary="Readiness Endpoint", description="Check that the questions are loaded and report the state of the data store.")
+async def readiness_check():
+    """
+    Check that the API can serve questions. Everything is answered from memory, without
+    touching the disk, so load balancers can probe it at high frequency.
+
+    Returns:
+    - dict: {"status": "ok"} together with the state of the question repository (generation,
+      row count, last reload as Unix time, load duration, writers holding or waiting for the
+      write lock) and the number of calls queued on the I/O and hashing executors.
+
+    Raises:
+    - HTTPException: If the questions are not loaded yet, raises a 503 error with the message "Service Unavailable".
+    """
+    stats = question_repository.stats()
+    if not stats["loaded"]:
+        raise HTTPException(status_code=503, detail="Service Unavailable")
+    refresh_task = getattr(app.state, "refresh_task", None)
+    return {
+        "status": "ok",
+        "questions": stats,
+        "refreshing": refresh_task is not None and not refresh_task.done(),
+        "queued": {"io": queue_depth(io_executor), "hashing": queue_depth(hashing_executor)},
+    }
+
 @app.get(f"{prefix}/healthcheck/", tags=["Health"], summary="Health Check Endpoint", description="Check the health status of the API.")
 async def health_check():
     """
-    Check the health status of the API.
+    Check the health status of the API, like the readiness endpoint.
 
     Returns:
-    - dict: A dictionary indicating the status of the API. If the data file exists, returns {"status": "ok"}; otherwise, raises a 503 error.
+    - dict: The readiness report, starting with {"status": "ok"}.
 
     Raises:
-    - HTTPException: If the data file is not available, raises a 503 error with the message "Service Unavailable".
+    - HTTPException: If the questions are not loaded yet, raises a 503 error with the message "Service Unavailable".
     """
-    if os.path.isfile(path):
-        return {"status": "ok"}
-    else:
-        raise HTTPException(status_code=503, detail="Service Unavailable")
+    return await readiness_check()
+
+@app.get(f"{prefix}/metrics", tags=["Health"], summary="Metrics Endpoint", description="Expose the request, stage latency, cache and reload metrics in the Prometheus text format.")
+async def get_metrics():
+    """
+    Exposes the metrics of this process in the Prometheus text format.
+
+    Returns:
+    - Response: Request counts by route and status, request and stage latency histograms,
+      cache lookups by result and dataset reloads. Empty when QCM_METRICS=0.
+    """
+    return Response(metrics.render() if metrics.ENABLED else "", media_type=metrics.CONTENT_TYPE)
 
 app.include_router(auth.router, prefix=f"{prefix}/auth")
 app.include_router(question.router, prefix=f"{prefix}/questions")
+app.include_router(quiz.router, prefix=f"{prefix}/quiz")
 
 if __name__ == "__main__":
     import uvicorn
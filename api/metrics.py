@@ -0,0 +1,192 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# Set QCM_METRICS=0 to turn every recording into a no-op
+ENABLED = os.environ.get("QCM_METRICS", "1") != "0"
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = ['{name}="{value}"'.format(name=name, value=_escape(str(value))) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return ["# HELP {name} {doc}".format(name=self.name, doc=self.documentation),
+                "# TYPE {name} {kind}".format(name=self.name, kind=self.kind)]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append("{name}{labels} {value}".format(name=self.name, labels=_format_labels(self.labelnames, key), value=value))
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: one count per bucket (not cumulative) plus +Inf, the sum and the count
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket in zip([*self.buckets, "+Inf"], counts):
+                cumulative += bucket
+                le = 'le="{bound}"'.format(bound=bound)
+                lines.append("{name}_bucket{labels} {value}".format(name=self.name, labels=_format_labels(self.labelnames, key, le), value=cumulative))
+            labels = _format_labels(self.labelnames, key)
+            lines.append("{name}_sum{labels} {value}".format(name=self.name, labels=labels, value=total))
+            lines.append("{name}_count{labels} {value}".format(name=self.name, labels=labels, value=count))
+        return lines
+
+
+REQUESTS = Counter("qcm_http_requests_total", "HTTP requests by route, method and status.", ["route", "method", "status"])
+REQUEST_LATENCY = Histogram("qcm_http_request_duration_seconds", "HTTP request latency by route.", ["route", "method"])
+STAGE_LATENCY = Histogram("qcm_stage_duration_seconds", "Latency of the internal stages of a request.", ["stage"])
+CACHE_REQUESTS = Counter("qcm_cache_requests_total", "Cache lookups by cache and result (hit or miss).", ["cache", "result"])
+RELOADS = Counter("qcm_dataset_reloads_total", "Loads of the questions file into memory.")
+
+_noop = nullcontext()
+
+def stage(name: str):
+    """
+    Times a stage of the request into `qcm_stage_duration_seconds`.
+
+    Usage:
+        with stage("sample"):
+            ...
+    """
+    if not ENABLED:
+        return _noop
+    return STAGE_LATENCY.time(stage=name)
+
+def cache_lookup(cache: str, hit: bool, count: int = 1):
+    if ENABLED and count:
+        CACHE_REQUESTS.inc(count, cache=cache, result="hit" if hit else "miss")
+
+def render() -> str:
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+def route_template(scope) -> str:
+    """
+    Returns the path of a routed request with its path parameters put back as `{name}`,
+    or "unmatched" for requests no route handled, so that unknown URLs add no new series.
+    """
+    if scope.get("route") is None:
+        return "unmatched"
+    path = scope["path"]
+    for name, value in scope.get("path_params", {}).items():
+        path = path.replace("/{value}".format(value=value), "/{{{name}}}".format(name=name), 1)
+    return path
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them by route template and status,
+    so that `/questions/?use=...` calls are aggregated under one route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = route_template(scope)
+            REQUEST_LATENCY.observe(time.perf_counter() - start, route=route, method=scope["method"])
+            REQUESTS.inc(route=route, method=scope["method"], status=status)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 
 class CSVQuestion(BaseModel):
     question: str
@@ -12,7 +12,80 @@ class CSVQuestion(BaseModel):
     responseD: Optional[str] = ""
     remark: Optional[str] = ""
 
+class QuestionKey(BaseModel):
+    question: str
+    subject: str
+
 class User(BaseModel):
     id: int
     name: str
-    password: str
\ No newline at end of file
+    password: str
+
+class ImportReport(BaseModel):
+    read: int = 0
+    accepted: int = 0
+    # Rows dropped, and rows kept after a correction, counted per rule
+    rejected: Dict[str, int] = {}
+    corrected: Dict[str, int] = {}
+
+    def reject(self, rule: str, rows: int):
+        if rows:
+            self.rejected[rule] = self.rejected.get(rule, 0) + rows
+
+    def correct(self, rule: str, rows: int):
+        if rows:
+            self.corrected[rule] = self.corrected.get(rule, 0) + rows
+
+class RowError(BaseModel):
+    # 1-based position of the row in the uploaded file, header excluded
+    row: int
+    question: Optional[str] = None
+    subject: Optional[str] = None
+    errors: List[str]
+
+class BulkImportResult(BaseModel):
+    imported: int
+    errors: List[RowError] = []
+
+class QuizSessionRequest(BaseModel):
+    use: str
+    subjects: List[str]
+    # Seed of the session's shuffle, to replay the same sequence of questions
+    seed: Optional[int] = None
+
+class QuizSessionInfo(BaseModel):
+    session_id: str
+    use: str
+    subjects: List[str]
+    total: int
+    remaining: int
+    # Seconds without a draw after which the session is dropped
+    expires_in: int
+
+class QuizQuestions(BaseModel):
+    questions: List[CSVQuestion]
+    remaining: int
+
+class QuizSpec(BaseModel):
+    use: str
+    subjects: List[str] = Field(min_length=1)
+    num_questions: int = Field(5, gt=0, le=20)
+    # Same meaning as the seed of GET /questions/
+    seed: Optional[int] = Field(None, ge=0)
+
+class QuizBatch(BaseModel):
+    quizzes: List[QuizSpec] = Field(min_length=1, max_length=1000)
+
+class NearDuplicate(BaseModel):
+    question: CSVQuestion
+    similarity: float
+
+class SearchResults(BaseModel):
+    total: int
+    offset: int
+    limit: int
+    questions: List[CSVQuestion]
+
+class QuestionPage(BaseModel):
+    questions: List[CSVQuestion]
+    next_cursor: Optional[str] = None
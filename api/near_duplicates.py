@@ -0,0 +1,230 @@
+"""
+Near-duplicate detection of question texts with MinHash signatures and LSH.
+
+Offline report of the near-duplicate pairs of a whole bank, as CSV:
+
+    python -m near_duplicates data/data.csv --threshold 0.85 > duplicates.csv
+"""
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Mapping, Set, Tuple
+from search_index import STOPWORDS, tokenize
+
+# The search stopwords but the negations, which make a question ask the opposite
+SHINGLE_STOPWORDS = STOPWORDS - {'n', 'ne', 'pas'}
+# Bumped whenever `shingles` changes, so that band keys stored by an older version are recomputed
+SHINGLES_VERSION = 2
+# Questions of the same subject whose word sets have at least this Jaccard similarity are near duplicates
+SIMILARITY_THRESHOLD = 0.85
+# 8 bands of 4 MinHash values: a pair at the threshold shares a band with 99.7% probability
+BANDS = 8
+ROWS_PER_BAND = 4
+NUM_PERMUTATIONS = BANDS * ROWS_PER_BAND
+# Questions whose signatures are computed together when indexing a whole bank
+SIGNATURE_CHUNK_SIZE = 20_000
+# Candidates verified per lookup, those sharing the most bands first, so that a bank of
+# templated questions, moderately similar to each other, does not make lookups linear
+MAX_CANDIDATES = 200
+# Buckets this large come from words shared by a large part of the bank, such as the words
+# of a template, and are skipped like stopwords: near duplicates also share smaller buckets
+MAX_BUCKET_SIZE = 1000
+
+# Universal hashing modulo a Mersenne prime; 31-bit operands keep the products within int64
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240229)
+_A = _rng.integers(1, _PRIME, NUM_PERMUTATIONS, dtype=np.int64)[:, None]
+_B = _rng.integers(0, _PRIME, NUM_PERMUTATIONS, dtype=np.int64)[:, None]
+_BAND_MULTIPLIERS = _rng.integers(1, 1 << 62, ROWS_PER_BAND, dtype=np.int64).astype(np.uint64)
+
+
+class NearDuplicateError(ValueError):
+    """
+    Raised when a new question is too similar to stored ones.
+    """
+
+    def __init__(self, duplicates: List[Tuple[dict, float]]):
+        super().__init__("Question has near duplicates: {questions}".format(
+            questions=", ".join(repr(row['question']) for row, _ in duplicates)))
+        self.duplicates = duplicates
+
+
+def shingles(text: str) -> Set[str]:
+    """
+    Returns the folded words of a text, so that punctuation, accents, case, stopwords and
+    word order do not tell two questions apart. Negations are kept, so a question and its
+    negation are not near duplicates.
+    """
+    return set(tokenize(text, SHINGLE_STOPWORDS)) if isinstance(text, str) else set()
+
+def similarity(a: str, b: str) -> float:
+    """
+    Returns the Jaccard similarity of the word sets of two texts.
+    """
+    a, b = shingles(a), shingles(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def band_keys(texts: List[str]) -> np.ndarray:
+    """
+    Computes the LSH band keys of texts: texts with similar word sets are likely to share
+    the key of at least one band.
+
+    Returns:
+        np.ndarray: An int64 array of shape (len(texts), BANDS), with a row of zeros for
+        the texts without words (see `has_words`).
+    """
+    words = [sorted(shingles(text)) for text in texts]
+    counts = np.fromiter((len(text_words) for text_words in words), dtype=np.int64, count=len(words))
+    signatures = np.full((len(words), NUM_PERMUTATIONS), _PRIME, dtype=np.int64)
+    present = counts > 0
+    if present.any():
+        flat = [word for text_words in words for word in text_words]
+        hashes = (pd.util.hash_array(np.array(flat, dtype=object)) & np.uint64(_PRIME)).astype(np.int64)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+        # Min over the words of each text of every permutation of the word hashes
+        signatures[present] = np.minimum.reduceat((_A * hashes + _B) % _PRIME, starts, axis=1).T
+    bands = signatures.astype(np.uint64).reshape(len(words), BANDS, ROWS_PER_BAND)
+    keys = (bands * _BAND_MULTIPLIERS).sum(axis=2, dtype=np.uint64).view(np.int64)
+    keys[~present] = 0
+    return keys
+
+def has_words(keys: np.ndarray) -> np.ndarray:
+    """
+    Tells which rows of `band_keys` belong to texts with words.
+    """
+    return (keys != 0).any(axis=1)
+
+def rank_near_duplicates(question: str, rows: Iterable[dict], threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple[dict, float]]:
+    """
+    Keeps the candidate rows similar enough to a question text, most similar first.
+    A row with the very same text is an exact duplicate, not a near one, and is skipped.
+    """
+    words = shingles(question)
+    ranked = []
+    for row in rows:
+        if row['question'] == question or not words:
+            continue
+        other = shingles(row['question'])
+        score = len(words & other) / len(words | other) if other else 0.0
+        if score >= threshold:
+            ranked.append((row, score))
+    ranked.sort(key=lambda item: -item[1])
+    return ranked
+
+
+class _BandTable:
+    # Keys of one band, sorted together with their labels, plus the keys added since
+    __slots__ = ('keys', 'labels', 'added')
+
+    def __init__(self, keys: np.ndarray, labels: np.ndarray):
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.labels = labels[order]
+        self.added: Dict[int, List[int]] = {}
+
+    def find(self, key: int) -> np.ndarray:
+        start = np.searchsorted(self.keys, key, side='left')
+        end = np.searchsorted(self.keys, key, side='right')
+        added = self.added.get(key, ())
+        if end - start + len(added) > MAX_BUCKET_SIZE:
+            return self.labels[:0]
+        return np.concatenate((self.labels[start:end], added)).astype(np.int64, copy=False) if added else self.labels[start:end]
+
+
+class NearDuplicateIndex:
+    """
+    LSH index of the question texts: each question is filed under the key of each of its
+    MinHash bands, so the candidates of a lookup are the few questions sharing a band with
+    it, found by binary search, instead of the whole bank.
+
+    The keys of a bank are sorted once; questions added afterwards are filed in small
+    dictionaries, and removed ones are only flagged, until the index is rebuilt.
+    """
+
+    def __init__(self, keys: np.ndarray, labels: np.ndarray):
+        self._bands = [_BandTable(keys[:, band], labels) for band in range(BANDS)]
+        self.removed: Set[int] = set()
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, exclude: Iterable[int] = ()) -> "NearDuplicateIndex":
+        """
+        Builds the index over the question texts of a DataFrame.
+
+        Args:
+            df (pd.DataFrame): The DataFrame containing the questions.
+            exclude (Iterable[int]): Labels of rows that must not be found, e.g. tombstoned rows.
+
+        Returns:
+            NearDuplicateIndex: The index over the DataFrame row labels.
+        """
+        labels = df.index.to_numpy(dtype=np.int64)
+        texts = df['question'].to_numpy()
+        keep = ~np.isin(labels, np.fromiter(exclude, dtype=np.int64))
+        labels, texts = labels[keep], texts[keep]
+        chunks = [band_keys(texts[start:start + SIGNATURE_CHUNK_SIZE].tolist()) for start in range(0, len(texts), SIGNATURE_CHUNK_SIZE)]
+        keys = np.concatenate(chunks) if chunks else np.empty((0, BANDS), dtype=np.int64)
+        words = has_words(keys)
+        return cls(keys[words], labels[words])
+
+    def add(self, label: int, row: Mapping[str, object]):
+        keys = band_keys([row.get('question')])[0]
+        if not keys.any():
+            return
+        for table, key in zip(self._bands, keys.tolist()):
+            table.added.setdefault(key, []).append(label)
+
+    def remove(self, label: int):
+        self.removed.add(label)
+
+    def candidates(self, question: str, limit: int = MAX_CANDIDATES) -> List[int]:
+        """
+        Returns the labels of the questions sharing at least one band with a question text,
+        at most `limit` of them, those sharing the most bands first.
+        """
+        keys = band_keys([question])[0]
+        if not keys.any():
+            return []
+        found = np.concatenate([table.find(key) for table, key in zip(self._bands, keys.tolist())])
+        labels, shared = np.unique(found, return_counts=True)
+        if self.removed:
+            alive = ~np.isin(labels, np.fromiter(self.removed, dtype=np.int64, count=len(self.removed)))
+            labels, shared = labels[alive], shared[alive]
+        # Most shared bands first, then the oldest question
+        order = np.lexsort((labels, -shared))[:limit]
+        return labels[order].tolist()
+
+
+def duplicate_report(df: pd.DataFrame, threshold: float = SIMILARITY_THRESHOLD) -> pd.DataFrame:
+    """
+    Finds every pair of near-duplicate questions of the same subject in a bank.
+
+    Args:
+        df (pd.DataFrame): The questions.
+        threshold (float): The minimum similarity of a reported pair.
+
+    Returns:
+        pd.DataFrame: One row per pair, with the subject, both question texts and their
+        similarity, most similar first.
+    """
+    df = df.reset_index(drop=True)
+    index = NearDuplicateIndex.from_dataframe(df)
+    questions, subjects = df['question'].tolist(), df['subject'].tolist()
+    pairs = []
+    for label, (question, subject) in enumerate(zip(questions, subjects)):
+        candidates = [{'question': questions[other]} for other in index.candidates(question)
+                      if other > label and subjects[other] == subject]
+        for row, score in rank_near_duplicates(question, candidates, threshold):
+            pairs.append((subject, question, row['question'], round(score, 3)))
+    report = pd.DataFrame(pairs, columns=['subject', 'question', 'near_duplicate', 'similarity'])
+    return report.sort_values('similarity', ascending=False, kind='stable', ignore_index=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Report the near-duplicate questions of a CSV file.")
+    parser.add_argument('csv_path')
+    parser.add_argument('--threshold', type=float, default=SIMILARITY_THRESHOLD)
+    arguments = parser.parse_args()
+    duplicate_report(pd.read_csv(arguments.csv_path), arguments.threshold).to_csv(sys.stdout, index=False)
@@ -0,0 +1,319 @@
+import itertools
+import numpy as np
+import pandas as pd
+from collections.abc import Set as AbstractSet
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def _frozen(labels: np.ndarray) -> np.ndarray:
+    labels.flags.writeable = False
+    return labels
+
+def sample_labels(buckets: List[np.ndarray], size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Draws `size` distinct labels uniformly from the union of `buckets`.
+
+    Positions are drawn over the virtual concatenation of the buckets and mapped back to
+    (bucket, offset), so the buckets are never copied: the work and the allocations are
+    proportional to `size`, not to the number of candidates.
+
+    Args:
+        buckets (List[np.ndarray]): The label buckets to draw from.
+        size (int): The number of labels to draw, at most the total bucket size.
+        rng (np.random.Generator): The random generator to draw with.
+
+    Returns:
+        np.ndarray: The drawn labels, in draw order.
+    """
+    ends = np.cumsum([len(bucket) for bucket in buckets])
+    positions = rng.choice(int(ends[-1]) if len(ends) else 0, size=size, replace=False, shuffle=True)
+    owners = np.searchsorted(ends, positions, side='right')
+    starts = ends - np.array([len(bucket) for bucket in buckets])
+    return np.array([buckets[owner][position - starts[owner]] for owner, position in zip(owners, positions)], dtype=np.int64)
+
+def allocate_quotas(total: int, weights: List[float]) -> List[int]:
+    """
+    Splits `total` into integer quotas proportional to `weights` (largest remainder method).
+
+    Args:
+        total (int): The number to split.
+        weights (List[float]): Non-negative weights, not all zero.
+
+    Returns:
+        List[int]: One quota per weight, summing to `total`; ties go to the earliest weights.
+    """
+    weights = np.asarray(weights, dtype=float)
+    shares = weights / weights.sum() * total
+    quotas = np.floor(shares).astype(np.int64)
+    order = np.argsort(quotas - shares, kind='stable')
+    quotas[order[:total - int(quotas.sum())]] += 1
+    return quotas.tolist()
+
+def sample_quota_labels(buckets: List[Optional[np.ndarray]], quotas: List[int], rng: np.random.Generator) -> np.ndarray:
+    """
+    Draws `quotas[i]` distinct labels from `buckets[i]` and shuffles them together.
+
+    Each draw only picks positions in its bucket, so the work is proportional to the
+    total of the quotas, like `sample_labels`.
+
+    Args:
+        buckets (List[Optional[np.ndarray]]): The label buckets, None for an empty one.
+        quotas (List[int]): The number of labels to draw from each bucket, at most its size.
+        rng (np.random.Generator): The random generator to draw with.
+
+    Returns:
+        np.ndarray: The drawn labels, in draw order.
+    """
+    labels = np.empty(sum(quotas), dtype=np.int64)
+    start = 0
+    for bucket, quota in zip(buckets, quotas):
+        if quota:
+            labels[start:start + quota] = bucket[rng.choice(len(bucket), size=quota, replace=False)]
+            start += quota
+    rng.shuffle(labels)
+    return labels
+
+
+# Removal stamp of the labels that are not removed
+_ALIVE = np.iinfo(np.int64).max
+
+def _room(size: int) -> int:
+    # Half again as much room, so that reallocations are amortized over the additions
+    return size + size // 2 + 16
+
+
+class _Lineage:
+    # State shared by an index and all its copies. Only the latest copy writes to it, and
+    # only what older copies ignore: labels past their size, removal stamps past their version
+    __slots__ = ('keys', 'previous', 'removed_in', 'versions')
+
+    def __init__(self, keys: Dict[Tuple[str, str], int], size: int):
+        # Latest label of each (question, subject), and the label it replaced
+        self.keys = keys
+        self.previous: Dict[int, int] = {}
+        # Version of the index each label was removed in, by label
+        self.removed_in = np.full(_room(size), _ALIVE, dtype=np.int64)
+        self.versions = itertools.count(1)
+
+    def reserve(self, size: int):
+        if size > len(self.removed_in):
+            removed_in = np.full(_room(size), _ALIVE, dtype=np.int64)
+            removed_in[:len(self.removed_in)] = self.removed_in
+            self.removed_in = removed_in
+
+
+class _Tombstones(AbstractSet):
+    # Read-only set of the labels removed as of one version of an index
+    __slots__ = ('_index',)
+
+    def __init__(self, index: "QuestionIndex"):
+        self._index = index
+
+    def __contains__(self, label) -> bool:
+        return self._index._is_removed(label)
+
+    def __len__(self) -> int:
+        return self._index._removed
+
+    def __iter__(self) -> Iterator[int]:
+        index = self._index
+        return iter(np.flatnonzero(index._lineage.removed_in[:index.size] <= index._version).tolist())
+
+
+class QuestionIndex:
+    """
+    Index of the question bank keyed by (use, subject).
+
+    Each (use, subject) bucket holds the DataFrame row labels of its questions, so that
+    validation, filtering and counting in `get_questions` are dict lookups instead of
+    column scans. The index is maintained incrementally on add/remove: only the touched
+    bucket is replaced, and bucket arrays are never mutated once published, so a reader
+    holding one always sees a consistent view.
+
+    Writers change a `copy` and publish it: copies share their arrays and the key map,
+    and record what they add past the size of the index they were copied from and what
+    they remove under their own version, which older copies ignore. A copy costs the
+    number of buckets, not the number of questions.
+
+    Removed labels are kept in `tombstones` until the DataFrame is compacted.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[Tuple[str, str], np.ndarray] = {}
+        self.uses: Dict[str, int] = {}
+        self.subjects: Dict[str, int] = {}
+        # Labels below `size` are indexed, added labels must be at least `size`
+        self.size = 0
+        # Arrays the buckets are a view of, with room to append
+        self._buffers: Dict[Tuple[str, str], np.ndarray] = {}
+        self._lineage = _Lineage({}, 0)
+        self._version = 0
+        self._keys = 0
+        self._removed = 0
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "QuestionIndex":
+        """
+        Builds the index from a DataFrame of questions.
+
+        Args:
+            df (pd.DataFrame): The DataFrame containing the questions.
+
+        Returns:
+            QuestionIndex: The index over the DataFrame row labels.
+        """
+        index = cls()
+        labels = df.index.to_numpy()
+        groups = df.groupby(['use', 'subject'], sort=False, observed=True).indices
+        for (use, subject), positions in groups.items():
+            index.buckets[(use, subject)] = _frozen(labels[positions].astype(np.int64))
+            index.uses[use] = index.uses.get(use, 0) + len(positions)
+            index.subjects[subject] = index.subjects.get(subject, 0) + len(positions)
+        keys = dict(zip(zip(df['question'], df['subject']), labels.tolist()))
+        index.size = int(labels.max()) + 1 if len(labels) else 0
+        index._lineage = _Lineage(keys, index.size)
+        index._keys = len(keys)
+        return index
+
+    def copy(self) -> "QuestionIndex":
+        """
+        Returns a copy of the index to make changes to, while readers keep using this one.
+        Only the dicts of the buckets and counts are copied, so the cost does not depend on
+        the number of questions. Only a copy of the latest index may be changed.
+        """
+        index = QuestionIndex()
+        index.buckets = dict(self.buckets)
+        index.uses = dict(self.uses)
+        index.subjects = dict(self.subjects)
+        index.size = self.size
+        index._buffers = dict(self._buffers)
+        index._lineage = self._lineage
+        index._version = next(self._lineage.versions)
+        index._keys = self._keys
+        index._removed = self._removed
+        return index
+
+    @property
+    def tombstones(self) -> AbstractSet:
+        """
+        The labels of the removed rows, as a read-only set.
+        """
+        return _Tombstones(self)
+
+    def _is_removed(self, label: int) -> bool:
+        return 0 <= label < self.size and self._lineage.removed_in[label] <= self._version
+
+    def __len__(self) -> int:
+        return self._keys
+
+    def has_use(self, use: str) -> bool:
+        return use in self.uses
+
+    def has_subjects(self, subjects: Iterable[str]) -> bool:
+        return all(subject in self.subjects for subject in subjects)
+
+    def find(self, question: str, subject: str) -> Optional[int]:
+        """
+        Returns the row label of the (question, subject) pair, or None if it is not indexed.
+        """
+        lineage = self._lineage
+        label = lineage.keys.get((question, subject))
+        # Labels added after this version point back to the one they replaced
+        while label is not None and label >= self.size:
+            label = lineage.previous.get(label)
+        if label is None or self._is_removed(label):
+            return None
+        return label
+
+    def candidates(self, use: str, subjects: Iterable[str]) -> List[np.ndarray]:
+        """
+        Returns the label buckets matching `use` and any of `subjects`.
+
+        Args:
+            use (str): The 'use' value to filter questions.
+            subjects (Iterable[str]): The subjects to filter questions.
+
+        Returns:
+            List[np.ndarray]: One read-only label array per non-empty bucket.
+        """
+        buckets = (self.buckets.get((use, subject)) for subject in dict.fromkeys(subjects))
+        return [bucket for bucket in buckets if bucket is not None]
+
+    def count(self, use: str, subjects: Iterable[str]) -> int:
+        return sum(len(bucket) for bucket in self.candidates(use, subjects))
+
+    def add(self, label: int, question: str, subject: str, use: str):
+        """
+        Indexes a new row, whose label must not be lower than `size`.
+
+        Args:
+            label (int): The DataFrame row label of the new question.
+            question (str): The question text.
+            subject (str): The question subject.
+            use (str): The question use.
+
+        Raises:
+            ValueError: If the label is lower than `size`.
+        """
+        if label < self.size:
+            raise ValueError("Rows must be added in increasing label order")
+        # Appended past the end of every published view of the bucket
+        bucket = self.buckets.get((use, subject))
+        count = len(bucket) if bucket is not None else 0
+        buffer = self._buffers.get((use, subject))
+        if buffer is None or count == len(buffer):
+            buffer = np.empty(_room(count), dtype=np.int64)
+            buffer[:count] = bucket if bucket is not None else []
+            self._buffers[(use, subject)] = buffer
+        buffer[count] = label
+        self.buckets[(use, subject)] = _frozen(buffer[:count + 1])
+        self.uses[use] = self.uses.get(use, 0) + 1
+        self.subjects[subject] = self.subjects.get(subject, 0) + 1
+
+        lineage = self._lineage
+        lineage.reserve(label + 1)
+        # Stamps left past the size by a change that was never published
+        lineage.removed_in[self.size:label + 1] = _ALIVE
+        if self.find(question, subject) is None:
+            self._keys += 1
+        previous = lineage.keys.get((question, subject))
+        if previous is not None:
+            # Set before the key, so older versions can always walk back to their label
+            lineage.previous[label] = previous
+        lineage.keys[(question, subject)] = label
+        self.size = label + 1
+
+    def remove(self, label: int, question: str, subject: str, use: str):
+        """
+        Removes a row from the index and records its label as a tombstone.
+
+        Args:
+            label (int): The DataFrame row label of the question.
+            question (str): The question text.
+            subject (str): The question subject.
+            use (str): The question use.
+        """
+        bucket = self.buckets.get((use, subject))
+        if bucket is None:
+            return
+        remaining = bucket[bucket != label]
+        if len(remaining) == len(bucket):
+            return
+        if len(remaining):
+            self.buckets[(use, subject)] = _frozen(remaining)
+        else:
+            del self.buckets[(use, subject)]
+        self._buffers.pop((use, subject), None)
+        self._decrement(self.uses, use)
+        self._decrement(self.subjects, subject)
+        if self.find(question, subject) == label:
+            self._keys -= 1
+        self._lineage.removed_in[label] = self._version
+        self._removed += 1
+
+    @staticmethod
+    def _decrement(counts: Dict[str, int], key: str):
+        if counts[key] <= 1:
+            del counts[key]
+        else:
+            counts[key] -= 1
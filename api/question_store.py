@@ -0,0 +1,205 @@
+import sys
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List
+from models import CSVQuestion
+
+FIELDS = list(CSVQuestion.model_fields)
+# Few distinct values repeated on every row: stored as categorical codes, one byte per row
+CATEGORICAL_COLUMNS = ['subject', 'use', 'correct']
+
+
+def _grown(size: int) -> int:
+    # Half again as much room, so that reallocations are amortized over the inserts
+    return size + size // 2 + 16
+
+
+def _code_dtype(categories: int) -> np.dtype:
+    # The code type pandas uses for this many categories, so that codes are shared, not converted
+    for dtype in (np.int8, np.int16, np.int32):
+        if categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class _CategoricalBuffer:
+    # Codes with spare room, and the categories they refer to; categories are only appended
+    __slots__ = ('codes', 'categories', 'dtype', '_code_of')
+
+    def __init__(self, values: pd.Series, size: int, capacity: int):
+        categorical = pd.Categorical(values)
+        self.categories = list(categorical.categories)
+        self._code_of = {category: code for code, category in enumerate(self.categories)}
+        self.dtype = pd.CategoricalDtype(self.categories)
+        self.codes = np.full(capacity, -1, dtype=_code_dtype(len(self.categories)))
+        self.codes[:size] = categorical.codes
+
+    def code(self, value) -> int:
+        if not isinstance(value, str):
+            return -1
+        code = self._code_of.get(value)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(value)
+            self._code_of[value] = code
+            self.dtype = pd.CategoricalDtype(self.categories)
+        return code
+
+    def values(self, size: int) -> pd.Categorical:
+        if self.codes.dtype != _code_dtype(len(self.categories)):
+            self.codes = self.codes.astype(_code_dtype(len(self.categories)))
+        return pd.Categorical.from_codes(self.codes[:size], dtype=self.dtype, validate=False)
+
+
+class QuestionColumns:
+    """
+    Append-only column buffers of the question bank, with spare room at the end.
+
+    The few distinct values of CATEGORICAL_COLUMNS are stored as categorical codes, the
+    other columns as object arrays. `frame` publishes a DataFrame over the first `size`
+    rows of the buffers without copying them. New rows are written past the end of every
+    published frame, so a published frame never changes, and an insert costs the same
+    whatever the size of the bank; full buffers are reallocated with half again as much room.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.columns = list(df.columns)
+        self.size = len(df)
+        capacity = _grown(self.size)
+        self._buffers: Dict[str, np.ndarray] = {}
+        self._categoricals: Dict[str, _CategoricalBuffer] = {}
+        for column in self.columns:
+            if column in CATEGORICAL_COLUMNS:
+                self._categoricals[column] = _CategoricalBuffer(df[column], self.size, capacity)
+            else:
+                values = df[column].to_numpy(dtype=object)
+                # A float column (e.g. an empty remark) would otherwise box a new NaN per row
+                values[pd.isna(values)] = np.nan
+                buffer = np.empty(capacity, dtype=object)
+                buffer[:self.size] = values
+                self._buffers[column] = buffer
+
+    def frame(self) -> pd.DataFrame:
+        """
+        Returns a DataFrame of the first `size` rows, labelled from 0, sharing the buffers.
+        """
+        index = pd.RangeIndex(self.size)
+        data = {}
+        for column in self.columns:
+            if column in self._categoricals:
+                data[column] = pd.Series(self._categoricals[column].values(self.size), index=index, copy=False)
+            else:
+                # An explicit dtype, since inferring it would scan the whole column
+                data[column] = pd.Series(self._buffers[column][:self.size], index=index, dtype=object, copy=False)
+        return pd.DataFrame(data, copy=False)
+
+    def append(self, rows: List[dict], start: int) -> pd.DataFrame:
+        """
+        Writes rows from position `start`, the size of the latest published frame, and
+        returns the frame including them. Rows written past `start` by a write that was
+        not published are overwritten.
+
+        Args:
+            rows (List[dict]): The new rows, by column.
+            start (int): The number of rows of the latest published frame.
+
+        Returns:
+            pd.DataFrame: The frame of the first `start + len(rows)` rows.
+        """
+        end = start + len(rows)
+        for column, buffer in self._buffers.items():
+            if end > len(buffer):
+                grown = np.empty(_grown(end), dtype=object)
+                grown[:start] = buffer[:start]
+                self._buffers[column] = buffer = grown
+            buffer[start:end] = [row.get(column) for row in rows]
+        for column, categorical in self._categoricals.items():
+            if end > len(categorical.codes):
+                grown = np.full(_grown(end), -1, dtype=categorical.codes.dtype)
+                grown[:start] = categorical.codes[:start]
+                categorical.codes = grown
+            codes = [categorical.code(row.get(column)) for row in rows]
+            # Wider codes first if new categories need them
+            categorical.values(start)
+            categorical.codes[start:end] = codes
+        self.size = end
+        return self.frame()
+
+def _text(value) -> str:
+    # Missing cells are NaN (or None) in the DataFrame and empty strings in the API
+    if isinstance(value, str):
+        return value
+    if value is None or pd.isna(value):
+        return ''
+    return str(value)
+
+class QuestionRow:
+    """
+    Lightweight read-only view of one question, with one slot per CSVQuestion field.
+
+    Rows are read straight from the DataFrame columns, and the pydantic model is only
+    built at the API boundary with `to_model`.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, *values):
+        for field, value in zip(FIELDS, values):
+            setattr(self, field, _text(value))
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def to_model(self) -> CSVQuestion:
+        return CSVQuestion(**self.to_dict())
+
+    def __repr__(self) -> str:
+        return "QuestionRow(question={question!r}, subject={subject!r})".format(question=self.question, subject=self.subject)
+
+
+def question_rows(df: pd.DataFrame, labels: Iterable[int]) -> List[QuestionRow]:
+    """
+    Reads rows by label into QuestionRow views, without building intermediate DataFrames.
+
+    Args:
+        df (pd.DataFrame): The DataFrame containing the questions.
+        labels (Iterable[int]): The row labels to read.
+
+    Returns:
+        List[QuestionRow]: One view per label, in the order of `labels`.
+    """
+    positions = df.index.get_indexer(list(labels))
+    if (positions < 0).any():
+        raise KeyError("Unknown question labels")
+    # Only the rows read are taken, categorical columns included
+    columns = [np.asarray(df[field].array.take(positions), dtype=object) if field in df.columns else None for field in FIELDS]
+    return [
+        QuestionRow(*(column[row] if column is not None else '' for column in columns))
+        for row in range(len(positions))
+    ]
+
+
+def resident_bytes(df: pd.DataFrame) -> int:
+    """
+    Estimates the memory held by a DataFrame, counting each shared Python object once,
+    unlike `memory_usage(deep=True)` which counts a string shared by several rows once per row.
+
+    Returns:
+        int: The number of bytes of the column buffers, the index and the distinct objects.
+    """
+    total = df.index.memory_usage(deep=False)
+    seen = set()
+    for column in df.columns:
+        values = df[column].array
+        if isinstance(values, pd.Categorical):
+            total += values.codes.nbytes
+            values = values.categories.to_numpy()
+        else:
+            values = values.to_numpy()
+            total += values.nbytes
+        if values.dtype == object:
+            for value in values:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    total += sys.getsizeof(value)
+    return total
@@ -0,0 +1,167 @@
+import secrets
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class LazyPermutation:
+    """
+    Random permutation of `range(size)` produced a few elements at a time.
+
+    It runs the Fisher-Yates shuffle one step per element taken, and only remembers the
+    positions that were swapped, so taking `k` elements costs O(k) time and memory
+    whatever the size.
+    """
+
+    def __init__(self, size: int, rng: np.random.Generator):
+        self.size = size
+        self.position = 0
+        self._rng = rng
+        self._swapped: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return self.size - self.position
+
+    def take(self, k: int) -> List[int]:
+        """
+        Returns the next `k` elements of the permutation, or all the remaining ones if there are fewer.
+        """
+        k = min(k, len(self))
+        start = self.position
+        targets = start + self._rng.integers(0, self.size - start - np.arange(k)) + np.arange(k)
+        taken = []
+        for i, j in zip(range(start, start + k), targets.tolist()):
+            value_i = self._swapped.pop(i, i)
+            taken.append(self._swapped.get(j, j) if j != i else value_i)
+            if j != i:
+                self._swapped[j] = value_i
+        self.position += k
+        return taken
+
+
+class QuizSession:
+    """
+    Draw state of one user's quiz over the questions matching a use and subjects.
+
+    The candidate ids are the repository's read-only arrays, shared rather than copied,
+    and are walked through a `LazyPermutation`, so a question is never handed out twice.
+    The keys of the questions handed out are remembered, so that when the repository
+    changes the session can restart on the new candidates and still skip them.
+    """
+
+    def __init__(self, username: str, use: str, subjects: List[str], seed: Optional[int] = None):
+        self.username = username
+        self.use = use
+        self.subjects = subjects
+        self.rng = np.random.default_rng(seed)
+        self.generation: Optional[int] = None
+        self.candidates: List[np.ndarray] = []
+        self.ends = np.empty(0, dtype=np.int64)
+        self.permutation = LazyPermutation(0, self.rng)
+        self.served: Set[Tuple[str, str]] = set()
+        # Candidates served before the last rebase, which the permutation will still draw
+        self.skipped = 0
+        # Serializes the draws of concurrent requests on the same session
+        self.lock = threading.Lock()
+
+    def rebase(self, generation: int, candidates: List[np.ndarray], served_candidates: int = 0):
+        """
+        Starts a new permutation over `candidates`, read from the repository at `generation`.
+
+        Args:
+            generation (int): The repository generation the candidates were read from.
+            candidates (List[np.ndarray]): The read-only arrays of candidate ids.
+            served_candidates (int): How many of the candidates were already handed out.
+        """
+        self.generation = generation
+        self.candidates = candidates
+        self.ends = np.cumsum([len(ids) for ids in candidates], dtype=np.int64)
+        self.permutation = LazyPermutation(int(self.ends[-1]) if len(self.ends) else 0, self.rng)
+        self.skipped = served_candidates
+
+    def remaining(self) -> int:
+        return len(self.permutation) - self.skipped
+
+    def draw_ids(self, k: int) -> List[int]:
+        """
+        Takes the ids of the next `k` candidates in the permutation.
+        """
+        positions = np.asarray(self.permutation.take(k), dtype=np.int64)
+        owners = np.searchsorted(self.ends, positions, side='right')
+        starts = self.ends - np.array([len(ids) for ids in self.candidates], dtype=np.int64)
+        return [int(self.candidates[owner][position - starts[owner]]) for owner, position in zip(owners, positions)]
+
+    def mark_served(self, rows: List[dict]) -> List[dict]:
+        """
+        Records rows as handed out and returns those that were not handed out before.
+        """
+        fresh = []
+        for row in rows:
+            key = (row['question'], row['subject'])
+            if key in self.served:
+                self.skipped -= 1
+                continue
+            self.served.add(key)
+            fresh.append(row)
+        return fresh
+
+
+# Sessions are dropped after this many seconds without a draw, or when the store is full
+SESSION_TTL = 1800
+SESSION_MAX_COUNT = 10_000
+
+class SessionStore:
+    """
+    Bounded store of quiz sessions, evicting the least recently used one when full and
+    expiring the sessions that were not used for `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_size: int = SESSION_MAX_COUNT):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions: "OrderedDict[str, Tuple[QuizSession, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, session: QuizSession) -> str:
+        """
+        Stores a session under a new random id.
+
+        Returns:
+            str: The session id.
+        """
+        session_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._sessions[session_id] = (session, time.monotonic() + self.ttl)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id: str) -> Optional[QuizSession]:
+        """
+        Returns the session and extends its lifetime, or None if it does not exist or expired.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            session, expires_at = entry
+            now = time.monotonic()
+            if expires_at <= now:
+                del self._sessions[session_id]
+                return None
+            self._sessions[session_id] = (session, now + self.ttl)
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def remove(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,621 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+from csv_management import EXPORT_CHUNK_SIZE, add_question, add_questions, apply_deletion_log, check_anchor, compact_questions, deletion_log_path, labels_after, listing_buckets, replace_csv, get_question_rows, get_questions, question_candidates, remove_questions, sample_question_labels
+from metrics import RELOADS, stage
+from models import CSVQuestion
+from near_duplicates import SIMILARITY_THRESHOLD, NearDuplicateIndex, rank_near_duplicates
+from question_index import QuestionIndex
+from question_store import QuestionColumns
+from search_index import SearchIndex
+
+try:
+    import fcntl
+except ImportError:  # fcntl is POSIX only, the in-process lock still serializes writers
+    fcntl = None
+
+
+class QuestionRepository(ABC):
+    """
+    Storage interface the question service depends on.
+
+    `generation` changes whenever the stored questions change, so callers can tell
+    whether data derived from the repository is still current.
+    """
+
+    generation: int
+
+    @abstractmethod
+    def load(self):
+        """
+        Prepares the storage so that it can serve requests.
+        """
+
+    @abstractmethod
+    def is_loaded(self) -> bool:
+        pass
+
+    @abstractmethod
+    def find_questions(self, use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> List[CSVQuestion]:
+        """
+        Draws `num_questions` random questions matching `use` and any of `subjects`.
+        The same `seed` on the same data draws the same questions. With `weights`, one per
+        subject, each subject gets its share of `num_questions` instead of a uniform draw
+        over all of them.
+
+        Raises:
+            ValueError: If the use or a subject is unknown, if the weights are not valid or if there are not enough questions.
+        """
+
+    @abstractmethod
+    def find_question_ids(self, use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> Tuple[int, List[int]]:
+        """
+        Draws questions like `find_questions` but returns their ids, together with the
+        generation they were drawn from, instead of building the models.
+        """
+
+    @abstractmethod
+    def find_candidate_ids(self, use: str, subjects: List[str]) -> Tuple[int, List[np.ndarray]]:
+        """
+        Returns the ids of every question matching `use` and any of `subjects`, as read-only
+        arrays, together with the generation they were read from.
+
+        Raises:
+            ValueError: If the use or a subject is unknown.
+        """
+
+    @abstractmethod
+    def get_question_rows(self, ids: List[int]) -> Tuple[int, List[dict]]:
+        """
+        Reads questions by id as plain dicts of the CSVQuestion fields, together with the
+        generation they were read from.
+        """
+
+    @abstractmethod
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[int, int, List[int]]:
+        """
+        Finds the questions containing every word of `query` in their text, answers or remark,
+        ignoring accents and case, best matches first.
+
+        Returns:
+            Tuple[int, int, List[int]]: The generation searched, the total number of matches and the ids of the requested page.
+        """
+
+    @abstractmethod
+    def find_near_duplicates(self, question: CSVQuestion, threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple[dict, float]]:
+        """
+        Finds the stored questions of the same subject whose text is similar to the question's
+        (see `near_duplicates`), most similar first. A question with the very same text is an
+        exact duplicate and is not returned.
+
+        Returns:
+            List[Tuple[dict, float]]: The rows, as plain dicts of the CSVQuestion fields, with their similarity.
+        """
+
+    @abstractmethod
+    def list_question_ids(self, after: int, limit: int, use: Optional[str] = None, subjects: Optional[List[str]] = None, anchor: Optional[str] = None) -> Tuple[int, List[int]]:
+        """
+        Lists the ids of the questions matching the optional filters in increasing order,
+        at most `limit` of them, starting after the id `after` (-1 for the first page).
+
+        `anchor` is the `row_anchor` of the question `after` was the id of: backends whose
+        ids can be renumbered check that `after` still designates that question.
+
+        Raises:
+            ValueError: If the use or a subject is unknown, or if `after` no longer designates the anchored question.
+
+        Returns:
+            Tuple[int, List[int]]: The generation listed and the ids of the page.
+        """
+
+    @abstractmethod
+    def iter_question_rows(self, use: Optional[str] = None, subjects: Optional[List[str]] = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[dict]]:
+        """
+        Reads every question matching the optional filters in id order, `chunk_size` at a
+        time, as plain dicts of the CSVQuestion fields, so that an export never holds the
+        whole bank. The filters are checked before the iterator is returned.
+
+        Raises:
+            ValueError: If the use or a subject is unknown.
+        """
+
+    def current_generation(self) -> int:
+        """
+        Returns the generation of the stored questions, picking up changes made by other workers.
+        """
+        return self.generation
+
+    @abstractmethod
+    def pinned(self) -> ContextManager[None]:
+        """
+        Keeps the generation seen by the reads of the current thread from changing until the
+        block ends, so that ids and the rows read for them always match. Writes must not be
+        made from the block. It is the fallback of readers that kept seeing the generation
+        change; writers are not held off while it lasts.
+        """
+
+    def is_in_memory(self) -> bool:
+        """
+        Tells whether reads can be served right now from memory, without parsing a file or
+        querying a database, so that async callers can run them on the event loop.
+        """
+        return False
+
+    def stats(self) -> dict:
+        """
+        Describes the state of the storage for the readiness probe. It is answered from
+        memory only, without touching the disk, so it can be polled at high frequency.
+        """
+        return {"loaded": self.is_loaded()}
+
+    @abstractmethod
+    def contains_keys(self, keys: List[Tuple[str, str]]) -> np.ndarray:
+        """
+        Tells which (question, subject) keys are stored.
+
+        Returns:
+            np.ndarray: A boolean mask aligned with `keys`.
+        """
+
+    @abstractmethod
+    def get_subjects(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def get_uses(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def add(self, question: CSVQuestion):
+        """
+        Raises:
+            ValueError: If the question already exists or if the correct answer is empty.
+        """
+
+    @abstractmethod
+    def add_many(self, questions: List[CSVQuestion]):
+        """
+        Raises:
+            ValueError: If any question already exists or has an empty correct answer; nothing is added then.
+        """
+
+    @abstractmethod
+    def remove_many(self, questions: List[CSVQuestion]) -> int:
+        """
+        Raises:
+            ValueError: If any question does not exist; nothing is removed then.
+        """
+
+    def remove(self, question: CSVQuestion) -> bool:
+        """
+        Raises:
+            ValueError: If the question does not exist.
+        """
+        return self.remove_many([question]) == 1
+
+
+class CSVQuestionRepository(QuestionRepository):
+    """
+    Process-wide in-memory store for the questions CSV file.
+
+    The file is parsed once and every read is then served from memory, together with a
+    (use, subject) index of the rows. The data is reloaded only when the file (or its
+    deletion log) changes on disk or when `reload` is called. Writes made through the
+    repository append only the new rows to the file; in memory they are written past the
+    end of the column buffers (see `QuestionColumns`), which a new DataFrame is published
+    over, so an insert does not copy the bank. The index is changed on a copy, which
+    shares its arrays with the published one (see `QuestionIndex.copy`), so a reader
+    holding a snapshot never sees it change. Deletions are tombstoned in a deletion log; once the share of tombstoned
+    rows reaches `compaction_threshold`, a background thread compacts the file.
+    The full-text `SearchIndex` and the `NearDuplicateIndex` are built on first use and
+    then kept up to date by the writes, until a reload or a compaction relabels the rows.
+    The low-cardinality columns are stored as categorical codes (see `question_store`) to
+    keep the resident size per question small.
+
+    Writers are serialized by an in-process lock plus an `fcntl` lock on `<file>.lock`
+    shared by every worker. Readers never take those locks while a snapshot is
+    available: a reload that would have to wait for a writer is skipped and the
+    current snapshot keeps being served.
+    """
+
+    def __init__(self, path: str, loader: Callable[[str], pd.DataFrame] = pd.read_csv, compaction_threshold: float = 0.2):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.compaction_threshold = compaction_threshold
+        self._loader = loader
+        # The DataFrame and its index are published together so readers get a consistent pair
+        self._state: Optional[Tuple[pd.DataFrame, QuestionIndex]] = None
+        # Buffers the published DataFrame is a view of, which writers append to
+        self._columns: Optional[QuestionColumns] = None
+        # Indexes derived from the rows, by type, with the generation each is current for
+        self._derived: Dict[type, Tuple[int, object]] = {}
+        # The snapshot and generation each thread reads from while the repository is pinned
+        self._pinned = threading.local()
+        self._stat: Optional[tuple] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self.compaction_thread: Optional[threading.Thread] = None
+        self.generation = 0
+        # Threads holding or waiting for the write lock
+        self._writers = 0
+        # Wall-clock time and duration of the last successful load, and the error of the last failed one
+        self.loaded_at: Optional[float] = None
+        self.load_duration: Optional[float] = None
+        self.load_error: Optional[str] = None
+
+    def _file_stat(self) -> tuple:
+        stat = os.stat(self.path)
+        try:
+            log = os.stat(deletion_log_path(self.path))
+            log_stat = (log.st_mtime_ns, log.st_size)
+        except FileNotFoundError:
+            log_stat = None
+        return stat.st_mtime_ns, stat.st_size, log_stat
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False, blocking: bool = True) -> Iterator[bool]:
+        # Yields whether the lock was acquired, which is always the case when blocking
+        if fcntl is None:
+            yield True
+            return
+        with open(self.lock_path, 'a') as file:
+            flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            try:
+                fcntl.flock(file.fileno(), flags if blocking else flags | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def _write_locked(self) -> Iterator[None]:
+        with self._lock:
+            self._writers += 1
+        try:
+            with self._write_lock:
+                yield
+        finally:
+            with self._lock:
+                self._writers -= 1
+
+    def _load(self) -> pd.DataFrame:
+        # Callers hold the write lock and a file lock
+        start = time.perf_counter()
+        try:
+            # Stat before reading so a write racing with the parse triggers another reload
+            stat = self._file_stat()
+            with stage("csv_parse"):
+                columns = QuestionColumns(self._loader(self.path))
+                df = columns.frame()
+            index = QuestionIndex.from_dataframe(df)
+            apply_deletion_log(df, self.path, index)
+        except Exception as e:
+            self.load_error = "{name}: {error}".format(name=type(e).__name__, error=e)
+            raise
+        with self._lock:
+            self._state = (df, index)
+            self._columns = columns
+            self._stat = stat
+            self.generation += 1
+            # Rebuilt on next use, since the reload may relabel the rows
+            self._derived = {}
+            self.loaded_at = time.time()
+            self.load_duration = time.perf_counter() - start
+            self.load_error = None
+        RELOADS.inc()
+        return df
+
+    def load(self) -> pd.DataFrame:
+        """
+        Parses the CSV file and replaces the in-memory DataFrame.
+
+        Returns:
+            pd.DataFrame: The freshly loaded DataFrame.
+        """
+        with self._write_locked(), self._file_lock(shared=True):
+            return self._load()
+
+    def reload(self) -> pd.DataFrame:
+        """
+        Forces a reload of the file.
+        """
+        return self.load()
+
+    def _try_reload(self):
+        # Reload unless a writer of this process or of another worker is busy
+        if not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            with self._file_lock(shared=True, blocking=False) as acquired:
+                if acquired and self.is_stale():
+                    self._load()
+        finally:
+            self._write_lock.release()
+
+    @contextmanager
+    def _writing(self) -> Iterator[Tuple[pd.DataFrame, QuestionIndex]]:
+        # Single writer across threads and workers, working on up-to-date data
+        with self._write_locked(), self._file_lock():
+            if self._state is None or self.is_stale():
+                self._load()
+            yield self._state
+
+    def _mark_written(self, df: pd.DataFrame, index: QuestionIndex, derived: Optional[Dict[type, object]] = None):
+        # Record our own write so the resulting file change does not trigger a reload
+        with self._lock:
+            self._state = (df, index)
+            self._stat = self._file_stat()
+            self.generation += 1
+            self._derived = {kind: (self.generation, value) for kind, value in (derived or {}).items()}
+
+    def _updated_derived(self, df: pd.DataFrame, added: List[int] = (), removed: List[int] = ()) -> Dict[type, object]:
+        # Writers hold the write lock; derived indexes current before the write are updated rather than dropped
+        derived = {kind: value for kind, (generation, value) in self._derived.items() if generation == self.generation}
+        rows = [(label, df.loc[label].to_dict()) for label in added] if derived else []
+        for value in derived.values():
+            for label, row in rows:
+                value.add(label, row)
+            for label in removed:
+                value.remove(label)
+        return derived
+
+    def add(self, question: CSVQuestion):
+        """
+        Adds a question in memory and appends it to the file.
+
+        Raises:
+            ValueError: If the question already exists or if the correct answer is empty.
+        """
+        with self._writing() as (df, index):
+            # Published snapshots are never changed: the new DataFrame and a copy of the index are published together
+            index = index.copy()
+            df = add_question(question, df, self.path, index, self._columns)
+            self._mark_written(df, index, self._updated_derived(df, added=df.index[-1:]))
+
+    def add_many(self, questions: List[CSVQuestion]):
+        """
+        Adds several questions in memory and appends them to the file with a single write.
+
+        Raises:
+            ValueError: If any question already exists or has an empty correct answer; nothing is added then.
+        """
+        with self._writing() as (df, index):
+            # add_questions builds a new DataFrame, so index a copy and publish both together
+            index = index.copy()
+            added = add_questions(questions, df, self.path, index, self._columns)
+            self._mark_written(added, index, self._updated_derived(added, added=added.index[len(df):]))
+
+    def remove_many(self, questions: List[CSVQuestion]) -> int:
+        """
+        Tombstones several questions with a single write to the deletion log.
+        They stop being served immediately.
+
+        Raises:
+            ValueError: If any question does not exist; nothing is removed then.
+
+        Returns:
+            int: The number of removed questions.
+        """
+        with self._writing() as (df, index):
+            # Tombstoned rows stay in the DataFrame, so readers holding their labels can still read them
+            labels = [index.find(question.question, question.subject) for question in questions]
+            index = index.copy()
+            removed = remove_questions(questions, df, self.path, index)
+            self._mark_written(df, index, self._updated_derived(df, removed=labels))
+            self._schedule_compaction(df, index)
+        return removed
+
+    def tombstone_ratio(self) -> float:
+        df, index = self.snapshot()
+        return len(index.tombstones) / len(df) if len(df) else 0.0
+
+    def _schedule_compaction(self, df: pd.DataFrame, index: QuestionIndex):
+        if not len(df) or len(index.tombstones) / len(df) < self.compaction_threshold:
+            return
+        if self.compaction_thread is not None and self.compaction_thread.is_alive():
+            return
+        self.compaction_thread = threading.Thread(target=self.compact, name="question-compaction", daemon=True)
+        self.compaction_thread.start()
+
+    def compact(self):
+        """
+        Drops the tombstoned rows and rewrites the whole file from memory.
+        """
+        with self._writing() as (df, index):
+            self._columns = QuestionColumns(compact_questions(df, self.path, index))
+            df = self._columns.frame()
+            self._mark_written(df, QuestionIndex.from_dataframe(df))
+
+    def replace(self, df: pd.DataFrame):
+        """
+        Replaces the whole file with the DataFrame, e.g. with a fresh copy of the question source,
+        and reloads it. Pending deletions refer to the old file and are dropped.
+        """
+        with self._write_locked(), self._file_lock():
+            replace_csv(df, self.path)
+            self._load()
+
+    def is_loaded(self) -> bool:
+        return self._state is not None
+
+    def is_in_memory(self) -> bool:
+        return self._state is not None and not self.is_stale()
+
+    def stats(self) -> dict:
+        with self._lock:
+            state, generation, writers = self._state, self.generation, self._writers
+        if state is None:
+            return {"loaded": False, "load_error": self.load_error}
+        df, index = state
+        return {
+            "loaded": True,
+            "generation": generation,
+            "rows": len(df) - len(index.tombstones),
+            "tombstoned_rows": len(index.tombstones),
+            "last_reload": self.loaded_at,
+            "load_duration_seconds": self.load_duration,
+            "load_error": self.load_error,
+            "writers": writers,
+            "compacting": self.compaction_thread is not None and self.compaction_thread.is_alive(),
+        }
+
+    def find_questions(self, use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> List[CSVQuestion]:
+        df, index = self.snapshot()
+        return get_questions(use, subjects, num_questions, df, index, seed, weights)
+
+    def _versioned_snapshot(self) -> Tuple[pd.DataFrame, QuestionIndex, int]:
+        pinned = getattr(self._pinned, 'state', None)
+        if pinned is not None:
+            return pinned
+        self.snapshot()
+        with self._lock:
+            df, index = self._state
+            return df, index, self.generation
+
+    def find_question_ids(self, use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> Tuple[int, List[int]]:
+        df, index, generation = self._versioned_snapshot()
+        return generation, sample_question_labels(use, subjects, num_questions, index, seed, weights).tolist()
+
+    def find_candidate_ids(self, use: str, subjects: List[str]) -> Tuple[int, List[np.ndarray]]:
+        df, index, generation = self._versioned_snapshot()
+        # The index buckets are read-only, so they are shared instead of copied
+        return generation, question_candidates(use, subjects, index)
+
+    def get_question_rows(self, ids: List[int]) -> Tuple[int, List[dict]]:
+        df, index, generation = self._versioned_snapshot()
+        return generation, get_question_rows(ids, df)
+
+    def _derived_index(self, kind: type) -> Tuple[pd.DataFrame, QuestionIndex, int, object]:
+        # The snapshot with the derived index of `kind` current for it, built if needed
+        df, index, generation = self._versioned_snapshot()
+        derived = self._derived.get(kind)
+        if derived is not None and derived[0] == generation:
+            return df, index, generation, derived[1]
+        if getattr(self._pinned, 'state', None) is not None:
+            # The pinned snapshot may be older than the published one, so its index is not kept
+            with stage("derived_index"):
+                return df, index, generation, kind.from_dataframe(df, index.tombstones)
+        # Built under the write lock, so no write can be missed while the rows are read
+        with self._write_locked():
+            df, index, generation = self._versioned_snapshot()
+            derived = self._derived.get(kind)
+            if derived is None or derived[0] != generation:
+                with stage("derived_index"):
+                    derived = (generation, kind.from_dataframe(df, index.tombstones))
+                with self._lock:
+                    if self.generation == generation:
+                        self._derived = {**self._derived, kind: derived}
+            return df, index, generation, derived[1]
+
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[int, int, List[int]]:
+        df, index, generation, search_index = self._derived_index(SearchIndex)
+        total, labels = search_index.search(query, limit, offset)
+        return generation, total, labels
+
+    def find_near_duplicates(self, question: CSVQuestion, threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple[dict, float]]:
+        df, index, generation, duplicates = self._derived_index(NearDuplicateIndex)
+        # Writers update the index in place, so it may know rows added or removed after this snapshot
+        last = df.index[-1] if len(df) else -1
+        labels = [label for label in duplicates.candidates(question.question) if label <= last and label not in index.tombstones]
+        rows = [row for row in get_question_rows(labels, df) if row['subject'] == question.subject]
+        return rank_near_duplicates(question.question, rows, threshold)
+
+    def list_question_ids(self, after: int, limit: int, use: Optional[str] = None, subjects: Optional[List[str]] = None, anchor: Optional[str] = None) -> Tuple[int, List[int]]:
+        df, index, generation = self._versioned_snapshot()
+        buckets = listing_buckets(use, subjects, index)
+        # A compaction renumbers the rows
+        if anchor is not None:
+            check_anchor(after, anchor, df)
+        return generation, labels_after(buckets, after, limit).tolist()
+
+    def iter_question_rows(self, use: Optional[str] = None, subjects: Optional[List[str]] = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[dict]]:
+        df, index = self.snapshot()
+        return self._iter_rows(df, listing_buckets(use, subjects, index), chunk_size)
+
+    @staticmethod
+    def _iter_rows(df: pd.DataFrame, buckets: List[np.ndarray], chunk_size: int) -> Iterator[List[dict]]:
+        # The snapshot is pinned: writes publish new buckets and compactions a new DataFrame,
+        # so the export is consistent however long it takes
+        after = -1
+        while True:
+            labels = labels_after(buckets, after, chunk_size)
+            if not len(labels):
+                return
+            yield get_question_rows(labels.tolist(), df)
+            after = int(labels[-1])
+
+    def current_generation(self) -> int:
+        return self._versioned_snapshot()[2]
+
+    @contextmanager
+    def pinned(self) -> Iterator[None]:
+        # Published snapshots are never changed, so holding one is enough; writers are not
+        # held off. A change written before the block is picked up first, as by any read
+        if getattr(self._pinned, 'state', None) is not None:
+            yield
+            return
+        self._pinned.state = self._versioned_snapshot()
+        try:
+            yield
+        finally:
+            self._pinned.state = None
+
+    def contains_keys(self, keys: List[Tuple[str, str]]) -> np.ndarray:
+        index = self.index
+        return np.fromiter((index.find(question, subject) is not None for question, subject in keys), dtype=bool, count=len(keys))
+
+    def get_subjects(self) -> List[str]:
+        return list(self.index.subjects)
+
+    def get_uses(self) -> List[str]:
+        return list(self.index.uses)
+
+    def is_stale(self) -> bool:
+        """
+        Checks whether the file or its deletion log changed on disk since the last load.
+
+        Returns:
+            bool: True if the file's mtime or size differs from the loaded snapshot.
+        """
+        try:
+            return self._file_stat() != self._stat
+        except FileNotFoundError:
+            # Keep serving the last good snapshot while the file is missing
+            return False
+
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        """
+        Returns the in-memory DataFrame, loading it on first access or when the file changed.
+        """
+        return self.snapshot()[0]
+
+    @property
+    def index(self) -> QuestionIndex:
+        """
+        Returns the (use, subject) index of the in-memory DataFrame.
+        """
+        return self.snapshot()[1]
+
+    def snapshot(self) -> Tuple[pd.DataFrame, QuestionIndex]:
+        """
+        Returns the DataFrame and its index as a consistent pair, reloading them first if needed.
+        Only the very first load waits for a writer; afterwards a stale snapshot is served
+        until the reload can run without blocking.
+        """
+        pinned = getattr(self._pinned, 'state', None)
+        if pinned is not None:
+            return pinned[:2]
+        if self._state is None:
+            self.load()
+        elif self.is_stale():
+            self._try_reload()
+        return self._state
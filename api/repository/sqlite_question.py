@@ -0,0 +1,463 @@
+import queue
+import random
+import sqlite3
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from csv_management import EXPORT_CHUNK_SIZE, IMPORT_CHUNK_SIZE, check_quotas, stream_questions, subject_quotas
+from models import CSVQuestion, ImportReport
+from near_duplicates import BANDS, MAX_BUCKET_SIZE, MAX_CANDIDATES, SHINGLES_VERSION, SIGNATURE_CHUNK_SIZE, SIMILARITY_THRESHOLD, band_keys, has_words, rank_near_duplicates
+from repository.question import QuestionRepository
+from search_index import FIELD_WEIGHTS, tokenize
+
+COLUMNS = ['question', 'subject', 'use', 'correct', 'responseA', 'responseB', 'responseC', 'responseD', 'remark']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    question TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    "use" TEXT NOT NULL,
+    correct TEXT NOT NULL CHECK (correct <> ''),
+    responseA TEXT NOT NULL DEFAULT '',
+    responseB TEXT NOT NULL DEFAULT '',
+    responseC TEXT NOT NULL DEFAULT '',
+    responseD TEXT NOT NULL DEFAULT '',
+    remark TEXT NOT NULL DEFAULT '',
+    UNIQUE (question, subject)
+);
+CREATE INDEX IF NOT EXISTS idx_questions_use_subject ON questions ("use", subject);
+CREATE TABLE IF NOT EXISTS meta (generation INTEGER NOT NULL);
+INSERT INTO meta (generation) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM meta);
+CREATE TRIGGER IF NOT EXISTS questions_insert AFTER INSERT ON questions
+    BEGIN UPDATE meta SET generation = generation + 1; END;
+CREATE TRIGGER IF NOT EXISTS questions_delete AFTER DELETE ON questions
+    BEGIN UPDATE meta SET generation = generation + 1; END;
+CREATE VIRTUAL TABLE IF NOT EXISTS questions_search USING fts5(
+    question, responseA, responseB, responseC, responseD, remark,
+    content='questions', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS questions_search_insert AFTER INSERT ON questions BEGIN
+    INSERT INTO questions_search (rowid, question, responseA, responseB, responseC, responseD, remark)
+    VALUES (new.id, new.question, new.responseA, new.responseB, new.responseC, new.responseD, new.remark);
+END;
+CREATE TRIGGER IF NOT EXISTS questions_search_delete AFTER DELETE ON questions BEGIN
+    INSERT INTO questions_search (questions_search, rowid, question, responseA, responseB, responseC, responseD, remark)
+    VALUES ('delete', old.id, old.question, old.responseA, old.responseB, old.responseC, old.responseD, old.remark);
+END;
+CREATE TABLE IF NOT EXISTS question_bands (
+    band INTEGER NOT NULL,
+    band_key INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (band, band_key, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_question_bands_id ON question_bands (id);
+CREATE TRIGGER IF NOT EXISTS questions_bands_delete AFTER DELETE ON questions
+    BEGIN DELETE FROM question_bands WHERE id = old.id; END;
+"""
+
+# Three parameters per key, below the 32766 variables SQLite accepts per statement
+KEYS_PER_QUERY = 5000
+
+SELECT_COLUMNS = ', '.join(f'"{column}"' for column in COLUMNS)
+INSERT = f"INSERT INTO questions ({SELECT_COLUMNS}) VALUES ({', '.join('?' for _ in COLUMNS)})"
+INSERT_OR_IGNORE = INSERT.replace('INSERT', 'INSERT OR IGNORE', 1)
+# bm25() takes the weights in the order of the questions_search columns
+SEARCH_ORDER = "bm25(questions_search, {weights}), rowid".format(weights=', '.join(str(weight) for weight in FIELD_WEIGHTS.values()))
+
+
+def _placeholders(values: List[str]) -> str:
+    return ', '.join('?' for _ in values)
+
+def _row(question: CSVQuestion) -> tuple:
+    return tuple(getattr(question, column) or '' for column in COLUMNS)
+
+def _insert_bands(connection: sqlite3.Connection, ids: List[int], texts: List[str]):
+    # The near-duplicate band keys are computed in Python, so they are written by the inserts rather than by a trigger
+    keys = band_keys(texts)
+    connection.executemany('INSERT OR IGNORE INTO question_bands (band, band_key, id) VALUES (?, ?, ?)', (
+        (band, key, id_) for id_, row_keys, words in zip(ids, keys.tolist(), has_words(keys)) if words
+        for band, key in enumerate(row_keys)
+    ))
+
+def _index_bands(connection: sqlite3.Connection):
+    # Files the questions inserted without their band keys, e.g. by `migrate_csv`, a chunk at a time
+    last = -1
+    while True:
+        rows = connection.execute(
+            'SELECT id, question FROM questions WHERE id > ? AND NOT EXISTS (SELECT 1 FROM question_bands WHERE question_bands.id = questions.id) '
+            'ORDER BY id LIMIT ?',
+            (last, SIGNATURE_CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        _insert_bands(connection, [row[0] for row in rows], [row[1] for row in rows])
+        last = rows[-1][0]
+
+def _distinct(connection: sqlite3.Connection, column: str) -> List[str]:
+    # Values in order of first appearance, like pandas' unique()
+    return [row[0] for row in connection.execute(f'SELECT "{column}" FROM questions GROUP BY "{column}" ORDER BY MIN(id)')]
+
+
+class SQLiteQuestionRepository(QuestionRepository):
+    """
+    Question repository backed by a SQLite database in WAL mode.
+
+    Filtering uses the (use, subject) index and the UNIQUE (question, subject) constraint
+    rejects duplicates, so no DataFrame is kept in memory. Connections come from a small
+    pool shared by the request threads. `generation` and the FTS5 search table are
+    maintained by triggers, so they also reflect writes made by other workers.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool: Optional[queue.Queue] = None
+        self._lock = threading.Lock()
+        # The connection each thread reads from while the repository is pinned
+        self._pinned = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def load(self):
+        """
+        Creates the schema if needed and opens the connection pool.
+        """
+        with self._lock:
+            if self._pool is not None:
+                return
+            pool = queue.Queue(maxsize=self.pool_size)
+            for _ in range(self.pool_size):
+                pool.put(self._connect())
+            with self._borrow(pool) as connection:
+                tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                connection.executescript(SCHEMA)
+                # Databases created before the search table existed get their rows indexed once, and
+                # band keys stored by an older version of the shingles (or not at all) are recomputed
+                with connection:
+                    if 'questions_search' not in tables:
+                        connection.execute("INSERT INTO questions_search (questions_search) VALUES ('rebuild')")
+                    if 'question_bands' not in tables or connection.execute('PRAGMA user_version').fetchone()[0] < SHINGLES_VERSION:
+                        connection.execute('DELETE FROM question_bands')
+                        connection.execute(f'PRAGMA user_version = {SHINGLES_VERSION}')
+                        _index_bands(connection)
+            self._pool = pool
+
+    def close(self):
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        while not pool.empty():
+            pool.get_nowait().close()
+
+    def is_loaded(self) -> bool:
+        return self._pool is not None
+
+    def stats(self) -> dict:
+        # The generation and row count live in the database, which readiness must not query
+        pool = self._pool
+        if pool is None:
+            return {"loaded": False}
+        return {"loaded": True, "idle_connections": pool.qsize(), "pool_size": self.pool_size}
+
+    @contextmanager
+    def _borrow(self, pool: queue.Queue) -> Iterator[sqlite3.Connection]:
+        connection = pool.get()
+        try:
+            yield connection
+        finally:
+            pool.put(connection)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrows a connection from the pool, waiting if they are all in use.
+        """
+        pinned = getattr(self._pinned, 'connection', None)
+        if pinned is not None:
+            yield pinned
+            return
+        if self._pool is None:
+            self.load()
+        with self._borrow(self._pool) as connection:
+            yield connection
+
+    @property
+    def generation(self) -> int:
+        with self.connection() as connection:
+            return connection.execute('SELECT generation FROM meta').fetchone()[0]
+
+    def __len__(self) -> int:
+        with self.connection() as connection:
+            return connection.execute('SELECT COUNT(*) FROM questions').fetchone()[0]
+
+    def get_subjects(self) -> List[str]:
+        with self.connection() as connection:
+            return _distinct(connection, 'subject')
+
+    def get_uses(self) -> List[str]:
+        with self.connection() as connection:
+            return _distinct(connection, 'use')
+
+    def _sample_ids(self, connection: sqlite3.Connection, use: str, subjects: List[str], num_questions: int, seed: Optional[int], weights: Optional[List[float]]) -> List[int]:
+        # The quotas are split over the subjects as requested, repeated ones included
+        quotas = subject_quotas(subjects, num_questions, weights) if weights is not None else None
+        subjects = list(dict.fromkeys(subjects))
+        self._check_criteria(connection, use, subjects)
+        if quotas is not None:
+            return self._sample_quota_ids(connection, use, quotas, seed)
+
+        ids = self._candidate_ids(connection, use, subjects)
+        if len(ids) < num_questions:
+            raise ValueError("Not enough questions available for the specified criteria. Number of questions available: {questions}".format(questions=len(ids)))
+        return random.Random(seed).sample(ids, num_questions)
+
+    @staticmethod
+    def _check_criteria(connection: sqlite3.Connection, use: Optional[str], subjects: Optional[List[str]]):
+        # A None filter is not checked
+        if use is not None and connection.execute('SELECT 1 FROM questions WHERE "use" = ? LIMIT 1', (use,)).fetchone() is None:
+            raise ValueError("The use you provide is not available. Availables Uses are: {uses}".format(uses=_distinct(connection, 'use')))
+        if subjects is None:
+            return
+        known = connection.execute(
+            f'SELECT COUNT(DISTINCT subject) FROM questions WHERE subject IN ({_placeholders(subjects)})', subjects
+        ).fetchone()[0]
+        if known < len(subjects):
+            raise ValueError("The subjects you provide are not available. Availables Subjects are: {subjects}".format(subjects=_distinct(connection, 'subject')))
+
+    @staticmethod
+    def _candidate_ids(connection: sqlite3.Connection, use: str, subjects: List[str]) -> List[int]:
+        # Only the ids are read from the (use, subject) index, full rows are fetched for the sample
+        return [row[0] for row in connection.execute(
+            f'SELECT id FROM questions WHERE "use" = ? AND subject IN ({_placeholders(subjects)}) ORDER BY id', [use, *subjects]
+        )]
+
+    @staticmethod
+    def _sample_quota_ids(connection: sqlite3.Connection, use: str, quotas: Dict[str, int], seed: Optional[int]) -> List[int]:
+        subjects = list(quotas)
+        ids: Dict[str, List[int]] = {subject: [] for subject in subjects}
+        for subject, id_ in connection.execute(
+            f'SELECT subject, id FROM questions WHERE "use" = ? AND subject IN ({_placeholders(subjects)}) ORDER BY id', [use, *subjects]
+        ):
+            ids[subject].append(id_)
+        check_quotas(quotas, {subject: len(subject_ids) for subject, subject_ids in ids.items()})
+        rng = random.Random(seed)
+        sample = [id_ for subject, quota in quotas.items() for id_ in rng.sample(ids[subject], quota)]
+        rng.shuffle(sample)
+        return sample
+
+    @staticmethod
+    def _rows(connection: sqlite3.Connection, ids: List[int]) -> List[tuple]:
+        rows = dict(
+            (row[0], row[1:]) for row in connection.execute(
+                f'SELECT id, {SELECT_COLUMNS} FROM questions WHERE id IN ({_placeholders(ids)})', ids
+            )
+        )
+        return [rows[id_] for id_ in ids]
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        # A read transaction gives every statement the same WAL snapshot
+        pinned = getattr(self._pinned, 'connection', None)
+        if pinned is not None:
+            # Already in the read transaction of `pinned`
+            yield pinned
+            return
+        with self.connection() as connection:
+            connection.execute('BEGIN')
+            try:
+                yield connection
+            finally:
+                connection.rollback()
+
+    @contextmanager
+    def pinned(self) -> Iterator[None]:
+        # Every read of the block shares one read transaction; writers are not held off
+        with self._reading() as connection:
+            # The snapshot is taken by the first read, not by BEGIN
+            connection.execute('SELECT generation FROM meta').fetchone()
+            self._pinned.connection = connection
+            try:
+                yield
+            finally:
+                self._pinned.connection = None
+
+    def find_questions(self, use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> List[CSVQuestion]:
+        with self._reading() as connection:
+            rows = self._rows(connection, self._sample_ids(connection, use, subjects, num_questions, seed, weights))
+        return [CSVQuestion(**dict(zip(COLUMNS, row))) for row in rows]
+
+    def find_question_ids(self, use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> Tuple[int, List[int]]:
+        with self._reading() as connection:
+            generation = connection.execute('SELECT generation FROM meta').fetchone()[0]
+            return generation, self._sample_ids(connection, use, subjects, num_questions, seed, weights)
+
+    def find_candidate_ids(self, use: str, subjects: List[str]) -> Tuple[int, List[np.ndarray]]:
+        subjects = list(dict.fromkeys(subjects))
+        with self._reading() as connection:
+            generation = connection.execute('SELECT generation FROM meta').fetchone()[0]
+            self._check_criteria(connection, use, subjects)
+            ids = np.array(self._candidate_ids(connection, use, subjects), dtype=np.int64)
+        ids.flags.writeable = False
+        return generation, [ids]
+
+    def get_question_rows(self, ids: List[int]) -> Tuple[int, List[dict]]:
+        with self._reading() as connection:
+            generation = connection.execute('SELECT generation FROM meta').fetchone()[0]
+            rows = self._rows(connection, ids)
+        return generation, [dict(zip(COLUMNS, row)) for row in rows]
+
+    @classmethod
+    def _listing_filter(cls, connection: sqlite3.Connection, use: Optional[str], subjects: Optional[List[str]]) -> Tuple[str, list]:
+        # Validates the optional filters and returns their SQL conditions and parameters
+        subjects = list(dict.fromkeys(subjects)) if subjects is not None else None
+        cls._check_criteria(connection, use, subjects)
+        conditions, parameters = '', []
+        if use is not None:
+            conditions += ' AND "use" = ?'
+            parameters.append(use)
+        if subjects is not None:
+            conditions += f' AND subject IN ({_placeholders(subjects)})'
+            parameters += subjects
+        return conditions, parameters
+
+    def list_question_ids(self, after: int, limit: int, use: Optional[str] = None, subjects: Optional[List[str]] = None, anchor: Optional[str] = None) -> Tuple[int, List[int]]:
+        # Ids are never renumbered, so the anchor is not needed: rows deleted meanwhile are simply skipped
+        with self._reading() as connection:
+            generation = connection.execute('SELECT generation FROM meta').fetchone()[0]
+            conditions, parameters = self._listing_filter(connection, use, subjects)
+            ids = [row[0] for row in connection.execute(
+                f'SELECT id FROM questions WHERE id > ?{conditions} ORDER BY id LIMIT ?', [after, *parameters, limit]
+            )]
+        return generation, ids
+
+    def iter_question_rows(self, use: Optional[str] = None, subjects: Optional[List[str]] = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[dict]]:
+        with self._reading() as connection:
+            conditions, parameters = self._listing_filter(connection, use, subjects)
+        return self._iter_rows(conditions, parameters, chunk_size)
+
+    def _iter_rows(self, conditions: str, parameters: list, chunk_size: int) -> Iterator[List[dict]]:
+        # Keyset pagination on the primary key: a connection is only borrowed per chunk,
+        # never while the consumer holds the iterator
+        after = -1
+        while True:
+            with self.connection() as connection:
+                rows = connection.execute(
+                    f'SELECT id, {SELECT_COLUMNS} FROM questions WHERE id > ?{conditions} ORDER BY id LIMIT ?',
+                    [after, *parameters, chunk_size]
+                ).fetchall()
+            if not rows:
+                return
+            yield [dict(zip(COLUMNS, row[1:])) for row in rows]
+            after = rows[-1][0]
+
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[int, int, List[int]]:
+        # The words are folded and quoted like the CSV search, so FTS5 operators in the query are not interpreted
+        terms = list(dict.fromkeys(tokenize(query)))
+        match = ' '.join('"{term}"'.format(term=term) for term in terms)
+        with self._reading() as connection:
+            generation = connection.execute('SELECT generation FROM meta').fetchone()[0]
+            if not terms:
+                return generation, 0, []
+            total = connection.execute('SELECT COUNT(*) FROM questions_search WHERE questions_search MATCH ?', (match,)).fetchone()[0]
+            ids = [row[0] for row in connection.execute(
+                f'SELECT rowid FROM questions_search WHERE questions_search MATCH ? ORDER BY {SEARCH_ORDER} LIMIT ? OFFSET ?',
+                (match, limit, offset)
+            )]
+        return generation, total, ids
+
+    def find_near_duplicates(self, question: CSVQuestion, threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple[dict, float]]:
+        keys = band_keys([question.question])
+        if not has_words(keys)[0]:
+            return []
+        values = ', '.join('(?, ?)' for _ in range(BANDS))
+        with self._reading() as connection:
+            # Like NearDuplicateIndex.candidates: the questions sharing the most bands first
+            ids = [row[0] for row in connection.execute(
+                f'WITH keys(band, band_key) AS (VALUES {values}), '
+                'selective(band, band_key) AS (SELECT band, band_key FROM keys WHERE (SELECT COUNT(*) FROM ('
+                'SELECT 1 FROM question_bands WHERE question_bands.band = keys.band AND question_bands.band_key = keys.band_key LIMIT ?)) <= ?) '
+                'SELECT id FROM selective JOIN question_bands USING (band, band_key) '
+                'GROUP BY id ORDER BY COUNT(*) DESC, id LIMIT ?',
+                [*(value for band, key in enumerate(keys[0].tolist()) for value in (band, key)), MAX_BUCKET_SIZE + 1, MAX_BUCKET_SIZE, MAX_CANDIDATES]
+            )]
+            rows = [dict(zip(COLUMNS, row)) for row in self._rows(connection, ids)]
+        return rank_near_duplicates(question.question, [row for row in rows if row['subject'] == question.subject], threshold)
+
+    def contains_keys(self, keys: List[Tuple[str, str]]) -> np.ndarray:
+        stored = np.zeros(len(keys), dtype=bool)
+        with self._reading() as connection:
+            # Joined in batches against the UNIQUE (question, subject) index, within SQLite's variable limit
+            for start in range(0, len(keys), KEYS_PER_QUERY):
+                batch = keys[start:start + KEYS_PER_QUERY]
+                values = ', '.join('(?, ?, ?)' for _ in batch)
+                parameters = [value for position, key in enumerate(batch, start) for value in (position, *key)]
+                positions = [row[0] for row in connection.execute(
+                    f'WITH keys(position, question, subject) AS (VALUES {values}) '
+                    'SELECT keys.position FROM keys JOIN questions ON questions.question = keys.question AND questions.subject = keys.subject',
+                    parameters
+                )]
+                stored[positions] = True
+        return stored
+
+    def add(self, question: CSVQuestion):
+        self.add_many([question])
+
+    def add_many(self, questions: List[CSVQuestion]):
+        for question in questions:
+            if question.correct == "":
+                raise ValueError("Question correct answer can't be empty: {question}".format(question=question.question))
+        with self.connection() as connection:
+            try:
+                with connection:
+                    ids = [connection.execute(INSERT, _row(question)).lastrowid for question in questions]
+                    _insert_bands(connection, ids, [question.question for question in questions])
+            except sqlite3.IntegrityError:
+                raise ValueError("Question already exists")
+
+    def remove_many(self, questions: List[CSVQuestion]) -> int:
+        with self.connection() as connection:
+            with connection:
+                for question in questions:
+                    deleted = connection.execute(
+                        'DELETE FROM questions WHERE question = ? AND subject = ?', (question.question, question.subject)
+                    ).rowcount
+                    if not deleted:
+                        # Leaving the `with connection` block with an exception rolls the batch back
+                        raise ValueError("Question does not exist: {question}".format(question=question.question))
+        return len(questions)
+
+
+def migrate_csv(csv_path: str, repository: SQLiteQuestionRepository, report: Optional[ImportReport] = None, chunksize: int = IMPORT_CHUNK_SIZE) -> int:
+    """
+    Copies the questions of a CSV file produced by `load_csv` into a SQLite repository.
+    Rows whose (question, subject) pair is already stored are skipped. The file is read
+    and cleaned in chunks inside a single transaction, so memory does not grow with its size.
+
+    Args:
+        csv_path (str): The path to the CSV file.
+        repository (SQLiteQuestionRepository): The destination repository.
+        report (Optional[ImportReport]): The report to count accepted and rejected rows in.
+        chunksize (int): The number of rows per chunk.
+
+    Returns:
+        int: The number of questions inserted.
+    """
+    before = len(repository)
+    with repository.connection() as connection:
+        with connection:
+            for chunk in stream_questions(csv_path, report or ImportReport(), chunksize):
+                connection.executemany(INSERT_OR_IGNORE, chunk[COLUMNS].astype(str).itertuples(index=False, name=None))
+            _index_bands(connection)
+    return len(repository) - before
+
+
+if __name__ == "__main__":
+    import sys
+    repository = SQLiteQuestionRepository(sys.argv[2])
+    print(f"{migrate_csv(sys.argv[1], repository)} questions migrated to {sys.argv[2]}")
@@ -0,0 +1,52 @@
+import csv
+from typing import Dict, Iterator, Optional
+from models import User
+
+
+class UserRepository:
+    """
+    Name-keyed store of users loaded from a CSV file of pre-hashed passwords.
+
+    The file (columns: id, name, password) is read once on first access; no password is
+    hashed at startup and lookups are a single dict access.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._users: Optional[Dict[str, User]] = None
+
+    def load(self) -> Dict[str, User]:
+        """
+        Reads the users file and replaces the in-memory users.
+
+        Returns:
+            Dict[str, User]: The users keyed by name.
+        """
+        with open(self.path, newline='', encoding='utf-8') as file:
+            users = {
+                row['name']: User(id=int(row['id']), name=row['name'], password=row['password'])
+                for row in csv.DictReader(file)
+            }
+        self._users = users
+        return users
+
+    @property
+    def users(self) -> Dict[str, User]:
+        if self._users is None:
+            return self.load()
+        return self._users
+
+    def get(self, name: str) -> Optional[User]:
+        return self.users.get(name)
+
+    def add(self, user: User):
+        """
+        Adds or replaces a user in memory. `user.password` must already be hashed.
+        """
+        self.users[user.name] = user
+
+    def __iter__(self) -> Iterator[User]:
+        return iter(list(self.users.values()))
+
+    def __len__(self) -> int:
+        return len(self.users)
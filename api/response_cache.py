@@ -0,0 +1,158 @@
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, TypeVar
+from metrics import cache_lookup, stage
+
+
+T = TypeVar('T')
+
+# Reads of ids and rows that may see the repository change before it is pinned
+CONSISTENT_READ_ATTEMPTS = 3
+
+
+class EncodedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def encode_json(value) -> bytes:
+    # Same encoding as FastAPI's JSONResponse
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def make_etag(body: bytes) -> str:
+    return '"{digest}"'.format(digest=hashlib.blake2b(body, digest_size=16).hexdigest())
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Checks an If-None-Match header against an ETag, using the weak comparison of RFC 9110.
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in (candidate.removeprefix('W/') for candidate in candidates)
+
+def read_consistently(repository, read: Callable[[], Optional[T]]) -> T:
+    """
+    Runs `read`, which returns None when the repository changed between the reads it made,
+    until it returns a value. After CONSISTENT_READ_ATTEMPTS, `read` runs once more with
+    the repository pinned, so a steady stream of writes cannot keep a reader retrying.
+    """
+    for _ in range(CONSISTENT_READ_ATTEMPTS):
+        value = read()
+        if value is not None:
+            return value
+    with repository.pinned():
+        value = read()
+    if value is None:
+        raise RuntimeError("The repository changed while it was pinned")
+    return value
+
+def _encoded(value) -> EncodedResponse:
+    body = encode_json(value)
+    return EncodedResponse(body, make_etag(body))
+
+
+class ResponseCache:
+    """
+    Pre-encoded JSON bodies for the question routes, versioned by the repository generation.
+
+    The subjects and uses lists are encoded once per generation and each question row once
+    per generation, so serving them does no pandas or pydantic work. Everything cached for
+    a generation lives in a single tuple that is replaced as a whole when the generation
+    changes, so a mutation invalidates the subjects, uses and rows together.
+    """
+
+    def __init__(self, max_rows: int = 100_000):
+        self.max_rows = max_rows
+        # (repository, generation, subjects, uses, rows)
+        self._state: Optional[tuple] = None
+        self._lock = threading.Lock()
+
+    def _current(self, repository, generation: int) -> tuple:
+        state = self._state
+        if state is not None and state[0] is repository and state[1] == generation:
+            return state
+        with self._lock:
+            state = self._state
+            if state is not None and state[0] is repository and state[1] >= generation:
+                if state[1] == generation:
+                    return state
+                # A request that started on an older generation must not evict the newer one
+                return (repository, generation, None, None, {})
+            state = (repository, generation, None, None, {})
+            self._state = state
+        return state
+
+    def subjects(self, repository) -> EncodedResponse:
+        state = self._current(repository, repository.current_generation())
+        cache_lookup("subjects", state[2] is not None)
+        if state[2] is None:
+            encoded = _encoded(repository.get_subjects())
+            self._replace(state, subjects=encoded)
+            return encoded
+        return state[2]
+
+    def uses(self, repository) -> EncodedResponse:
+        state = self._current(repository, repository.current_generation())
+        cache_lookup("uses", state[3] is not None)
+        if state[3] is None:
+            encoded = _encoded(repository.get_uses())
+            self._replace(state, uses=encoded)
+            return encoded
+        return state[3]
+
+    def _replace(self, state: tuple, subjects: Optional[EncodedResponse] = None, uses: Optional[EncodedResponse] = None):
+        # Only fills the state it was computed for; a newer generation discards the value
+        with self._lock:
+            if self._state is state:
+                self._state = (state[0], state[1], subjects or state[2], uses or state[3], state[4])
+
+    def questions(self, repository, use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> EncodedResponse:
+        """
+        Draws questions like `find_questions` and returns the encoded JSON list.
+
+        Raises:
+            ValueError: If the use or a subject is unknown or if there are not enough questions.
+        """
+        def read() -> Optional[EncodedResponse]:
+            generation, ids = repository.find_question_ids(use, subjects, num_questions, seed, weights)
+            encoded = self.encoded_rows(repository, generation, ids)
+            if encoded is None:
+                # The rows were read from a newer generation and may not match the drawn ids
+                return None
+            body = b'[' + b','.join(encoded) + b']'
+            return EncodedResponse(body, make_etag(body))
+        return read_consistently(repository, read)
+
+    def encoded_rows(self, repository, generation: int, ids: List[int]) -> Optional[List[bytes]]:
+        """
+        Returns the JSON encoding of the rows with the given ids, as of `generation`.
+
+        Returns:
+            Optional[List[bytes]]: One encoded row per id, or None if the repository changed since `generation`.
+        """
+        rows = self._current(repository, generation)[4]
+        missing = [id_ for id_ in dict.fromkeys(ids) if id_ not in rows]
+        fetched = {}
+        if missing:
+            with stage("serialize"):
+                fetched = self._fetch(repository, generation, missing)
+            if fetched is None:
+                return None
+            if len(rows) + len(fetched) <= self.max_rows:
+                rows.update(fetched)
+        cache_lookup("rows", True, len(ids) - len(missing))
+        cache_lookup("rows", False, len(missing))
+        return [rows[id_] if id_ in rows else fetched[id_] for id_ in ids]
+
+    @staticmethod
+    def _fetch(repository, generation: int, ids: List[int]) -> Optional[Dict[int, bytes]]:
+        try:
+            rows_generation, rows = repository.get_question_rows(ids)
+        except KeyError:
+            # The ids were relabelled by a newer generation
+            return None
+        if rows_generation != generation:
+            return None
+        return {id_: encode_json(row) for id_, row in zip(ids, rows)}
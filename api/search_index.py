@@ -0,0 +1,240 @@
+import math
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from typing import Dict, Iterable, List, Mapping, Set, Tuple
+
+# Matches in the question count more than in the answers, and the remark counts least
+FIELD_WEIGHTS = {
+    'question': 2.0,
+    'responseA': 1.0,
+    'responseB': 1.0,
+    'responseC': 1.0,
+    'responseD': 1.0,
+    'remark': 0.5,
+}
+# Frequent French words, not indexed since they match most questions
+STOPWORDS = frozenset("""
+    a au aux avec ce ces c d dans de des du elle en est et il ils j l la le les leur lui ma mais me
+    mes mon n ne nos notre nous on ou par pas pour qu que qui s sa se ses son sur t ta te tes ton tu
+    un une vos votre vous y
+""".split())
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+# Ligatures that NFKD does not decompose
+_LIGATURES = str.maketrans({'œ': 'oe', 'Œ': 'OE', 'æ': 'ae', 'Æ': 'AE'})
+
+def fold(text: str) -> str:
+    """
+    Removes the accents and the case of a text, so that "Élève" and "eleve" match.
+    """
+    decomposed = unicodedata.normalize('NFKD', text.translate(_LIGATURES))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+def tokenize(text: str, stopwords: Set[str] = STOPWORDS) -> List[str]:
+    """
+    Splits a text into folded words, without the stopwords.
+    """
+    return [token for token in _TOKEN.findall(fold(text)) if token not in stopwords]
+
+def _weighted_terms(row: Mapping[str, object]) -> Dict[str, float]:
+    terms: Dict[str, float] = defaultdict(float)
+    for field, weight in FIELD_WEIGHTS.items():
+        value = row.get(field)
+        if isinstance(value, str):
+            for token in tokenize(value):
+                terms[token] += weight
+    return terms
+
+
+class _Growable:
+    # Append-only numpy array: readers slice the first `size` items, which are never rewritten
+    __slots__ = ('values', 'size')
+
+    def __init__(self, values: np.ndarray):
+        self.values = values
+        self.size = len(values)
+
+    def append(self, value):
+        if self.size == len(self.values):
+            grown = np.empty(max(4, 2 * self.size), dtype=self.values.dtype)
+            grown[:self.size] = self.values[:self.size]
+            self.values = grown
+        self.values[self.size] = value
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        size = self.size
+        return self.values[:size]
+
+
+class _Postings:
+    # Labels in increasing order with the weighted term frequency of each
+    __slots__ = ('labels', 'frequencies')
+
+    def __init__(self, labels: np.ndarray, frequencies: np.ndarray):
+        self.labels = _Growable(labels)
+        self.frequencies = _Growable(frequencies)
+
+    def append(self, label: int, frequency: float):
+        # The frequency is written first, so a reader never sees a label without it
+        self.frequencies.append(frequency)
+        self.labels.append(label)
+
+    def __len__(self) -> int:
+        return self.labels.size
+
+
+class SearchIndex:
+    """
+    Inverted index of the question texts, keyed by folded word.
+
+    Each word maps to the row labels of the questions containing it, in increasing order,
+    with the field-weighted frequency of the word. A query keeps the questions that
+    contain every word: it walks the rarest word's postings and finds them in the others
+    by binary search, so its cost depends on how selective the query is, not on the size
+    of the bank. Results are ranked with BM25.
+
+    Rows are added in increasing label order and removals only flag the label, so
+    readers can query while a writer updates the index.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, _Postings] = {}
+        # Weighted length and liveness of every row, indexed by label
+        self._lengths = _Growable(np.empty(0, dtype=np.float32))
+        self._alive = _Growable(np.empty(0, dtype=bool))
+        self.documents = 0
+        self.total_length = 0.0
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, exclude: Iterable[int] = ()) -> "SearchIndex":
+        """
+        Builds the index over the rows of a DataFrame of questions.
+
+        Args:
+            df (pd.DataFrame): The DataFrame containing the questions, with increasing labels.
+            exclude (Iterable[int]): Labels of rows that must not be found, e.g. tombstoned rows.
+
+        Returns:
+            SearchIndex: The index over the DataFrame row labels.
+        """
+        index = cls()
+        labels = df.index.to_numpy(dtype=np.int64)
+        size = int(labels.max()) + 1 if len(labels) else 0
+        lengths = np.zeros(size, dtype=np.float32)
+        alive = np.zeros(size, dtype=bool)
+        excluded = set(exclude)
+        columns = {field: df[field].to_numpy() for field in FIELD_WEIGHTS if field in df.columns}
+        postings: Dict[str, Tuple[List[int], List[float]]] = defaultdict(lambda: ([], []))
+        for position, label in enumerate(labels.tolist()):
+            if label in excluded:
+                continue
+            terms = _weighted_terms({field: values[position] for field, values in columns.items()})
+            for term, frequency in terms.items():
+                term_labels, frequencies = postings[term]
+                term_labels.append(label)
+                frequencies.append(frequency)
+            lengths[label] = sum(terms.values())
+            alive[label] = True
+            index.documents += 1
+        index.postings = {
+            term: _Postings(np.array(term_labels, dtype=np.int64), np.array(frequencies, dtype=np.float32))
+            for term, (term_labels, frequencies) in postings.items()
+        }
+        index._lengths = _Growable(lengths)
+        index._alive = _Growable(alive)
+        index.total_length = float(lengths.sum())
+        return index
+
+    def add(self, label: int, row: Mapping[str, object]):
+        """
+        Indexes a new row, whose label must be greater than every label already indexed.
+
+        Raises:
+            ValueError: If the label is not greater than the labels already indexed.
+        """
+        if label < self._alive.size:
+            raise ValueError("Rows must be added in increasing label order")
+        terms = _weighted_terms(row)
+        while self._alive.size < label:
+            self._lengths.append(0.0)
+            self._alive.append(False)
+        self._lengths.append(sum(terms.values()))
+        for term, frequency in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                self.postings[term] = _Postings(np.array([label], dtype=np.int64), np.array([frequency], dtype=np.float32))
+            else:
+                postings.append(label, frequency)
+        self._alive.append(True)
+        self.documents += 1
+        self.total_length += sum(terms.values())
+
+    def remove(self, label: int):
+        """
+        Stops returning a row. Its postings stay until the index is rebuilt.
+        """
+        alive = self._alive.view()
+        if label < len(alive) and alive[label]:
+            alive[label] = False
+            self.documents -= 1
+            self.total_length -= float(self._lengths.view()[label])
+
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[int, List[int]]:
+        """
+        Finds the rows containing every word of the query, best matches first.
+
+        Args:
+            query (str): The words to look for; accents and case are ignored.
+            limit (int): The maximum number of labels to return.
+            offset (int): The number of best matches to skip, for pagination.
+
+        Returns:
+            Tuple[int, List[int]]: The total number of matching rows and the labels of the requested page.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        postings = [self.postings.get(term) for term in terms]
+        if not terms or any(term_postings is None for term_postings in postings):
+            return 0, []
+        alive = self._alive.view()
+        lengths = self._lengths.view()
+        documents = max(self.documents, 1)
+        average_length = self.total_length / documents if self.total_length > 0 else 1.0
+
+        # Rarest word first: the candidates only shrink from there
+        views = sorted(((term_postings.labels.view(), term_postings.frequencies.view()) for term_postings in postings),
+                       key=lambda view: len(view[0]))
+        candidates = views[0][0]
+        candidates = candidates[candidates < len(alive)]
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for term_labels, frequencies in views:
+            positions = np.searchsorted(term_labels, candidates)
+            found = positions < len(term_labels)
+            found[found] = term_labels[positions[found]] == candidates[found]
+            candidates, positions, scores = candidates[found], positions[found], scores[found]
+            frequency = frequencies[positions].astype(np.float64)
+            norm = K1 * (1 - B + B * lengths[candidates] / average_length)
+            idf = math.log(1 + (documents - len(term_labels) + 0.5) / (len(term_labels) + 0.5))
+            scores += idf * frequency * (K1 + 1) / (frequency + norm)
+
+        matches = alive[candidates]
+        candidates, scores = candidates[matches], scores[matches]
+        total = len(candidates)
+        end = min(offset + limit, total)
+        if offset >= end:
+            return total, []
+        if end < total:
+            best = np.argpartition(-scores, end - 1)[:end]
+            candidates, scores = candidates[best], scores[best]
+        # Best score first, then the oldest question
+        order = np.lexsort((candidates, -scores))[offset:end]
+        return total, candidates[order].tolist()
+
+    def __len__(self) -> int:
+        return self.documents
@@ -1,22 +1,188 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
 import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
 from passlib.context import CryptContext
+from executor import run_hashing
+from metrics import cache_lookup, stage
 from models import User
+from repository.user import UserRepository
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# Simulate a user database with hashed passwords
-users_db = [
-    User(id=0, name="admin", password=pwd_context.hash("4dm1N")),
-    User(id=1, name="alice", password=pwd_context.hash("wonderland")),
-    User(id=2, name="bob", password=pwd_context.hash("builder")),
-    User(id=3, name="clementine", password=pwd_context.hash("mandarine")),
-]
+# Get the directory path of the current file
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Construct the path to the users file, which stores pre-hashed passwords
+USERS_FILE_PATH = os.path.join(CURRENT_DIR, '..', 'data', 'users.csv')
+
+# User database keyed by name, loaded on first lookup
+users_db = UserRepository(USERS_FILE_PATH)
 
 def get_user_by_name(name: str) -> User:
-    return next((user for user in users_db if user.name == name), None)
+    return users_db.get(name)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    with stage("bcrypt"):
+        return pwd_context.verify(plain_password, hashed_password)
+
+
+# Verified credentials are remembered for a short time so repeat requests skip bcrypt
+CREDENTIAL_CACHE_TTL = 300
+CREDENTIAL_CACHE_MAX_SIZE = 1024
+
+class CredentialCache:
+    """
+    Bounded, TTL-limited cache of credentials that already passed bcrypt verification.
+
+    Only a keyed HMAC-SHA256 digest of (username, password, stored hash) is kept, with a
+    per-process random key, so the cache never holds plain passwords. Digests are
+    compared in constant time, and including the stored hash means a password change
+    can never match an entry made with the old one.
+    """
+
+    def __init__(self, ttl: float = CREDENTIAL_CACHE_TTL, max_size: int = CREDENTIAL_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._key = secrets.token_bytes(32)
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, user: User, password: str) -> bytes:
+        message = b"\x00".join(value.encode() for value in (user.name, password, user.password))
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def contains(self, user: User, password: str) -> bool:
+        digest = self._digest(user, password)
+        with self._lock:
+            entry = self._entries.get(user.name)
+            if entry is None:
+                return False
+            cached_digest, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user.name]
+                return False
+            self._entries.move_to_end(user.name)
+        return hmac.compare_digest(cached_digest, digest)
+
+    def add(self, user: User, password: str):
+        digest = self._digest(user, password)
+        with self._lock:
+            self._entries[user.name] = (digest, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, name: str):
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+credential_cache = CredentialCache()
+
+def verify_user_password(user: User, password: str) -> bool:
+    """
+    Verifies a user's password, skipping bcrypt when the credentials were recently verified.
+    """
+    cached = credential_cache.contains(user, password)
+    cache_lookup("credentials", cached)
+    if cached:
+        return True
+    if verify_password(password, user.password):
+        credential_cache.add(user, password)
+        return True
+    return False
+
+async def verify_user_password_async(user: User, password: str) -> bool:
+    """
+    Same as `verify_user_password`, but bcrypt runs on the hashing executor so the event loop keeps serving requests.
+    """
+    cached = credential_cache.contains(user, password)
+    cache_lookup("credentials", cached)
+    if cached:
+        return True
+    if await run_hashing(verify_password, password, user.password):
+        credential_cache.add(user, password)
+        return True
+    return False
+
+def update_password(name: str, new_password: str) -> bool:
+    """
+    Changes a user's password and drops any cached credentials for that user.
+
+    Returns:
+        bool: True if the user exists, False otherwise.
+    """
+    user = get_user_by_name(name)
+    if user is None:
+        return False
+    user.password = pwd_context.hash(new_password)
+    credential_cache.invalidate(name)
+    return True
+
+
+# Access tokens are signed with this key; set QCM_SECRET_KEY to share them across workers and restarts
+SECRET_KEY = os.environ.get("QCM_SECRET_KEY", "").encode() or secrets.token_bytes(32)
+ACCESS_TOKEN_TTL = 3600
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(body: str) -> bytes:
+    return hmac.new(SECRET_KEY, body.encode(), hashlib.sha256).digest()
+
+def create_access_token(user: User, ttl: int = ACCESS_TOKEN_TTL) -> str:
+    """
+    Issues a signed, expiring access token carrying the user id, name and admin role.
+
+    The token is `<base64url(JSON payload)>.<base64url(HMAC-SHA256 signature)>`.
+    """
+    payload = {
+        "sub": user.id,
+        "name": user.name,
+        "admin": user.name == 'admin',
+        "exp": int(time.time()) + ttl,
+    }
+    body = _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+    return f"{body}.{_b64encode(_sign(body))}"
+
+def decode_access_token(token: str) -> Optional[dict]:
+    """
+    Verifies an access token's signature and expiry.
+
+    Returns:
+        Optional[dict]: The token payload, or None if the token is malformed, forged or expired.
+    """
+    with stage("token_verify"):
+        return _decode_access_token(token)
+
+def _decode_access_token(token: str) -> Optional[dict]:
+    body, _, signature = token.partition(".")
+    try:
+        is_valid_signature = hmac.compare_digest(_b64decode(signature), _sign(body))
+        if not is_valid_signature:
+            return None
+        payload = json.loads(_b64decode(body))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(payload, dict) or payload.get("exp", 0) <= time.time():
+        return None
+    return payload
 
 
 class AuthService:
@@ -27,12 +193,40 @@ class AuthService:
         user = get_user_by_name(username)
         if user:
             is_correct_username = secrets.compare_digest(username, user.name)
-            is_correct_password = verify_password(password, user.password)
+            is_correct_password = verify_user_password(user, password)
             return is_correct_username and is_correct_password
         return False
 
     @staticmethod
     def is_admin(username: str, password: str) -> bool:
-        is_correct_admin_username = secrets.compare_digest(username, get_user_by_name('admin').name)
-        is_correct_admin_password = verify_password(password, get_user_by_name('admin').password)
+        admin = get_user_by_name('admin')
+        is_correct_admin_username = secrets.compare_digest(username, admin.name)
+        is_correct_admin_password = verify_user_password(admin, password)
         return is_correct_admin_username and is_correct_admin_password
+
+    @staticmethod
+    async def authenticate_user_async(username: str, password: str) -> bool:
+        user = get_user_by_name(username)
+        if user:
+            is_correct_username = secrets.compare_digest(username, user.name)
+            is_correct_password = await verify_user_password_async(user, password)
+            return is_correct_username and is_correct_password
+        return False
+
+    @staticmethod
+    async def is_admin_async(username: str, password: str) -> bool:
+        admin = get_user_by_name('admin')
+        is_correct_admin_username = secrets.compare_digest(username, admin.name)
+        is_correct_admin_password = await verify_user_password_async(admin, password)
+        return is_correct_admin_username and is_correct_admin_password
+
+    @staticmethod
+    def issue_token(username: str) -> str:
+        return create_access_token(get_user_by_name(username))
+
+    @staticmethod
+    def verify_token(token: str, admin: bool = False) -> Optional[str]:
+        payload = decode_access_token(token)
+        if payload is None or (admin and not payload.get("admin")):
+            return None
+        return payload.get("name")
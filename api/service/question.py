@@ -1,48 +1,135 @@
+import json
 import os
+from executor import run_io
 import pandas as pd
-from typing import List
-from models import CSVQuestion
-from csv_management import get_questions, add_question, remove_question
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from csv_management import decode_cursor, draw_question_labels, encode_cursor, encode_export, parse_questions, row_anchor, validate_questions
+from models import BulkImportResult, CSVQuestion, NearDuplicate, QuestionKey, QuizSpec
+from near_duplicates import NearDuplicateError
+from repository.question import CSVQuestionRepository, QuestionRepository
+from repository.sqlite_question import SQLiteQuestionRepository
+from response_cache import EncodedResponse, ResponseCache, encode_json, make_etag, read_consistently
 
 # Get the directory path of the current file
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-# Construct the path to the CSV file
+# Construct the path to the question repository
 CSV_FILE_PATH = os.path.join(CURRENT_DIR, '..', 'data', 'data.csv')
+# Construct the path to the SQLite database, used when QCM_STORAGE=sqlite
+SQLITE_FILE_PATH = os.path.join(CURRENT_DIR, '..', 'data', 'questions.db')
 
 # df = pd.read_csv(CSV_FILE_PATH)
 
 def load_dataframe(CSV_FILE_PATH:str):
     return pd.read_csv(CSV_FILE_PATH)
-    
-def find_questions(use: str, subjects: List[str], num_questions: int) -> List[CSVQuestion]:
+
+def create_repository(storage: str) -> QuestionRepository:
+    """
+    Creates the question repository for the configured storage backend ("csv" or "sqlite").
     """
-    Retrieves questions from the CSV file.
+    if storage == 'sqlite':
+        return SQLiteQuestionRepository(SQLITE_FILE_PATH)
+    if storage == 'csv':
+        return CSVQuestionRepository(CSV_FILE_PATH, loader=load_dataframe)
+    raise ValueError("Unknown storage backend: {storage}".format(storage=storage))
+
+# Process-wide store, loaded once by the lifespan hook
+question_repository = create_repository(os.environ.get('QCM_STORAGE', 'csv'))
+# Pre-encoded JSON responses, rebuilt when the repository generation changes
+response_cache = ResponseCache()
+
+def find_questions(use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> List[CSVQuestion]:
+    """
+    Retrieves questions from the question repository.
+    A `seed` makes the draw reproducible, and `weights` split it across the subjects.
 
     Returns:
         List[CSVQuestion]: A list of CSVQuestion objects representing the questions.
     """
-    # Read questions from the CSV file
-    df = load_dataframe(CSV_FILE_PATH)
-    return get_questions(use, subjects, num_questions, pd.DataFrame(df))
+    return question_repository.find_questions(use, subjects, num_questions, seed, weights)
 
-def create_question(question: CSVQuestion) -> CSVQuestion:
+def find_near_duplicates(question: QuestionKey) -> List[NearDuplicate]:
     """
-    Adds a new question to the CSV file.
+    Finds the stored questions of the same subject whose text is nearly the same,
+    e.g. reworded or punctuated differently, most similar first.
+
+    Args:
+        question (QuestionKey): The question text and subject to check.
+
+    Returns:
+        List[NearDuplicate]: The similar questions with their similarity, between 0 and 1.
+    """
+    return to_near_duplicates(question_repository.find_near_duplicates(question))
+
+def to_near_duplicates(duplicates: List[Tuple[dict, float]]) -> List[NearDuplicate]:
+    """
+    Builds the models of the (row, similarity) pairs returned by the repository.
+    """
+    return [NearDuplicate(question=CSVQuestion(**row), similarity=round(score, 3)) for row, score in duplicates]
+
+def create_question(question: CSVQuestion, allow_near_duplicates: bool = False) -> CSVQuestion:
+    """
+    Adds a new question to the question repository.
 
     Args:
         question (CSVQuestion): The new question to add.
+        allow_near_duplicates (bool): Whether to add the question even if similar questions are stored.
 
     Returns:
         CSVQuestion: The added question.
+
+    Raises:
+        NearDuplicateError: If similar questions are stored and `allow_near_duplicates` is not set.
     """
-    df = load_dataframe(CSV_FILE_PATH)
-    add_question(question, df, CSV_FILE_PATH)
+    if not allow_near_duplicates:
+        duplicates = question_repository.find_near_duplicates(question)
+        if duplicates:
+            raise NearDuplicateError(duplicates)
+    question_repository.add(question)
     return question
 
-# TODO: should be tested
+def create_questions(questions: List[CSVQuestion]) -> List[CSVQuestion]:
+    """
+    Adds several questions to the question repository with a single write.
+
+    Args:
+        questions (List[CSVQuestion]): The new questions to add.
+
+    Returns:
+        List[CSVQuestion]: The added questions.
+    """
+    question_repository.add_many(questions)
+    return questions
+
+def import_questions(body: bytes, media_type: str, skip_invalid: bool = False) -> BulkImportResult:
+    """
+    Imports an uploaded CSV or NDJSON file of questions with a single write.
+
+    Every row is validated first. If some rows are invalid, nothing is imported unless
+    `skip_invalid` is set, in which case the valid rows are imported.
+
+    Args:
+        body (bytes): The uploaded file.
+        media_type (str): The media type of the file.
+        skip_invalid (bool): Whether to import the valid rows when some rows are invalid.
+
+    Raises:
+        ValueError: If the file cannot be parsed, or if a question was added concurrently.
+
+    Returns:
+        BulkImportResult: The number of imported questions and the errors of the rejected rows.
+    """
+    batch = parse_questions(body, media_type)
+    valid, errors = validate_questions(batch, question_repository.contains_keys)
+    if errors and not skip_invalid:
+        return BulkImportResult(imported=0, errors=errors)
+    questions = [CSVQuestion(**row) for row in batch[valid].to_dict('records')]
+    if questions:
+        question_repository.add_many(questions)
+    return BulkImportResult(imported=len(questions), errors=errors)
+
 def delete_question(question: CSVQuestion) -> bool:
     """
-    Deletes a question from the CSV file.
+    Deletes a question from the question repository.
 
     Args:
         question (CSVQuestion): The question to delete.
@@ -50,29 +137,255 @@ def delete_question(question: CSVQuestion) -> bool:
     Returns:
         CSVQuestion: The deleted question.
     """
-    df = load_dataframe(CSV_FILE_PATH)
-
-    if remove_question(question, df, CSV_FILE_PATH):
+    if question_repository.remove(question):
         return True
     else:
         return False
 
+def delete_questions(questions: List[QuestionKey]) -> int:
+    """
+    Deletes several questions with a single write to the deletion log.
+
+    Args:
+        questions (List[QuestionKey]): The (question, subject) pairs to delete.
+
+    Returns:
+        int: The number of deleted questions.
+    """
+    return question_repository.remove_many(questions)
+
 def get_subjects() -> List[str]:
     """
-    Retrieves unique subjects from the CSV file.
+    Retrieves unique subjects from the question repository.
 
     Returns:
         List[str]: A list of unique subjects.
     """
-    df = load_dataframe(CSV_FILE_PATH)
-    return df['subject'].unique().tolist()
+    return question_repository.get_subjects()
 
 def get_uses() -> List[str]:
     """
-    Retrieves unique uses from the CSV file.
+    Retrieves unique uses from the question repository.
 
     Returns:
         List[str]: A list of unique uses.
     """
-    df = load_dataframe(CSV_FILE_PATH)
-    return df['use'].unique().tolist()
\ No newline at end of file
+    return question_repository.get_uses()
+
+def find_questions_json(use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> EncodedResponse:
+    """
+    Draws questions like `find_questions` and returns them as pre-encoded JSON.
+
+    Returns:
+        EncodedResponse: The JSON list of questions and its ETag.
+    """
+    return response_cache.questions(question_repository, use, subjects, num_questions, seed, weights)
+
+def search_questions_json(query: str, limit: int, offset: int = 0) -> EncodedResponse:
+    """
+    Finds the questions matching every word of `query`, ignoring accents and case, and
+    returns a page of them, best matches first, as pre-encoded JSON.
+
+    Returns:
+        EncodedResponse: The JSON total, offset, limit and questions, and its ETag.
+    """
+    def read() -> Optional[EncodedResponse]:
+        generation, total, ids = question_repository.search(query, limit, offset)
+        rows = response_cache.encoded_rows(question_repository, generation, ids)
+        # The repository changed between the search and the read of the rows
+        if rows is None:
+            return None
+        body = b'{"total":%d,"offset":%d,"limit":%d,"questions":[%s]}' % (total, offset, limit, b','.join(rows))
+        return EncodedResponse(body, make_etag(body))
+    return read_consistently(question_repository, read)
+
+def list_questions_json(cursor: Optional[str], limit: int, use: Optional[str] = None, subjects: Optional[List[str]] = None) -> EncodedResponse:
+    """
+    Returns a page of the questions matching the optional filters, in storage order, as
+    pre-encoded JSON. Each page ends with the cursor of the next one, so that the whole
+    bank can be walked page by page, whatever its size, without skipping or repeating rows.
+
+    Args:
+        cursor (Optional[str]): The `next_cursor` of the previous page, None for the first page.
+        limit (int): The maximum number of questions of the page.
+        use (Optional[str]): The use of the questions to list, all of them if None.
+        subjects (Optional[List[str]]): The subjects of the questions to list, all of them if None.
+
+    Raises:
+        ValueError: If the cursor is invalid or expired, or if the use or a subject is unknown.
+
+    Returns:
+        EncodedResponse: The JSON questions and next cursor (null after the last page), and its ETag.
+    """
+    after, anchor = decode_cursor(cursor) if cursor else (-1, None)
+    def read() -> Optional[Tuple[List[int], List[bytes]]]:
+        generation, ids = question_repository.list_question_ids(after, limit, use, subjects, anchor)
+        rows = response_cache.encoded_rows(question_repository, generation, ids)
+        # The repository changed between the listing and the read of the rows
+        return None if rows is None else (ids, rows)
+    ids, rows = read_consistently(question_repository, read)
+    next_cursor = None
+    if len(ids) == limit:
+        last = json.loads(rows[-1])
+        next_cursor = encode_cursor(ids[-1], row_anchor(last['question'], last['subject']))
+    body = b'{"questions":[%s],"next_cursor":%s}' % (b','.join(rows), encode_json(next_cursor))
+    return EncodedResponse(body, make_etag(body))
+
+def export_questions(format: str, use: Optional[str] = None, subjects: Optional[List[str]] = None) -> Iterator[bytes]:
+    """
+    Exports the questions matching the optional filters as a CSV, NDJSON or Parquet file,
+    read and encoded a chunk at a time. The filters and the format are checked before the
+    first chunk is read.
+
+    Raises:
+        ValueError: If the format is not available, or if the use or a subject is unknown.
+
+    Returns:
+        Iterator[bytes]: The successive parts of the file.
+    """
+    return encode_export(question_repository.iter_question_rows(use, subjects), format)
+
+def get_subjects_json() -> EncodedResponse:
+    """
+    Returns the unique subjects as pre-encoded JSON.
+
+    Returns:
+        EncodedResponse: The JSON list of subjects and its ETag.
+    """
+    return response_cache.subjects(question_repository)
+
+def get_uses_json() -> EncodedResponse:
+    """
+    Returns the unique uses as pre-encoded JSON.
+
+    Returns:
+        EncodedResponse: The JSON list of uses and its ETag.
+    """
+    return response_cache.uses(question_repository)
+
+# Number of quizzes of a batch built and sent together
+BATCH_CHUNK_SIZE = 50
+
+def _quiz_candidates(quiz: QuizSpec, generation: int, candidates: Dict[tuple, tuple]) -> tuple:
+    # Resolves (generation, buckets, error) once per distinct (use, subjects) and generation
+    key = (quiz.use, tuple(dict.fromkeys(quiz.subjects)))
+    entry = candidates.get(key)
+    if entry is None or entry[0] != generation:
+        try:
+            entry = (*question_repository.find_candidate_ids(quiz.use, list(key[1])), None)
+        except ValueError as e:
+            entry = (generation, None, str(e))
+        candidates[key] = entry
+    return entry
+
+def _draw_quiz_batch_chunk(quizzes: List[QuizSpec], start: int, candidates: Dict[tuple, tuple]) -> Optional[bytes]:
+    # None if the repository changed while the chunk was drawn
+    generation = question_repository.current_generation()
+    drawn: List[Tuple[int, Optional[list], Optional[str]]] = []
+    consistent = True
+    for position, quiz in enumerate(quizzes[start:start + BATCH_CHUNK_SIZE], start):
+        entry_generation, buckets, error = _quiz_candidates(quiz, generation, candidates)
+        consistent = consistent and entry_generation == generation
+        if error is None:
+            try:
+                drawn.append((position, draw_question_labels(buckets, quiz.num_questions, quiz.seed).tolist(), None))
+                continue
+            except ValueError as e:
+                error = str(e)
+        drawn.append((position, None, error))
+    ids = [id_ for _, labels, _ in drawn if labels for id_ in labels]
+    # Candidates or rows from another generation mean the repository changed meanwhile
+    rows = response_cache.encoded_rows(question_repository, generation, ids) if consistent else None
+    if rows is None:
+        return None
+    lines = []
+    offset = 0
+    for position, labels, error in drawn:
+        if error is not None:
+            lines.append(encode_json({"index": position, "error": error}))
+            continue
+        lines.append(b'{"index":%d,"questions":[%s]}' % (position, b','.join(rows[offset:offset + len(labels)])))
+        offset += len(labels)
+    return b'\n'.join(lines) + b'\n'
+
+def _quiz_batch_chunk(quizzes: List[QuizSpec], start: int, candidates: Dict[tuple, tuple]) -> bytes:
+    # `candidates` is shared by the chunks of a batch
+    return read_consistently(question_repository, lambda: _draw_quiz_batch_chunk(quizzes, start, candidates))
+
+def generate_quiz_batch(quizzes: List[QuizSpec]) -> Iterator[bytes]:
+    """
+    Draws the questions of many quizzes at once and yields them as NDJSON, one line per quiz:
+    {"index": i, "questions": [...]} or {"index": i, "error": "..."} if the quiz cannot be drawn.
+
+    The candidates of each distinct (use, subjects) are resolved once for the whole batch,
+    and the rows of a chunk of quizzes are read and encoded together. A quiz with a `seed`
+    gets the same questions as GET /questions/ with that seed.
+
+    Yields:
+        bytes: The lines of `BATCH_CHUNK_SIZE` quizzes at a time.
+    """
+    candidates: Dict[tuple, tuple] = {}
+    for start in range(0, len(quizzes), BATCH_CHUNK_SIZE):
+        yield _quiz_batch_chunk(quizzes, start, candidates)
+
+
+# Async variants for the routes: reads run on the event loop while the repository serves them
+# from memory, anything that touches the disk runs on the I/O executor
+
+async def find_questions_json_async(use: str, subjects: List[str], num_questions: int, seed: Optional[int] = None, weights: Optional[List[float]] = None) -> EncodedResponse:
+    if question_repository.is_in_memory():
+        return find_questions_json(use, subjects, num_questions, seed, weights)
+    return await run_io(find_questions_json, use, subjects, num_questions, seed, weights)
+
+async def search_questions_json_async(query: str, limit: int, offset: int = 0) -> EncodedResponse:
+    # Always off the event loop: the first search of a generation builds the CSV search index
+    return await run_io(search_questions_json, query, limit, offset)
+
+async def list_questions_json_async(cursor: Optional[str], limit: int, use: Optional[str] = None, subjects: Optional[List[str]] = None) -> EncodedResponse:
+    if question_repository.is_in_memory():
+        return list_questions_json(cursor, limit, use, subjects)
+    return await run_io(list_questions_json, cursor, limit, use, subjects)
+
+async def export_questions_async(format: str, use: Optional[str] = None, subjects: Optional[List[str]] = None) -> AsyncIterator[bytes]:
+    # Validated here, so that errors are raised before the response starts
+    parts = await run_io(export_questions, format, use, subjects)
+    return _export_parts(parts)
+
+async def _export_parts(parts: Iterator[bytes]) -> AsyncIterator[bytes]:
+    # Each part is read and encoded off the event loop
+    while True:
+        part = await run_io(next, parts, None)
+        if part is None:
+            return
+        yield part
+
+async def get_subjects_json_async() -> EncodedResponse:
+    if question_repository.is_in_memory():
+        return get_subjects_json()
+    return await run_io(get_subjects_json)
+
+async def get_uses_json_async() -> EncodedResponse:
+    if question_repository.is_in_memory():
+        return get_uses_json()
+    return await run_io(get_uses_json)
+
+async def generate_quiz_batch_async(quizzes: List[QuizSpec]) -> AsyncIterator[bytes]:
+    candidates: Dict[tuple, tuple] = {}
+    for start in range(0, len(quizzes), BATCH_CHUNK_SIZE):
+        if question_repository.is_in_memory():
+            yield _quiz_batch_chunk(quizzes, start, candidates)
+        else:
+            yield await run_io(_quiz_batch_chunk, quizzes, start, candidates)
+
+async def create_question_async(question: CSVQuestion, allow_near_duplicates: bool = False) -> CSVQuestion:
+    return await run_io(create_question, question, allow_near_duplicates)
+
+async def find_near_duplicates_async(question: QuestionKey) -> List[NearDuplicate]:
+    # Off the event loop: the first lookup of a generation builds the CSV near-duplicate index
+    return await run_io(find_near_duplicates, question)
+
+async def import_questions_async(body: bytes, media_type: str, skip_invalid: bool = False) -> BulkImportResult:
+    return await run_io(import_questions, body, media_type, skip_invalid)
+
+async def delete_questions_async(questions: List[QuestionKey]) -> int:
+    return await run_io(delete_questions, questions)
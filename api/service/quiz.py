@@ -0,0 +1,101 @@
+from typing import List, Optional
+import service.question as question_service
+from executor import run_io
+from models import CSVQuestion, QuizQuestions, QuizSessionInfo
+from quiz_session import QuizSession, SessionStore
+from response_cache import read_consistently
+
+# Process-wide quiz sessions, bounded in number and lifetime
+session_store = SessionStore()
+
+def _rebase(session: QuizSession):
+    # Restarts the session on the current candidates, counting those it already handed out
+    repository = question_service.question_repository
+    try:
+        generation, candidates = repository.find_candidate_ids(session.use, session.subjects)
+    except ValueError:
+        # The use or a subject no longer exists, so nothing is left to draw
+        generation, candidates = repository.current_generation(), []
+    served = int(repository.contains_keys(list(session.served)).sum()) if session.served else 0
+    session.rebase(generation, candidates, served)
+
+def _draw_questions(session: QuizSession, num_questions: int, rows: List[dict]) -> Optional[bool]:
+    # Adds rows until there are `num_questions` or the session runs out; None if the
+    # repository changed meanwhile. Callers hold the session lock
+    repository = question_service.question_repository
+    if repository.current_generation() != session.generation:
+        _rebase(session)
+    while len(rows) < num_questions and len(session.permutation):
+        ids = session.draw_ids(num_questions - len(rows))
+        try:
+            generation, drawn = repository.get_question_rows(ids)
+        except KeyError:
+            # The rows were relabelled, e.g. by a compaction
+            generation = None
+        if generation != session.generation:
+            return None
+        rows += session.mark_served(drawn)
+    return True
+
+def start_session(username: str, use: str, subjects: List[str], seed: Optional[int] = None) -> QuizSessionInfo:
+    """
+    Starts a quiz session over the questions matching `use` and any of `subjects`.
+
+    Raises:
+        ValueError: If the use or a subject is unknown.
+
+    Returns:
+        QuizSessionInfo: The session id and the number of questions it can hand out.
+    """
+    session = QuizSession(username, use, list(dict.fromkeys(subjects)), seed)
+    session.rebase(*question_service.question_repository.find_candidate_ids(use, subjects))
+    session_id = session_store.add(session)
+    return QuizSessionInfo(session_id=session_id, use=use, subjects=session.subjects, total=session.remaining(),
+                           remaining=session.remaining(), expires_in=session_store.ttl)
+
+def _owned_session(username: str, session_id: str) -> Optional[QuizSession]:
+    session = session_store.get(session_id)
+    if session is None or session.username != username:
+        return None
+    return session
+
+def next_questions(username: str, session_id: str, num_questions: int) -> Optional[QuizQuestions]:
+    """
+    Hands out the next `num_questions` questions of a session, never one it handed out before.
+    Fewer questions are returned once the session runs out of them.
+
+    Returns:
+        Optional[QuizQuestions]: The questions and how many are left, or None if the user has no such session.
+    """
+    session = _owned_session(username, session_id)
+    if session is None:
+        return None
+    rows = []
+    with session.lock:
+        read_consistently(question_service.question_repository, lambda: _draw_questions(session, num_questions, rows))
+        remaining = max(session.remaining(), 0)
+    return QuizQuestions(questions=[CSVQuestion(**row) for row in rows], remaining=remaining)
+
+def end_session(username: str, session_id: str) -> bool:
+    """
+    Drops a session.
+
+    Returns:
+        bool: True if the user had such a session, False otherwise.
+    """
+    if _owned_session(username, session_id) is None:
+        return False
+    return session_store.remove(session_id)
+
+
+# Async variants for the routes, following `service.question`
+
+async def start_session_async(username: str, use: str, subjects: List[str], seed: Optional[int] = None) -> QuizSessionInfo:
+    if question_service.question_repository.is_in_memory():
+        return start_session(username, use, subjects, seed)
+    return await run_io(start_session, username, use, subjects, seed)
+
+async def next_questions_async(username: str, session_id: str, num_questions: int) -> Optional[QuizQuestions]:
+    if question_service.question_repository.is_in_memory():
+        return next_questions(username, session_id, num_questions)
+    return await run_io(next_questions, username, session_id, num_questions)
@@ -0,0 +1,42 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+CSV = b"question,subject,use,correct,responseA,responseB,responseC,responseD,remark\nQ1,S1,Exam,A,A1,A2,A3,,\n"
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        etag = '"{digest}"'.format(digest=hashlib.sha256(server.body).hexdigest()[:16])
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    # Local stand-in for the S3 bucket, answering conditional requests with 304
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.body = CSV
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/questions.csv"
@@ -0,0 +1,18 @@
+from benchmarks.data import synthetic_questions
+from benchmarks.harness import measure
+
+
+def test_synthetic_questions_cardinality():
+    df = synthetic_questions(500, subjects=20, uses=2)
+    assert len(df) == 500
+    assert df['subject'].nunique() == 20
+    assert df['use'].nunique() == 2
+    assert df['question'].is_unique
+    assert synthetic_questions(50, seed=1).equals(synthetic_questions(50, seed=1))
+
+def test_measure_reports_latency_and_memory():
+    result = measure('allocate', lambda: bytearray(100_000), iterations=10, rows=1)
+    assert result['name'] == 'allocate' and result['rows'] == 1
+    assert 0 < result['p50_ms'] <= result['p99_ms']
+    assert result['throughput_per_s'] > 0
+    assert result['peak_bytes'] >= 100_000
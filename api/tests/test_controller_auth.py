@@ -9,7 +9,9 @@ def test_login_success():
         auth=("alice", "wonderland")
     )
     assert response.status_code == 200
-    assert response.json() == {"username": "alice"}
+    assert response.json()["username"] == "alice"
+    assert response.json()["token_type"] == "bearer"
+    assert response.json()["access_token"]
 
 def test_login_invalid_username():
     response = client.get(
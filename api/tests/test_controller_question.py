@@ -1,8 +1,14 @@
+import json
+from contextlib import contextmanager
 from fastapi.testclient import TestClient
+import threading
+import pandas as pd
 import pytest
+from unittest.mock import patch
 from main import app
 from models import CSVQuestion
-from service.question import delete_question
+from repository.question import CSVQuestionRepository
+from executor import HASHING_WORKERS, hashing_executor
 
 client = TestClient(app)
 
@@ -21,13 +27,21 @@ def admin_credentials():
         "password": "4dm1N"
     }
 
+@contextmanager
+def temporary_repository(tmp_path, questions):
+    # Writes go to a bank in tmp_path, not to the tracked data/data.csv
+    path = tmp_path / "data.csv"
+    pd.DataFrame([question.model_dump() for question in questions]).to_csv(path, index=False)
+    with patch('service.question.question_repository', CSVQuestionRepository(str(path))) as repository:
+        yield repository
+
 def test_get_questions(user_credentials):
     response = client.get("/api-v1/questions/?use=Test%20de%20positionnement&subjects=BDD&subjects=Docker&num_questions=5",
                            auth=(user_credentials['username'], user_credentials['password']))
     assert response.status_code == 200
     assert len(response.json()) == 5  # Assuming there are at least 5 questions available
 
-def test_add_question(admin_credentials):
+def test_add_question(admin_credentials, tmp_path):
     question = [CSVQuestion(
         question = "What is the capital of France?",
         subject = "Geography",
@@ -40,13 +54,15 @@ def test_add_question(admin_credentials):
         remark = ""
     )]
     question_data = [q.model_dump() for q in question]
+    existing = question[0].model_copy(update={"question": "What is the capital of Spain?"})
 
-    response = client.post("/api-v1/questions/", 
-                        auth=(admin_credentials['username'], admin_credentials['password']),
-                        json=question_data[0])
-    assert response.status_code == 200
-    assert response.json() == question_data[0]
-    delete_question(question[0])
+    with temporary_repository(tmp_path, [existing]) as repository:
+        response = client.post("/api-v1/questions/", 
+                            auth=(admin_credentials['username'], admin_credentials['password']),
+                            json=question_data[0])
+        assert response.status_code == 200
+        assert response.json() == question_data[0]
+        assert len(repository.snapshot()[1]) == 2
 
 def test_get_unique_subjects():
     response = client.get("/api-v1/questions/subjects/")
@@ -56,4 +72,222 @@ def test_get_unique_subjects():
 def test_get_unique_uses():
     response = client.get("/api-v1/questions/uses/")
     assert response.status_code == 200
-    assert isinstance(response.json(), list)
\ No newline at end of file
+    assert isinstance(response.json(), list)
+
+def login(credentials):
+    response = client.get("/api-v1/auth/login", auth=(credentials['username'], credentials['password']))
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def test_get_questions_with_access_token(user_credentials):
+    response = client.get("/api-v1/questions/?use=Test%20de%20positionnement&subjects=BDD&num_questions=5",
+                          headers=login(user_credentials))
+    assert response.status_code == 200
+    assert len(response.json()) == 5
+
+def test_get_questions_with_invalid_access_token():
+    response = client.get("/api-v1/questions/?use=Test%20de%20positionnement&subjects=BDD",
+                          headers={"Authorization": "Bearer forged.token"})
+    assert response.status_code == 401
+
+def test_get_questions_without_credentials():
+    response = client.get("/api-v1/questions/?use=Test%20de%20positionnement&subjects=BDD")
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == 'Basic'
+
+def test_add_question_requires_admin_token(user_credentials):
+    question = CSVQuestion(question="Q", subject="S", use="U", correct="A", responseA="A1", responseB="A2", responseC="A3")
+    response = client.post("/api-v1/questions/", headers=login(user_credentials), json=question.model_dump())
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Invalid admin credentials"}
+
+
+def test_delete_questions(admin_credentials, tmp_path):
+    question = CSVQuestion(question="What is the capital of Italy?", subject="Geography", use="Quiz",
+                           correct="Rome", responseA="Rome", responseB="Milan", responseC="Turin")
+    auth = (admin_credentials['username'], admin_credentials['password'])
+    existing = question.model_copy(update={"question": "What is the capital of Spain?"})
+    with temporary_repository(tmp_path, [existing]) as repository:
+        client.post("/api-v1/questions/", auth=auth, json=question.model_dump())
+
+        keys = [{"question": question.question, "subject": question.subject}]
+        response = client.request("DELETE", "/api-v1/questions/", auth=auth, json=keys)
+        assert response.status_code == 200
+        assert response.json() == {"deleted": 1}
+
+        response = client.request("DELETE", "/api-v1/questions/", auth=auth, json=keys)
+        assert response.status_code == 400
+        assert len(repository.snapshot()[1]) == 1
+
+
+def test_get_questions_with_seed(user_credentials):
+    url = "/api-v1/questions/?use=Test%20de%20positionnement&subjects=BDD&subjects=Docker&num_questions=5&seed=3"
+    auth = (user_credentials['username'], user_credentials['password'])
+    assert client.get(url, auth=auth).json() == client.get(url, auth=auth).json()
+
+
+def test_get_questions_balanced(user_credentials):
+    url = "/api-v1/questions/?use=Test%20de%20positionnement&subjects=BDD&subjects=Docker&num_questions=6"
+    auth = (user_credentials['username'], user_credentials['password'])
+    response = client.get(url + "&balanced=true", auth=auth)
+    assert response.status_code == 200
+    assert sorted(q['subject'] for q in response.json()) == ['BDD'] * 3 + ['Docker'] * 3
+
+    response = client.get(url + "&weights=2&weights=1", auth=auth)
+    assert sorted(q['subject'] for q in response.json()) == ['BDD'] * 4 + ['Docker'] * 2
+
+    response = client.get(url.replace("num_questions=6", "num_questions=12") + "&balanced=true", auth=auth)
+    assert response.status_code == 400
+    assert "'Docker': 5" in response.json()["detail"]
+
+
+def test_get_unique_subjects_not_modified():
+    response = client.get("/api-v1/questions/subjects/")
+    etag = response.headers["etag"]
+    response = client.get("/api-v1/questions/subjects/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_get_questions_not_modified(user_credentials):
+    url = "/api-v1/questions/?use=Test%20de%20positionnement&subjects=BDD&num_questions=2&seed=5"
+    auth = (user_credentials['username'], user_credentials['password'])
+    etag = client.get(url, auth=auth).headers["etag"]
+    assert client.get(url, auth=auth, headers={"If-None-Match": etag}).status_code == 304
+    # The credentials are checked before the cache
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 401
+
+
+def test_hashing_burst_does_not_block_question_reads(user_credentials):
+    url = "/api-v1/questions/?use=Test%20de%20positionnement&subjects=BDD&num_questions=2"
+    headers = login(user_credentials)
+    release = threading.Event()
+    busy = [hashing_executor.submit(release.wait, 10) for _ in range(HASHING_WORKERS)]
+    try:
+        assert client.get(url, headers=headers).status_code == 200
+        assert client.get("/api-v1/questions/subjects/").status_code == 200
+    finally:
+        release.set()
+        for future in busy:
+            future.result()
+
+
+def test_import_questions(admin_credentials, tmp_path):
+    auth = (admin_credentials['username'], admin_credentials['password'])
+    questions = [CSVQuestion(question=f"Imported question {i}", subject="Imports", use="Quiz", correct="A",
+                             responseA="A1", responseB="A2", responseC="A3") for i in range(3)]
+    existing = CSVQuestion(question="Existing question", subject="Existing", use="Quiz", correct="A",
+                           responseA="A1", responseB="A2", responseC="A3")
+    with temporary_repository(tmp_path, [existing]) as repository:
+        csv = "question,subject,use,correct,responseA,responseB,responseC\n" + "".join(
+            f"{q.question},{q.subject},{q.use},{q.correct},{q.responseA},{q.responseB},{q.responseC}\n" for q in questions[:2])
+        response = client.post("/api-v1/questions/import", auth=auth, content=csv, headers={"Content-Type": "text/csv"})
+        assert response.status_code == 200
+        assert response.json() == {"imported": 2, "errors": []}
+
+        # The batch is rejected as a whole, with one error per invalid row
+        ndjson = "\n".join(q.model_dump_json() for q in questions)
+        response = client.post("/api-v1/questions/import", auth=auth, content=ndjson, headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 400
+        assert [error["row"] for error in response.json()["detail"]["errors"]] == [1, 2]
+
+        response = client.post("/api-v1/questions/import?skip_invalid=true", auth=auth, content=ndjson,
+                               headers={"Content-Type": "application/x-ndjson"})
+        assert response.json()["imported"] == 1
+        assert client.get("/api-v1/questions/subjects/").json() == ["Existing", "Imports"]
+
+        keys = [{"question": q.question, "subject": q.subject} for q in questions]
+        assert client.request("DELETE", "/api-v1/questions/", auth=auth, json=keys).json() == {"deleted": 3}
+        assert len(repository.snapshot()[1]) == 1
+
+
+def test_import_questions_rejects_other_media_types(admin_credentials):
+    auth = (admin_credentials['username'], admin_credentials['password'])
+    response = client.post("/api-v1/questions/import", auth=auth, json=[])
+    assert response.status_code == 415
+    assert client.post("/api-v1/questions/import", content="a,b\n", headers={"Content-Type": "text/csv"}).status_code == 401
+
+
+def test_get_quiz_batch(user_credentials):
+    auth = (user_credentials['username'], user_credentials['password'])
+    quiz = {"use": "Test de positionnement", "subjects": ["BDD", "Docker"], "num_questions": 4}
+    response = client.post("/api-v1/questions/batch", auth=auth,
+                           json={"quizzes": [{**quiz, "seed": 1}, {**quiz, "use": "Unknown"}, {**quiz, "seed": 2}]})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert len(lines[0]["questions"]) == 4 and "error" in lines[1]
+    url = "/api-v1/questions/?use=Test%20de%20positionnement&subjects=BDD&subjects=Docker&num_questions=4&seed=2"
+    assert lines[2]["questions"] == client.get(url, auth=auth).json()
+
+    assert client.post("/api-v1/questions/batch", json={"quizzes": [quiz]}).status_code == 401
+    assert client.post("/api-v1/questions/batch", auth=auth, json={"quizzes": []}).status_code == 422
+
+def test_search_questions(user_credentials):
+    auth = (user_credentials['username'], user_credentials['password'])
+    response = client.get("/api-v1/questions/search", params={"q": "DOCKER utilise", "limit": 1}, auth=auth)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["total"] >= 1 and result["limit"] == 1 and result["offset"] == 0
+    assert len(result["questions"]) == 1
+    assert "docker" in result["questions"][0]["question"].lower()
+    etag = response.headers["etag"]
+    response = client.get("/api-v1/questions/search", params={"q": "DOCKER utilise", "limit": 1}, auth=auth, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    assert client.get("/api-v1/questions/search", params={"q": "docker"}).status_code == 401
+    assert client.get("/api-v1/questions/search", params={"q": ""}, auth=auth).status_code == 422
+
+def test_add_question_rejects_near_duplicates(admin_credentials, tmp_path):
+    auth = (admin_credentials['username'], admin_credentials['password'])
+    question = CSVQuestion(question="Kafka est-il un système de messagerie ?", subject="Streaming de données", use="Test de validation",
+                           correct="A", responseA="Oui", responseB="Non", responseC="Parfois")
+    # The bank holds this question twice, with and without "un"
+    bank = [question.model_copy(update={"question": text}) for text in ("Kafka est un système de messagerie", "Kafka est système de messagerie")]
+    with temporary_repository(tmp_path, bank) as repository:
+        response = client.post("/api-v1/questions/", auth=auth, json=question.model_dump())
+        assert response.status_code == 409
+        duplicates = response.json()["detail"]["near_duplicates"]
+        assert {duplicate["question"]["question"] for duplicate in duplicates} == {"Kafka est un système de messagerie", "Kafka est système de messagerie"}
+        assert all(duplicate["similarity"] == 1.0 for duplicate in duplicates)
+
+        response = client.get("/api-v1/questions/near-duplicates", auth=auth,
+                              params={"question": question.question, "subject": question.subject})
+        assert response.status_code == 200
+        assert response.json() == duplicates
+
+        response = client.post("/api-v1/questions/", auth=auth, params={"allow_near_duplicates": True}, json=question.model_dump())
+        assert response.status_code == 200
+        assert len(repository.snapshot()[1]) == 3
+
+def test_list_questions(admin_credentials, user_credentials):
+    auth = (admin_credentials['username'], admin_credentials['password'])
+    response = client.get("/api-v1/questions/all", params={"limit": 2, "subjects": ["BDD"]}, auth=auth)
+    assert response.status_code == 200
+    page = response.json()
+    assert [question["subject"] for question in page["questions"]] == ["BDD", "BDD"]
+    response = client.get("/api-v1/questions/all", params={"limit": 2, "subjects": ["BDD"], "cursor": page["next_cursor"]}, auth=auth)
+    assert response.status_code == 200
+    assert not {question["question"] for question in response.json()["questions"]} & {question["question"] for question in page["questions"]}
+
+    assert client.get("/api-v1/questions/all", params={"cursor": "garbage"}, auth=auth).status_code == 400
+    assert client.get("/api-v1/questions/all", params={"use": "Unknown"}, auth=auth).status_code == 400
+    assert client.get("/api-v1/questions/all", auth=(user_credentials['username'], user_credentials['password'])).status_code == 401
+
+def test_export_questions(admin_credentials):
+    auth = (admin_credentials['username'], admin_credentials['password'])
+    response = client.get("/api-v1/questions/export", params={"format": "ndjson", "subjects": ["BDD"]}, auth=auth)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == 'attachment; filename="questions.ndjson"'
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines and all(line["subject"] == "BDD" for line in lines)
+
+    response = client.get("/api-v1/questions/export", auth=auth)
+    assert response.status_code == 200
+    assert response.text.startswith("question,subject,use,correct,")
+
+    assert client.get("/api-v1/questions/export", params={"subjects": ["Unknown"]}, auth=auth).status_code == 400
+    assert client.get("/api-v1/questions/export", params={"format": "xml"}, auth=auth).status_code == 422
+    with patch('csv_management.pyarrow', None):
+        assert client.get("/api-v1/questions/export", params={"format": "parquet"}, auth=auth).status_code == 501
@@ -0,0 +1,34 @@
+from fastapi.testclient import TestClient
+from main import app
+
+client = TestClient(app)
+alice = ("alice", "wonderland")
+criteria = {"use": "Test de positionnement", "subjects": ["BDD", "Docker"], "seed": 2}
+
+def test_quiz_session_hands_out_each_question_once():
+    response = client.post("/api-v1/quiz/sessions", json=criteria, auth=alice)
+    assert response.status_code == 201
+    session = response.json()
+    assert session["remaining"] == session["total"] > 0
+
+    questions = []
+    while True:
+        response = client.post(f"/api-v1/quiz/sessions/{session['session_id']}/next?num_questions=4", auth=alice)
+        assert response.status_code == 200
+        batch = response.json()
+        if not batch["questions"]:
+            break
+        questions += [(question["question"], question["subject"]) for question in batch["questions"]]
+    assert len(questions) == len(set(questions)) == session["total"]
+    assert batch["remaining"] == 0
+
+    assert client.delete(f"/api-v1/quiz/sessions/{session['session_id']}", auth=alice).status_code == 204
+    assert client.post(f"/api-v1/quiz/sessions/{session['session_id']}/next", auth=alice).status_code == 404
+
+def test_quiz_session_errors():
+    assert client.post("/api-v1/quiz/sessions", json=criteria).status_code == 401
+    response = client.post("/api-v1/quiz/sessions", json={**criteria, "use": "Unknown"}, auth=alice)
+    assert response.status_code == 400
+    session_id = client.post("/api-v1/quiz/sessions", json=criteria, auth=alice).json()["session_id"]
+    # Sessions are private to the user who started them
+    assert client.post(f"/api-v1/quiz/sessions/{session_id}/next", auth=("admin", "4dm1N")).status_code == 404
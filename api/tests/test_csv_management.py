@@ -1,16 +1,35 @@
+import io
+import numpy as np
 import pandas as pd
 import pytest
+from unittest.mock import patch
 from csv_management import (
     add_question, 
+    add_questions,
+    apply_deletion_log,
+    compact_csv,
+    compact_questions,
+    decode_cursor,
+    deletion_log_path,
+    encode_cursor,
+    encode_export,
+    labels_after,
+    remove_question,
+    remove_questions,
     convert_CSVQuestion_List_to_dict_list,
     convert_df_to_CSVQuestion_List, 
     get_questions, load_csv, 
+    stream_questions,
+    subject_quotas,
+    parse_questions,
+    validate_questions,
     verify_question_subject_and_subject_existence, 
     verify_subject_existence,
     verify_use_existence
 )
 
-from models import CSVQuestion
+from models import CSVQuestion, ImportReport
+from question_index import QuestionIndex
 
 
 @pytest.fixture
@@ -50,6 +69,29 @@ def test_load_csv(tmp_path, sample_df):
     loaded_data = pd.read_csv(tmp_path / "loaded_test.csv").fillna('')    
     assert loaded_data.equals(sample_df.fillna(''))
 
+def test_load_csv_streaming(tmp_path, sample_df):
+    source = tmp_path / "source.csv"
+    rows = pd.concat([sample_df] * 3, ignore_index=True)
+    rows.loc[1, 'subject'] = 'Sytèmes distribués'
+    rows.loc[2, 'correct'] = None
+    rows.loc[4, 'subject'] = 'Sytèmes distribués'
+    rows.loc[4, 'correct'] = None
+    rows.to_csv(source, index=False)
+
+    report = load_csv(source, tmp_path / "streamed.csv", chunksize=2)
+    assert report == ImportReport(read=6, accepted=4, rejected={'missing_correct': 2}, corrected={'subject_typo': 1})
+    # Same output as the one-shot import
+    assert load_csv(source, tmp_path / "loaded.csv") == report
+    assert (tmp_path / "streamed.csv").read_text() == (tmp_path / "loaded.csv").read_text()
+    assert 'Sytèmes distribués' not in (tmp_path / "streamed.csv").read_text()
+
+def test_stream_questions_reads_in_chunks(tmp_path, sample_df):
+    source = tmp_path / "source.csv"
+    pd.concat([sample_df] * 5, ignore_index=True).to_csv(source, index=False)
+    report = ImportReport()
+    assert [len(chunk) for chunk in stream_questions(source, report, chunksize=4)] == [4, 4, 2]
+    assert report.accepted == 10
+
 def test_verify_data_existence(sample_df):
     # Create a CSVQuestion object for testing
     question = CSVQuestion(
@@ -147,4 +189,197 @@ def test_add_question(tmp_path, sample_df):
     # Add the new question to the DataFrame and check if it's present
     add_question(new_question, sample_df, tmp_path / "updated_test.csv")
     updated_data = pd.read_csv(tmp_path / "updated_test.csv")
-    assert verify_question_subject_and_subject_existence(new_question, updated_data) == True
\ No newline at end of file
+    assert verify_question_subject_and_subject_existence(new_question, updated_data) == True
+
+def make_question(text, subject='Subject 1', correct='A'):
+    return CSVQuestion(question=text, subject=subject, use='Exam', correct=correct,
+                       responseA='A1', responseB='A2', responseC='A3')
+
+def test_add_question_appends_row(tmp_path, sample_df):
+    destination = tmp_path / "questions.csv"
+    # Existing file without a trailing newline
+    destination.write_text(sample_df.to_csv(index=False).rstrip('\n'))
+    df = add_question(make_question('New Question'), sample_df, destination)
+
+    lines = destination.read_text().splitlines()
+    assert lines[0].startswith('question,')
+    assert lines[2].startswith('Question 2,')
+    assert lines[3].startswith('New Question,')
+    # A new DataFrame is returned, the one passed in is unchanged
+    assert len(df) == 3 and len(sample_df) == 2
+    assert pd.read_csv(destination)['question'].tolist() == ['Question 1', 'Question 2', 'New Question']
+
+def test_add_questions_single_fsync(tmp_path, sample_df):
+    destination = tmp_path / "questions.csv"
+    sample_df.to_csv(destination, index=False)
+    questions = [make_question(f'New Question {i}') for i in range(3)]
+    with patch('os.fsync') as mock_fsync:
+        df = add_questions(questions, sample_df, destination)
+        assert mock_fsync.call_count == 1
+    assert len(df) == 5
+    assert pd.read_csv(destination)['question'].tolist()[-3:] == [q.question for q in questions]
+
+def test_add_questions_is_all_or_nothing(tmp_path, sample_df):
+    destination = tmp_path / "questions.csv"
+    sample_df.to_csv(destination, index=False)
+    with pytest.raises(ValueError, match="Question already exists"):
+        add_questions([make_question('New Question'), make_question('Question 1')], sample_df, destination)
+    with pytest.raises(ValueError, match="Question already exists"):
+        add_questions([make_question('New Question'), make_question('New Question')], sample_df, destination)
+    with pytest.raises(ValueError, match="correct answer can't be empty"):
+        add_questions([make_question('New Question', correct='')], sample_df, destination)
+    assert len(pd.read_csv(destination)) == 2
+
+def test_compact_csv(tmp_path, sample_df):
+    destination = tmp_path / "questions.csv"
+    destination.write_text("stale")
+    compact_csv(sample_df, destination)
+    assert pd.read_csv(destination).fillna('').equals(sample_df.fillna(''))
+    assert list(tmp_path.iterdir()) == [destination]
+
+def test_remove_question_without_index(tmp_path, sample_df):
+    destination = tmp_path / "questions.csv"
+    question = make_question('Question 1')
+    assert remove_question(question, sample_df, destination) is True
+    assert pd.read_csv(destination)['question'].tolist() == ['Question 2']
+    with pytest.raises(ValueError, match="Question does not exist"):
+        remove_question(question, sample_df, destination)
+
+def test_remove_questions_tombstones(tmp_path, sample_df):
+    destination = tmp_path / "questions.csv"
+    sample_df.to_csv(destination, index=False)
+    index = QuestionIndex.from_dataframe(sample_df)
+
+    assert remove_questions([make_question('Question 1')], sample_df, destination, index) == 1
+    assert index.tombstones == {0}
+    assert not index.has_use('Exam')
+    with pytest.raises(ValueError):
+        get_questions('Exam', ['Subject 1'], 1, sample_df, index)
+    # The row stays on disk until compaction, the deletion is logged next to it
+    assert len(pd.read_csv(destination)) == 2
+    assert pd.read_csv(deletion_log_path(destination))['position'].tolist() == [0]
+
+    with pytest.raises(ValueError, match="Question does not exist"):
+        remove_questions([make_question('Question 2', subject='Subject 2'), make_question('Question 1')], sample_df, destination, index)
+    assert index.tombstones == {0}
+
+def test_apply_deletion_log_and_compact(tmp_path, sample_df):
+    destination = tmp_path / "questions.csv"
+    sample_df.to_csv(destination, index=False)
+    remove_questions([make_question('Question 1')], sample_df, destination, QuestionIndex.from_dataframe(sample_df))
+
+    df = pd.read_csv(destination)
+    index = QuestionIndex.from_dataframe(df)
+    apply_deletion_log(df, destination, index)
+    assert index.tombstones == {0}
+    assert index.find('Question 1', 'Subject 1') is None
+
+    df = compact_questions(df, destination, index)
+    assert df.index.tolist() == [0]
+    assert pd.read_csv(destination)['question'].tolist() == ['Question 2']
+    assert not (tmp_path / "questions.csv.deleted").exists()
+
+def test_apply_deletion_log_ignores_replaced_rows(tmp_path, sample_df):
+    destination = tmp_path / "questions.csv"
+    pd.DataFrame({'position': [0, 5], 'question': ['Other question', 'Question 1'], 'subject': ['Subject 1'] * 2}) \
+        .to_csv(deletion_log_path(destination), index=False)
+    index = QuestionIndex.from_dataframe(sample_df)
+    apply_deletion_log(sample_df, destination, index)
+    assert index.tombstones == set()
+
+def test_get_questions_with_seed(sample_df):
+    sample_df = pd.concat([sample_df] * 10, ignore_index=True)
+    sample_df['question'] = [f'Question {i}' for i in range(len(sample_df))]
+    first = get_questions('Exam', ['Subject 1'], 5, sample_df, seed=7)
+    second = get_questions('Exam', ['Subject 1'], 5, sample_df, seed=7)
+    assert [q.question for q in first] == [q.question for q in second]
+    assert len({q.question for q in first}) == 5
+
+
+def test_parse_questions_csv_and_ndjson(sample_df):
+    csv = sample_df.drop(columns=['remark']).to_csv(index=False).encode()
+    ndjson = sample_df.to_json(orient='records', lines=True).encode()
+    for batch in (parse_questions(csv, 'text/csv'), parse_questions(ndjson, 'application/x-ndjson')):
+        assert batch.fillna('').to_dict('records') == sample_df.to_dict('records')
+
+    # Other JSON types are read as text, like in a CSV file, and nulls stay missing
+    ndjson = b'{"question": "Q", "subject": null, "use": "Exam", "correct": 1, "responseA": "A1", "responseB": "A2", "responseC": "A3"}'
+    batch = parse_questions(ndjson, 'application/x-ndjson')
+    assert batch.loc[0, 'correct'] == '1' and pd.isna(batch.loc[0, 'subject'])
+    with pytest.raises(ValueError, match="Missing columns: \\['correct'\\]"):
+        parse_questions(sample_df.drop(columns=['correct']).to_csv(index=False).encode(), 'text/csv')
+    with pytest.raises(ValueError, match="Unsupported media type"):
+        parse_questions(csv, 'application/json')
+
+def test_validate_questions(sample_df):
+    batch = pd.concat([sample_df, sample_df.iloc[[0]]], ignore_index=True)
+    batch.loc[1, 'correct'] = ''
+    batch.loc[len(batch)] = [None, 'Subject 1', 'Exam', 'A', 'A1', 'A2', 'A3', '', '']
+    batch.loc[len(batch)] = ['Question 3', 'Subject 1', 'Exam', 3, 'A1', 'A2', 'A3', '', '']
+    stored = {('Question 2', 'Subject 2')}
+    valid, errors = validate_questions(batch, lambda keys: np.array([key in stored for key in keys]))
+
+    assert valid.tolist() == [True, False, False, False, False]
+    assert [(error.row, error.errors) for error in errors] == [
+        (2, ["Question correct answer can't be empty", "Question already exists"]),
+        (3, ["Question is repeated in the upload"]),
+        (4, ["Field required: question"]),
+        (5, ["Fields must be strings"]),
+    ]
+    assert errors[2].question is None and errors[2].subject == 'Subject 1'
+
+def balanced_df():
+    return pd.DataFrame([
+        {'question': f'Question {i}', 'subject': subject, 'use': 'Exam', 'correct': 'A'}
+        for i, subject in enumerate(['Subject 1'] * 10 + ['Subject 2'] * 3)
+    ])
+
+def test_get_questions_balanced():
+    df = balanced_df()
+    questions = get_questions('Exam', ['Subject 1', 'Subject 2'], 6, df, weights=[1, 1], seed=3)
+    assert sorted(q.subject for q in questions) == ['Subject 1'] * 3 + ['Subject 2'] * 3
+    assert len({q.question for q in questions}) == 6
+    again = get_questions('Exam', ['Subject 1', 'Subject 2'], 6, df, weights=[1, 1], seed=3)
+    assert [q.question for q in questions] == [q.question for q in again]
+
+    questions = get_questions('Exam', ['Subject 1', 'Subject 2'], 8, df, weights=[3, 1])
+    assert sorted(q.subject for q in questions) == ['Subject 1'] * 6 + ['Subject 2'] * 2
+
+def test_get_questions_balanced_reports_each_subject():
+    with pytest.raises(ValueError, match=r"per subject: \{'Subject 1': 10, 'Subject 2': 3\}, requested per subject: \{'Subject 1': 4, 'Subject 2': 4\}"):
+        get_questions('Exam', ['Subject 1', 'Subject 2'], 8, balanced_df(), weights=[1, 1])
+
+def test_subject_quotas():
+    assert subject_quotas(['A', 'B', 'C'], 7) == {'A': 3, 'B': 2, 'C': 2}
+    assert subject_quotas(['A', 'B', 'A'], 4, [1, 2, 1]) == {'A': 2, 'B': 2}
+    with pytest.raises(ValueError, match="one weight per subject"):
+        subject_quotas(['A', 'B'], 4, [1])
+    with pytest.raises(ValueError, match="non-negative"):
+        subject_quotas(['A', 'B'], 4, [0, 0])
+    with pytest.raises(ValueError, match="non-negative"):
+        subject_quotas(['A', 'B'], 4, [1, -1])
+
+def test_labels_after():
+    buckets = [np.array([1, 4, 9]), np.array([0, 2, 3, 10]), np.array([], dtype=np.int64)]
+    assert labels_after(buckets, -1, 3).tolist() == [0, 1, 2]
+    assert labels_after(buckets, 3, 3).tolist() == [4, 9, 10]
+    assert labels_after(buckets, 10, 3).tolist() == []
+    assert labels_after([], -1, 3).tolist() == []
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(41, 'abcdef')) == (41, 'abcdef')
+    for cursor in ['', 'not a cursor', encode_cursor(1, 'a')[:-2] + '!!']:
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            decode_cursor(cursor)
+
+def test_encode_export_parquet_round_trip():
+    parquet = pytest.importorskip("pyarrow.parquet")
+    chunks = [
+        [CSVQuestion(question=f"Question {chunk}.{row}", subject="Subject", use="Exam", correct="A",
+                     responseA="A1", responseB="A2", responseC="A3").model_dump() for row in range(2)]
+        for chunk in range(3)
+    ]
+    exported = b''.join(encode_export(iter(chunks), 'parquet'))
+    # One row group per chunk, read back as the rows that were exported
+    assert parquet.ParquetFile(io.BytesIO(exported)).metadata.num_row_groups == 3
+    assert parquet.read_table(io.BytesIO(exported)).to_pylist() == [row for rows in chunks for row in rows]
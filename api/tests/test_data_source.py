@@ -0,0 +1,48 @@
+import hashlib
+import pytest
+import requests
+from data_source import CSVSource
+from tests.conftest import CSV, url
+
+
+def test_refresh_downloads_once_and_revalidates(server, tmp_path):
+    source = CSVSource(url(server), str(tmp_path))
+    assert source.cached_path() is None
+
+    fetched = source.refresh()
+    assert fetched.changed
+    assert fetched.path == str(tmp_path / f"{hashlib.sha256(CSV).hexdigest()}.csv")
+    assert open(fetched.path, 'rb').read() == CSV
+
+    assert source.refresh() == (fetched.path, False)
+    assert server.requests[1]['If-None-Match'] is not None
+
+    server.body = CSV + b"Q2,S1,Exam,B,B1,B2,B3,,\n"
+    changed = source.refresh()
+    assert changed.changed and changed.path != fetched.path
+    # The previous body is dropped from the cache once replaced
+    assert not (tmp_path / fetched.path).exists()
+
+def test_cached_copy_survives_offline(server, tmp_path):
+    source = CSVSource(url(server), str(tmp_path), timeout=1)
+    path = source.refresh().path
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(requests.RequestException):
+        source.refresh()
+    assert CSVSource(url(server), str(tmp_path)).cached_path() == path
+
+def test_rejected_body_is_not_cached(server, tmp_path):
+    source = CSVSource(url(server), str(tmp_path))
+    path = source.refresh().path
+
+    def reject(new_path):
+        assert open(new_path, 'rb').read() == b"<html>"
+        raise ValueError(new_path)
+
+    server.body = b"<html>"
+    with pytest.raises(ValueError):
+        source.refresh(on_change=reject)
+    assert source.cached_path() == path
+    assert open(path, 'rb').read() == CSV
+    assert not (tmp_path / f"{hashlib.sha256(b'<html>').hexdigest()}.csv").exists()
@@ -1,19 +1,126 @@
 import os
+import pandas as pd
+import pytest
+import main
 from main import app
+from repository.question import CSVQuestionRepository
+from tests.conftest import url
 from fastapi.testclient import TestClient
 
 client = TestClient(app)
 
 def test_health_check():
+    main.question_repository.load()
     response = client.get("/api-v1/healthcheck/")
     assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+def test_liveness_check():
+    response = client.get("/api-v1/healthcheck/live")
+    assert response.status_code == 200
     assert response.json() == {"status": "ok"}
 
-def test_invalid_path_health_check():
-    # Temporarily rename the data file to simulate unavailability
-    os.rename("data/data.csv", "data/data_temp.csv")
-    response = client.get("/api-v1/healthcheck/")
-    assert response.status_code == 503
-    assert response.json() == {"detail": "Service Unavailable"}
-    # Rename the file back to its original name
-    os.rename("data/data_temp.csv", "data/data.csv")
+def test_readiness_check_reports_the_data_store():
+    main.question_repository.load()
+    response = client.get("/api-v1/healthcheck/ready")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ok"
+    assert body["questions"]["generation"] == main.question_repository.generation
+    df, index = main.question_repository.snapshot()
+    assert body["questions"]["rows"] == len(df) - len(index.tombstones)
+    assert body["questions"]["last_reload"] is not None
+    assert body["questions"]["load_duration_seconds"] >= 0
+    assert body["questions"]["writers"] == 0
+    assert body["queued"] == {"io": 0, "hashing": 0}
+
+def test_readiness_check_does_not_touch_the_disk(tmp_path, monkeypatch):
+    repository = CSVQuestionRepository(str(tmp_path / "data.csv"))
+    pd.DataFrame([{"question": "Q", "subject": "S", "use": "U", "correct": "A"}]).to_csv(repository.path, index=False)
+    repository.load()
+    monkeypatch.setattr(main, "question_repository", repository)
+    # The last loaded data keeps being reported while the file is gone
+    os.remove(repository.path)
+    response = client.get("/api-v1/healthcheck/ready")
+    assert response.status_code == 200
+    assert response.json()["questions"]["rows"] == 1
+
+def test_invalid_path_health_check(tmp_path, monkeypatch):
+    # A repository whose file was never loaded is not ready
+    monkeypatch.setattr(main, "question_repository", CSVQuestionRepository(str(tmp_path / "missing.csv")))
+    for endpoint in ("/api-v1/healthcheck/", "/api-v1/healthcheck/ready"):
+        response = client.get(endpoint)
+        assert response.status_code == 503
+        assert response.json() == {"detail": "Service Unavailable"}
+    assert client.get("/api-v1/healthcheck/live").status_code == 200
+
+
+@pytest.fixture
+def startup(tmp_path, monkeypatch):
+    # Points the lifespan at temporary files and a temporary repository
+    repository = CSVQuestionRepository(str(tmp_path / "data.csv"))
+    monkeypatch.setattr(main, "path", repository.path)
+    monkeypatch.setattr(main, "destinations", [repository.path, str(tmp_path / "tests_data.csv")])
+    monkeypatch.setattr(main, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(main, "question_repository", repository)
+    return repository
+
+def test_startup_downloads_once_for_both_destinations(server, startup, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "csv_url", url(server))
+    with TestClient(app):
+        assert startup.get_subjects() == ["S1"]
+    assert len(server.requests) == 1
+    assert pd.read_csv(tmp_path / "tests_data.csv")["question"].tolist() == ["Q1"]
+
+def test_startup_serves_cache_and_refreshes_in_background(server, startup, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "csv_url", url(server))
+    with TestClient(app):
+        pass
+    server.body += b"Q2,S2,Exam,B,B1,B2,B3,,\n"
+    with TestClient(app):
+        pass
+    # The cached copy was served first, then replaced by the revalidated one
+    assert server.requests[1]["If-None-Match"] is not None
+    assert startup.get_subjects() == ["S1", "S2"]
+
+def test_startup_works_offline(server, startup, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "csv_url", url(server))
+    with TestClient(app):
+        pass
+    server.shutdown()
+    server.server_close()
+    os.remove(startup.path)
+    with TestClient(app) as offline:
+        assert startup.get_subjects() == ["S1"]
+        assert offline.get("/api-v1/healthcheck/").status_code == 200
+
+def test_startup_keeps_the_cache_when_the_download_is_unparsable(server, startup, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "csv_url", url(server))
+    with TestClient(app):
+        pass
+    server.body = b""
+    with TestClient(app):
+        pass
+    assert startup.get_subjects() == ["S1"]
+    # The empty body was not cached, so a later offline startup still has the questions
+    server.shutdown()
+    server.server_close()
+    os.remove(startup.path)
+    with TestClient(app):
+        assert startup.get_subjects() == ["S1"]
+
+def test_metrics_endpoint():
+    client.get("/api-v1/questions/subjects/")
+    client.get("/api-v1/questions/subjects/")
+    client.get("/api-v1/auth/login", auth=("alice", "wonderland"))
+    response = client.get("/api-v1/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    # Requests are aggregated by route template, not by URL
+    assert 'qcm_http_requests_total{route="/api-v1/questions/subjects/",method="GET",status="200"}' in text
+    assert 'qcm_http_request_duration_seconds_count{route="/api-v1/auth/login",method="GET"}' in text
+    assert 'qcm_cache_requests_total{cache="subjects",result="hit"}' in text
+    assert 'qcm_cache_requests_total{cache="credentials",result=' in text
+    assert 'qcm_stage_duration_seconds_count{stage=' in text
+    assert '# TYPE qcm_dataset_reloads_total counter' in text
@@ -0,0 +1,54 @@
+import pytest
+import metrics
+from metrics import Counter, Histogram, render, stage
+
+@pytest.fixture
+def registry(monkeypatch):
+    # Metrics created by a test are dropped from the exposition afterwards
+    monkeypatch.setattr(metrics, "_registry", [])
+    return metrics._registry
+
+def test_counter_renders_by_labels(registry):
+    counter = Counter("test_total", "Test counter.", ["route", "status"])
+    counter.inc(route="/a", status=200)
+    counter.inc(2, route="/a", status=200)
+    counter.inc(route="/b", status=404)
+    text = render()
+    assert "# TYPE test_total counter" in text
+    assert 'test_total{route="/a",status="200"} 3' in text
+    assert 'test_total{route="/b",status="404"} 1' in text
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = Histogram("test_seconds", "Test histogram.", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, stage="x")
+    text = render()
+    assert 'test_seconds_bucket{stage="x",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{stage="x",le="1.0"} 2' in text
+    assert 'test_seconds_bucket{stage="x",le="+Inf"} 3' in text
+    assert 'test_seconds_sum{stage="x"} 5.55' in text
+    assert 'test_seconds_count{stage="x"} 3' in text
+
+def test_label_values_are_escaped(registry):
+    counter = Counter("test_total", "Test counter.", ["name"])
+    counter.inc(name='a"b\\c')
+    assert 'test_total{name="a\\"b\\\\c"} 1' in render()
+
+def test_stage_times_into_the_stage_histogram():
+    before = metrics.STAGE_LATENCY.count(stage="test")
+    with stage("test"):
+        pass
+    assert metrics.STAGE_LATENCY.count(stage="test") == before + 1
+
+def test_disabled_metrics_record_nothing(registry, monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    counter = Counter("test_total", "Test counter.")
+    counter.inc()
+    with stage("disabled"):
+        pass
+    assert counter.value() == 0
+    assert metrics.STAGE_LATENCY.count(stage="disabled") == 0
+
+def test_route_template():
+    assert metrics.route_template({"path": "/a/42/b", "path_params": {"id": 42}, "route": object()}) == "/a/{id}/b"
+    assert metrics.route_template({"path": "/missing", "path_params": {}}) == "unmatched"
@@ -0,0 +1,58 @@
+import pandas as pd
+from unittest.mock import patch
+from near_duplicates import NearDuplicateIndex, band_keys, duplicate_report, has_words, rank_near_duplicates, similarity
+
+
+def test_similarity_ignores_punctuation_accents_and_order():
+    assert similarity("Qu'est-ce que Docker ?", "qu est ce que DOCKER") == 1.0
+    assert similarity("Un système distribué", "Distribué, un systeme.") == 1.0
+    assert similarity("Docker persiste les volumes", "Docker persiste les réseaux") == 0.5
+    assert similarity("", "Docker") == 0.0
+
+def test_similarity_keeps_negations():
+    assert similarity("Quel est l'avantage de Docker ?", "Quel n'est pas l'avantage de Docker ?") < 0.85
+    assert similarity("Docker ne persiste pas les volumes", "Docker persiste les volumes") < 0.85
+    assert rank_near_duplicates("Quel n'est pas l'avantage de Docker ?", [{'question': "Quel est l'avantage de Docker ?"}]) == []
+
+def test_band_keys_are_shared_by_similar_texts():
+    keys = band_keys(["Kafka est un système de messagerie", "Kafka est système de messagerie :", "Spark", "?"])
+    assert (keys[0] == keys[1]).all()
+    assert not (keys[0] == keys[2]).any()
+    assert has_words(keys).tolist() == [True, True, True, False]
+    # The keys do not depend on the process, so they can be stored
+    assert (band_keys(["Spark"]) == keys[2]).all()
+
+def test_rank_near_duplicates():
+    rows = [{'question': 'Docker est utilisé'}, {'question': 'Docker est-il utilisé ?'}, {'question': 'Docker est lent'}]
+    assert rank_near_duplicates('Docker est utilisé', rows) == [(rows[1], 1.0)]
+
+def test_index_candidates_follow_updates():
+    df = pd.DataFrame({'question': ['Kafka est un système de messagerie', 'Spark traite des flux', 'Hadoop stocke des fichiers']})
+    index = NearDuplicateIndex.from_dataframe(df, exclude=[2])
+    assert index.candidates('Kafka est système de messagerie ?') == [0]
+    assert index.candidates('Hadoop stocke des fichiers') == []
+
+    index.add(3, {'question': 'Hadoop stocke des fichiers !'})
+    index.remove(0)
+    assert index.candidates('Hadoop stocke des fichiers') == [3]
+    assert index.candidates('Kafka est système de messagerie ?') == []
+
+def test_duplicate_report():
+    df = pd.DataFrame({
+        'question': ['Kafka est un système de messagerie', 'Spark traite des flux', 'Kafka est système de messagerie', 'Kafka est un système de messagerie'],
+        'subject': ['Streaming', 'Streaming', 'Streaming', 'Autre'],
+    })
+    report = duplicate_report(df)
+    assert report.to_dict('records') == [{
+        'subject': 'Streaming', 'question': 'Kafka est un système de messagerie',
+        'near_duplicate': 'Kafka est système de messagerie', 'similarity': 1.0,
+    }]
+
+def test_candidates_of_a_templated_bank():
+    df = pd.DataFrame({'question': [f'Question synthétique numéro {i}' for i in range(300)]})
+    index = NearDuplicateIndex.from_dataframe(df)
+    with patch('near_duplicates.MAX_BUCKET_SIZE', 20), patch('near_duplicates.MAX_CANDIDATES', 5):
+        # The buckets of the template words are skipped, the number still tells the questions apart
+        candidates = index.candidates('QUESTION SYNTHETIQUE NUMERO 42 ?')
+    assert candidates[0] == 42
+    assert len(candidates) <= 5
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+from question_index import QuestionIndex, allocate_quotas, sample_labels, sample_quota_labels
+
+
+@pytest.fixture
+def sample_df():
+    return pd.DataFrame([
+        {'question': 'Question 1', 'subject': 'Subject 1', 'use': 'Exam'},
+        {'question': 'Question 2', 'subject': 'Subject 2', 'use': 'Exam'},
+        {'question': 'Question 3', 'subject': 'Subject 1', 'use': 'Quiz'},
+        {'question': 'Question 4', 'subject': 'Subject 1', 'use': 'Exam'},
+    ])
+
+def test_from_dataframe(sample_df):
+    index = QuestionIndex.from_dataframe(sample_df)
+    assert index.uses == {'Exam': 3, 'Quiz': 1}
+    assert index.subjects == {'Subject 1': 3, 'Subject 2': 1}
+    assert index.buckets[('Exam', 'Subject 1')].tolist() == [0, 3]
+    assert index.find('Question 2', 'Subject 2') == 1
+    assert index.find('Question 2', 'Subject 1') is None
+    assert len(index) == 4
+
+def test_candidates_and_count(sample_df):
+    index = QuestionIndex.from_dataframe(sample_df)
+    assert index.count('Exam', ['Subject 1', 'Subject 2']) == 3
+    assert index.count('Exam', ['Subject 1', 'Subject 1']) == 2
+    assert index.count('Quiz', ['Subject 2']) == 0
+    assert index.has_use('Quiz')
+    assert not index.has_subjects(['Subject 1', 'Unknown'])
+
+def test_add_and_remove(sample_df):
+    index = QuestionIndex.from_dataframe(sample_df)
+    index.add(4, 'Question 5', 'Subject 3', 'Quiz')
+    assert index.buckets[('Quiz', 'Subject 3')].tolist() == [4]
+    assert index.subjects['Subject 3'] == 1
+
+    index.remove(2, 'Question 3', 'Subject 1', 'Quiz')
+    assert ('Quiz', 'Subject 1') not in index.buckets
+    assert index.uses['Quiz'] == 1
+    assert index.find('Question 3', 'Subject 1') is None
+
+    index.remove(4, 'Question 5', 'Subject 3', 'Quiz')
+    assert 'Quiz' not in index.uses
+    assert 'Subject 3' not in index.subjects
+
+def test_buckets_are_read_only(sample_df):
+    index = QuestionIndex.from_dataframe(sample_df)
+    bucket = index.buckets[('Exam', 'Subject 1')]
+    index.add(4, 'Question 5', 'Subject 1', 'Exam')
+    # Readers holding the previous bucket keep a consistent view
+    assert bucket.tolist() == [0, 3]
+    with pytest.raises(ValueError):
+        bucket[0] = 1
+
+def test_sample_labels():
+    buckets = [np.arange(0, 5), np.arange(100, 103), np.arange(200, 201)]
+    labels = sample_labels(buckets, 9, np.random.default_rng())
+    assert sorted(labels.tolist()) == [0, 1, 2, 3, 4, 100, 101, 102, 200]
+
+    first = sample_labels(buckets, 4, np.random.default_rng(42))
+    second = sample_labels(buckets, 4, np.random.default_rng(42))
+    assert first.tolist() == second.tolist()
+    assert len(set(first.tolist())) == 4
+
+def test_allocate_quotas():
+    assert allocate_quotas(5, [1, 1]) == [3, 2]
+    assert allocate_quotas(10, [1, 1, 1]) == [4, 3, 3]
+    assert allocate_quotas(10, [3, 1]) == [8, 2]
+    assert allocate_quotas(4, [1, 0, 1]) == [2, 0, 2]
+
+def test_sample_quota_labels():
+    buckets = [np.arange(0, 5), None, np.arange(100, 103)]
+    labels = sample_quota_labels(buckets, [2, 0, 3], np.random.default_rng(1))
+    assert len(set(labels.tolist())) == 5
+    assert sum(label < 5 for label in labels) == 2
+    assert sorted(label for label in labels if label >= 100) == [100, 101, 102]
+    assert labels.tolist() == sample_quota_labels(buckets, [2, 0, 3], np.random.default_rng(1)).tolist()
+
+def test_copies_do_not_change_the_original(sample_df):
+    index = QuestionIndex.from_dataframe(sample_df)
+    copy = index.copy()
+    copy.add(4, 'Question 5', 'Subject 1', 'Exam')
+    copy.remove(0, 'Question 1', 'Subject 1', 'Exam')
+    assert copy.buckets[('Exam', 'Subject 1')].tolist() == [3, 4]
+    assert copy.find('Question 5', 'Subject 1') == 4 and copy.find('Question 1', 'Subject 1') is None
+    assert copy.tombstones == {0} and len(copy) == 4
+
+    assert index.buckets[('Exam', 'Subject 1')].tolist() == [0, 3]
+    assert index.find('Question 5', 'Subject 1') is None and index.find('Question 1', 'Subject 1') == 0
+    assert index.tombstones == set() and len(index) == 4
+
+    # A question removed then added again is found at its old label by older versions only
+    again = copy.copy()
+    again.add(5, 'Question 1', 'Subject 1', 'Exam')
+    assert again.find('Question 1', 'Subject 1') == 5
+    assert copy.find('Question 1', 'Subject 1') is None
+    assert index.find('Question 1', 'Subject 1') == 0
+
+    with pytest.raises(ValueError, match="increasing label order"):
+        again.add(5, 'Question 6', 'Subject 1', 'Exam')
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from models import CSVQuestion
+from question_store import QuestionColumns, QuestionRow, question_rows, resident_bytes
+
+
+def make_frame(rows):
+    # Strings built at runtime are distinct objects, like rows coming from JSON or the API
+    return pd.DataFrame({
+        'question': [f"Question {i}" for i in range(rows)],
+        'subject': ["".join(["Sub", "ject"]) for _ in range(rows)],
+        'use': ["".join(["Ex", "am"]) for _ in range(rows)],
+        'correct': ["".join(["A", ""]) + str(i % 2) for i in range(rows)],
+        'responseA': ['A1'] * rows,
+        'responseB': ['A2'] * rows,
+        'responseC': ['A3'] * rows,
+        'responseD': [np.nan] * rows,
+        'remark': [None] * rows,
+    })
+
+def test_question_columns_store_categorical_codes():
+    df = make_frame(100)
+    frame = QuestionColumns(df).frame()
+    assert isinstance(frame['subject'].dtype, pd.CategoricalDtype)
+    assert frame['correct'].cat.codes.dtype == np.int8
+    assert frame['subject'].tolist() == ['Subject'] * 100
+    assert frame['correct'].tolist() == df['correct'].tolist()
+    assert resident_bytes(frame) < resident_bytes(df)
+
+def test_question_columns_keep_missing_values():
+    df = make_frame(3)
+    df.loc[1, 'subject'] = np.nan
+    frame = QuestionColumns(df).frame()
+    assert frame['subject'].isna().tolist() == [False, True, False]
+
+def test_question_columns_add_categories_on_append():
+    columns = QuestionColumns(make_frame(2))
+    frame = columns.frame()
+    grown = columns.append([{'question': 'Q', 'subject': 'Other', 'use': None}], 2)
+    assert grown['subject'].tolist() == ['Subject', 'Subject', 'Other']
+    assert pd.isna(grown.at[2, 'use'])
+    # The published frame keeps its categories
+    assert list(frame['subject'].cat.categories) == ['Subject']
+
+def test_question_rows():
+    df = make_frame(5)
+    df.index = [10, 11, 12, 13, 14]
+    rows = question_rows(df, [13, 10])
+    assert [row.question for row in rows] == ['Question 3', 'Question 0']
+    assert rows[0].responseD == '' and rows[0].remark == ''
+    assert rows[0].to_model() == CSVQuestion(**rows[0].to_dict())
+    assert not hasattr(rows[0], '__dict__')
+
+def test_question_row_converts_values_to_text():
+    row = QuestionRow('Q', 'S', 'U', 1, 'A1', 'A2', 'A3', None, float('nan'))
+    assert (row.correct, row.responseD, row.remark) == ('1', '', '')
+
+def test_question_columns_publish_frames_without_copies():
+    columns = QuestionColumns(make_frame(3))
+    frame = columns.frame()
+    assert frame.index.equals(pd.RangeIndex(3))
+
+    grown = columns.append([{'question': 'Question 3', 'subject': 'Subject'}], 3)
+    # The published frame is unchanged, and the new one shares its rows
+    assert len(frame) == 3 and len(grown) == 4
+    assert grown['question'].tolist() == ['Question 0', 'Question 1', 'Question 2', 'Question 3']
+    assert np.shares_memory(frame['question'].to_numpy(), grown['question'].to_numpy())
+    assert pd.isna(grown.at[3, 'remark'])
+
+    # Appending past the spare room reallocates the buffers, published frames keep theirs
+    for i in range(4, 100):
+        grown = columns.append([{'question': f'Question {i}'}], i)
+    assert len(grown) == 100 and grown.at[99, 'question'] == 'Question 99'
+    assert frame['question'].tolist() == ['Question 0', 'Question 1', 'Question 2']
@@ -0,0 +1,56 @@
+import numpy as np
+from unittest.mock import patch
+from quiz_session import LazyPermutation, QuizSession, SessionStore
+
+def test_lazy_permutation_is_a_permutation():
+    permutation = LazyPermutation(50, np.random.default_rng(3))
+    taken = permutation.take(7) + permutation.take(40) + permutation.take(10)
+    assert sorted(taken) == list(range(50))
+    assert len(permutation) == 0
+    assert permutation.take(5) == []
+
+def test_lazy_permutation_only_stores_swaps():
+    permutation = LazyPermutation(10**9, np.random.default_rng(1))
+    taken = permutation.take(1000)
+    assert len(set(taken)) == 1000
+    assert len(permutation._swapped) <= 1000
+    assert LazyPermutation(10**9, np.random.default_rng(1)).take(1000) == taken
+
+def test_session_draws_from_every_candidate_array():
+    session = QuizSession('alice', 'Exam', ['A', 'B'], seed=4)
+    session.rebase(1, [np.array([10, 11, 12]), np.array([20, 21])])
+    assert session.remaining() == 5
+    assert sorted(session.draw_ids(5)) == [10, 11, 12, 20, 21]
+    assert session.remaining() == 0
+
+def test_session_skips_questions_served_before_a_rebase():
+    session = QuizSession('alice', 'Exam', ['A'])
+    rows = [{'question': 'Q1', 'subject': 'A'}, {'question': 'Q2', 'subject': 'A'}]
+    assert session.mark_served(rows) == rows
+    session.rebase(2, [np.array([1, 2, 3])], served_candidates=2)
+    assert session.remaining() == 1
+    assert len(session.draw_ids(3)) == 3
+    assert session.mark_served(rows + [{'question': 'Q3', 'subject': 'A'}]) == [{'question': 'Q3', 'subject': 'A'}]
+    assert session.remaining() == 0
+
+def test_session_store_evicts_least_recently_used():
+    store = SessionStore(max_size=2)
+    first, second = store.add(QuizSession('a', 'U', [])), store.add(QuizSession('b', 'U', []))
+    store.get(first)
+    third = store.add(QuizSession('c', 'U', []))
+    assert len(store) == 2
+    assert store.get(second) is None
+    assert store.get(first) is not None and store.get(third) is not None
+
+def test_session_store_expires_idle_sessions():
+    store = SessionStore(ttl=10)
+    with patch('quiz_session.time.monotonic', return_value=100.0):
+        session_id = store.add(QuizSession('a', 'U', []))
+    with patch('quiz_session.time.monotonic', return_value=105.0):
+        assert store.get(session_id) is not None
+    with patch('quiz_session.time.monotonic', return_value=114.0):
+        # The previous get extended the lifetime
+        assert store.get(session_id) is not None
+    with patch('quiz_session.time.monotonic', return_value=200.0):
+        assert store.get(session_id) is None
+    assert len(store) == 0
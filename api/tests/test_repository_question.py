@@ -0,0 +1,194 @@
+import threading
+import pandas as pd
+import pytest
+from csv_management import row_anchor
+from models import CSVQuestion
+from repository.question import CSVQuestionRepository
+from search_index import SearchIndex
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "data.csv"
+    pd.DataFrame([{
+        'question': 'Question 1', 'subject': 'Subject 1', 'use': 'Exam', 'correct': 'A',
+        'responseA': 'A1', 'responseB': 'A2', 'responseC': 'A3', 'responseD': 'A4', 'remark': ''
+    }]).to_csv(path, index=False)
+    return str(path)
+
+def make_question(text):
+    return CSVQuestion(question=text, subject='Subject 1', use='Exam', correct='A',
+                       responseA='A1', responseB='A2', responseC='A3')
+
+def test_concurrent_writes_are_not_lost(csv_path):
+    repository = CSVQuestionRepository(csv_path)
+    threads = [threading.Thread(target=repository.add, args=(make_question(f'Question {i}'),)) for i in range(2, 22)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(repository.dataframe) == 21
+    assert sorted(pd.read_csv(csv_path)['question']) == sorted(repository.dataframe['question'])
+    assert not repository.is_stale()
+
+def test_writers_of_several_workers_see_each_other(csv_path):
+    # Two repositories on the same file behave like two uvicorn workers
+    worker_a = CSVQuestionRepository(csv_path, compaction_threshold=1.0)
+    worker_b = CSVQuestionRepository(csv_path, compaction_threshold=1.0)
+    worker_a.load()
+    worker_b.load()
+
+    worker_a.add(make_question('Question 2'))
+    worker_b.add(make_question('Question 3'))
+    worker_a.remove(make_question('Question 3'))
+    with pytest.raises(ValueError, match="Question already exists"):
+        worker_b.add(make_question('Question 2'))
+
+    assert pd.read_csv(csv_path)['question'].tolist() == ['Question 1', 'Question 2', 'Question 3']
+    assert worker_b.index.find('Question 3', 'Subject 1') is None
+    assert worker_b.index.count('Exam', ['Subject 1']) == 2
+
+def test_readers_do_not_block_on_writers(csv_path):
+    reader, writer = CSVQuestionRepository(csv_path), CSVQuestionRepository(csv_path)
+    df = reader.dataframe
+    with writer._file_lock():
+        pd.DataFrame([make_question('Question 2').model_dump()]).to_csv(csv_path, mode='a', header=False, index=False)
+        # The writer of the other worker is busy: the current snapshot is served
+        assert reader.dataframe is df
+        assert reader.generation == 1
+    assert reader.dataframe['question'].tolist() == ['Question 1', 'Question 2']
+    assert reader.generation == 2
+
+def test_pinned_reads_do_not_hold_writers_off(csv_path):
+    repository = CSVQuestionRepository(csv_path)
+    with repository.pinned():
+        generation = repository.current_generation()
+        writer = threading.Thread(target=repository.add, args=(make_question('Question 2'),))
+        writer.start()
+        writer.join(timeout=5)
+        assert not writer.is_alive()
+        # The block keeps reading the snapshot it pinned
+        assert repository.current_generation() == generation
+        with pytest.raises(KeyError):
+            repository.get_question_rows([1])
+        assert repository.search('Question', 10) == (generation, 1, [0])
+    assert repository.current_generation() == generation + 1
+    assert sorted(repository.search('Question', 10)[2]) == [0, 1]
+
+def test_snapshot_is_consistent_after_bulk_insert(csv_path):
+    repository = CSVQuestionRepository(csv_path)
+    df, index = repository.snapshot()
+    repository.add_many([make_question(f'Question {i}') for i in range(2, 5)])
+    # Readers holding the previous snapshot keep a DataFrame/index pair that agree
+    assert index.count('Exam', ['Subject 1']) == len(df) == 1
+    new_df, new_index = repository.snapshot()
+    assert new_index.count('Exam', ['Subject 1']) == len(new_df) == 4
+
+def test_snapshot_is_consistent_after_single_insert_and_removal(csv_path):
+    repository = CSVQuestionRepository(csv_path, compaction_threshold=1.0)
+    df, index = repository.snapshot()
+    repository.add(make_question('Question 2'))
+    # The previous snapshot is neither grown nor reused
+    assert repository.snapshot()[0] is not df
+    assert index.count('Exam', ['Subject 1']) == len(df) == len(index) == 1
+    assert index.find('Question 2', 'Subject 1') is None
+
+    df, index = repository.snapshot()
+    repository.remove(make_question('Question 1'))
+    assert index.find('Question 1', 'Subject 1') == 0 and not index.tombstones
+    assert index.count('Exam', ['Subject 1']) == len(index) == 2
+    new_df, new_index = repository.snapshot()
+    assert new_index.tombstones == {0} and len(new_index) == 1
+
+def test_stats_track_loads_and_writers(csv_path):
+    repository = CSVQuestionRepository(csv_path, compaction_threshold=1.0)
+    assert repository.stats() == {"loaded": False, "load_error": None}
+    repository.load()
+    stats = repository.stats()
+    assert stats["generation"] == 1 and stats["rows"] == 1 and stats["writers"] == 0
+    assert stats["load_duration_seconds"] >= 0 and stats["load_error"] is None
+
+    repository.add(make_question('Question 2'))
+    repository.remove(make_question('Question 1'))
+    assert repository.stats()["rows"] == 1
+    assert repository.stats()["tombstoned_rows"] == 1
+    with repository._write_locked():
+        assert repository.stats()["writers"] == 1
+
+def test_failed_load_is_reported(csv_path):
+    def broken(path):
+        raise ValueError("unparseable")
+    repository = CSVQuestionRepository(csv_path, loader=broken)
+    with pytest.raises(ValueError):
+        repository.load()
+    assert repository.stats() == {"loaded": False, "load_error": "ValueError: unparseable"}
+
+def test_search_follows_writes(csv_path):
+    repository = CSVQuestionRepository(csv_path, compaction_threshold=1.0)
+    repository.add(make_question('Qu’est-ce qu’un réseau ?'))
+    generation, total, labels = repository.search('RESEAU', 10)
+    assert (generation, total) == (repository.generation, 1)
+    search_index = repository._derived[SearchIndex][1]
+
+    # Writes update the search index in place instead of rebuilding it
+    repository.add_many([make_question('Un autre réseau'), make_question('Sans rapport')])
+    repository.remove(make_question('Qu’est-ce qu’un réseau ?'))
+    generation, total, labels = repository.search('reseau', 10)
+    assert repository._derived[SearchIndex][1] is search_index
+    assert total == 1
+    assert repository.dataframe.loc[labels[0], 'question'] == 'Un autre réseau'
+
+    # Compaction relabels the rows, so the index is rebuilt on the next search
+    repository.compact()
+    generation, total, labels = repository.search('reseau', 10)
+    assert repository._derived[SearchIndex][1] is not search_index
+    assert repository.dataframe.loc[labels, 'question'].tolist() == ['Un autre réseau']
+
+def test_find_near_duplicates_follows_writes(csv_path):
+    repository = CSVQuestionRepository(csv_path, compaction_threshold=1.0)
+    assert repository.find_near_duplicates(make_question('Question 2')) == []
+
+    repository.add(make_question('Qu’est-ce qu’un réseau ?'))
+    duplicates = repository.find_near_duplicates(make_question('qu est ce qu un RESEAU'))
+    assert [(row['question'], score) for row, score in duplicates] == [('Qu’est-ce qu’un réseau ?', 1.0)]
+    # Only the questions of the same subject are compared
+    other_subject = make_question('Un réseau').model_copy(update={'subject': 'Subject 2'})
+    assert repository.find_near_duplicates(other_subject) == []
+
+    repository.remove(make_question('Qu’est-ce qu’un réseau ?'))
+    assert repository.find_near_duplicates(make_question('Un réseau ?')) == []
+
+def test_list_question_ids_resumes_across_writes(csv_path):
+    repository = CSVQuestionRepository(csv_path, compaction_threshold=1.0)
+    repository.add_many([make_question(f'Question {i}') for i in range(2, 7)])
+    repository.add(make_question('Question 7').model_copy(update={'use': 'Quiz'}))
+    generation, ids = repository.list_question_ids(-1, 3)
+    assert (generation, ids) == (repository.generation, [0, 1, 2])
+    anchor = row_anchor('Question 3', 'Subject 1')
+
+    # Rows removed or added meanwhile are neither repeated nor skipped
+    repository.remove(make_question('Question 4'))
+    repository.add(make_question('Question 8'))
+    assert repository.list_question_ids(2, 10, anchor=anchor)[1] == [4, 5, 6, 7]
+    assert repository.list_question_ids(-1, 10, use='Exam', subjects=['Subject 1'])[1] == [0, 1, 2, 4, 5, 7]
+    with pytest.raises(ValueError, match="use you provide is not available"):
+        repository.list_question_ids(-1, 10, use='Unknown')
+
+    # Compaction renumbers the rows after the removed one, whose cursors can no longer be resumed
+    repository.compact()
+    assert repository.list_question_ids(2, 10, anchor=anchor)[1] == [3, 4, 5, 6]
+    with pytest.raises(ValueError, match="cursor is no longer valid"):
+        repository.list_question_ids(5, 10, anchor=row_anchor('Question 6', 'Subject 1'))
+
+def test_iter_question_rows_reads_a_snapshot(csv_path):
+    repository = CSVQuestionRepository(csv_path, compaction_threshold=1.0)
+    repository.add_many([make_question(f'Question {i}') for i in range(2, 6)])
+    chunks = repository.iter_question_rows(subjects=['Subject 1'], chunk_size=2)
+    first = next(chunks)
+    repository.remove(make_question('Question 4'))
+    repository.add(make_question('Question 6'))
+    rows = first + [row for chunk in chunks for row in chunk]
+    assert [row['question'] for row in rows] == ['Question 1', 'Question 2', 'Question 3', 'Question 4', 'Question 5']
+    with pytest.raises(ValueError, match="subjects you provide are not available"):
+        repository.iter_question_rows(subjects=['Unknown'])
@@ -0,0 +1,154 @@
+import pandas as pd
+import pytest
+from models import CSVQuestion, ImportReport, QuestionKey
+from repository.sqlite_question import SQLiteQuestionRepository, migrate_csv
+
+
+@pytest.fixture
+def repository(tmp_path):
+    repository = SQLiteQuestionRepository(str(tmp_path / "questions.db"), pool_size=2)
+    repository.add_many([make_question(f'Question {i}', subject=f'Subject {i % 2}') for i in range(6)])
+    yield repository
+    repository.close()
+
+def make_question(text, subject='Subject 0', use='Exam', correct='A'):
+    return CSVQuestion(question=text, subject=subject, use=use, correct=correct,
+                       responseA='A1', responseB='A2', responseC='A3')
+
+def test_find_questions(repository):
+    questions = repository.find_questions('Exam', ['Subject 0'], 3)
+    assert sorted(q.question for q in questions) == ['Question 0', 'Question 2', 'Question 4']
+    assert questions[0].responseD == ''
+
+    with pytest.raises(ValueError, match="use you provide is not available"):
+        repository.find_questions('Quiz', ['Subject 0'], 1)
+    with pytest.raises(ValueError, match="subjects you provide are not available"):
+        repository.find_questions('Exam', ['Subject 0', 'Unknown'], 1)
+    with pytest.raises(ValueError, match="Number of questions available: 6"):
+        repository.find_questions('Exam', ['Subject 0', 'Subject 1'], 7)
+
+def test_contains_keys(repository):
+    keys = [('Question 1', 'Subject 1'), ('Question 1', 'Subject 0'), ('Unknown', 'Subject 0')]
+    assert repository.contains_keys(keys).tolist() == [True, False, False]
+
+def test_subjects_and_uses(repository):
+    assert repository.get_subjects() == ['Subject 0', 'Subject 1']
+    assert repository.get_uses() == ['Exam']
+
+def test_add_rejects_duplicates_and_empty_correct(repository):
+    generation = repository.generation
+    with pytest.raises(ValueError, match="Question already exists"):
+        repository.add_many([make_question('New Question'), make_question('Question 0')])
+    with pytest.raises(ValueError, match="correct answer can't be empty"):
+        repository.add(make_question('New Question', correct=''))
+    assert len(repository) == 6
+    assert repository.generation == generation
+
+    repository.add(make_question('Question 0', subject='Subject 2'))
+    assert len(repository) == 7
+    assert repository.generation == generation + 1
+
+def test_remove(repository):
+    assert repository.remove(QuestionKey(question='Question 0', subject='Subject 0')) is True
+    with pytest.raises(ValueError, match="Question does not exist"):
+        repository.remove_many([QuestionKey(question='Question 2', subject='Subject 0'),
+                                QuestionKey(question='Question 0', subject='Subject 0')])
+    # The failed batch was rolled back
+    assert len(repository) == 5
+
+def test_migrate_csv(tmp_path):
+    csv_path = tmp_path / "data.csv"
+    pd.DataFrame([
+        make_question('Question 1').model_dump(),
+        make_question('Question 1').model_dump(),
+        {**make_question('Question 2').model_dump(), 'responseC': None},
+        {**make_question('Question 3').model_dump(), 'correct': None},
+    ]).to_csv(csv_path, index=False)
+    repository = SQLiteQuestionRepository(str(tmp_path / "questions.db"))
+    report = ImportReport()
+    assert migrate_csv(str(csv_path), repository, report, chunksize=2) == 2
+    assert report.rejected == {'missing_correct': 1}
+    assert migrate_csv(str(csv_path), repository) == 0
+    assert sorted(q.responseC for q in repository.find_questions('Exam', ['Subject 0'], 2)) == ['', 'A3']
+    # The migrated questions are filed for the near-duplicate lookups
+    assert [row['question'] for row, _ in repository.find_near_duplicates(make_question('question: 2'))] == ['Question 2']
+    repository.close()
+
+def test_find_questions_with_seed(repository):
+    first = repository.find_questions('Exam', ['Subject 0', 'Subject 1'], 4, seed=11)
+    assert first == repository.find_questions('Exam', ['Subject 0', 'Subject 1'], 4, seed=11)
+
+def test_find_questions_balanced(repository):
+    repository.add_many([make_question(f'Extra {i}', subject='Subject 0') for i in range(6)])
+    questions = repository.find_questions('Exam', ['Subject 0', 'Subject 1'], 6, seed=2, weights=[1, 1])
+    assert sorted(q.subject for q in questions) == ['Subject 0'] * 3 + ['Subject 1'] * 3
+    assert questions == repository.find_questions('Exam', ['Subject 0', 'Subject 1'], 6, seed=2, weights=[1, 1])
+    with pytest.raises(ValueError, match="per subject: \\{'Subject 0': 9, 'Subject 1': 3\\}"):
+        repository.find_questions('Exam', ['Subject 0', 'Subject 1'], 8, weights=[1, 1])
+
+def test_search(repository):
+    repository.add_many([make_question('Qu’est-ce qu’un SYSTÈME distribué ?'), make_question('Un système', subject='Subject 1')])
+    generation, total, ids = repository.search('systeme', 10)
+    assert (generation, total) == (repository.generation, 2)
+    # The shorter question matches better
+    assert [row['question'] for row in repository.get_question_rows(ids)[1]] == ['Un système', 'Qu’est-ce qu’un SYSTÈME distribué ?']
+    assert repository.search('systeme distribue', 10)[1:] == (1, ids[1:])
+    assert repository.search('systeme', 1, offset=1)[1:] == (2, ids[1:])
+    # FTS5 operators are searched as plain words
+    assert repository.search('systeme OR "question', 10)[1] == 0
+
+    repository.remove(QuestionKey(question='Un système', subject='Subject 1'))
+    assert repository.search('systeme', 10)[1:] == (1, ids[1:])
+
+def test_existing_databases_are_indexed(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "questions.db")
+    repository = SQLiteQuestionRepository(path)
+    repository.add(make_question('Un réseau'))
+    repository.close()
+    # A database created before the search table existed
+    with sqlite3.connect(path) as connection:
+        connection.executescript('DROP TRIGGER questions_search_insert; DROP TRIGGER questions_search_delete; DROP TABLE questions_search; '
+                                 'DROP TRIGGER questions_bands_delete; DROP TABLE question_bands;')
+    repository = SQLiteQuestionRepository(path)
+    assert repository.search('reseau', 10)[1] == 1
+    assert len(repository.find_near_duplicates(make_question('Un réseau ?'))) == 1
+    repository.close()
+
+def test_band_keys_of_older_shingles_are_recomputed(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "questions.db")
+    repository = SQLiteQuestionRepository(path)
+    repository.add(make_question('Un réseau'))
+    repository.close()
+    # Band keys stored before the shingles last changed
+    with sqlite3.connect(path) as connection:
+        connection.executescript('UPDATE question_bands SET band_key = 0; PRAGMA user_version = 1;')
+    repository = SQLiteQuestionRepository(path)
+    assert len(repository.find_near_duplicates(make_question('Un réseau ?'))) == 1
+    repository.close()
+
+def test_find_near_duplicates(repository):
+    repository.add(make_question('Qu’est-ce qu’un réseau ?'))
+    duplicates = repository.find_near_duplicates(make_question('qu est ce qu un RESEAU'))
+    assert [(row['question'], score) for row, score in duplicates] == [('Qu’est-ce qu’un réseau ?', 1.0)]
+    assert duplicates[0][0]['responseA'] == 'A1'
+    assert repository.find_near_duplicates(make_question('Un réseau', subject='Subject 1')) == []
+
+    repository.remove(QuestionKey(question='Qu’est-ce qu’un réseau ?', subject='Subject 0'))
+    assert repository.find_near_duplicates(make_question('Un réseau')) == []
+
+def test_list_question_ids_and_iter_question_rows(repository):
+    generation, ids = repository.list_question_ids(-1, 4)
+    assert generation == repository.generation
+    assert [row['question'] for row in repository.get_question_rows(ids)[1]] == [f'Question {i}' for i in range(4)]
+    repository.remove(QuestionKey(question='Question 4', subject='Subject 0'))
+    assert len(repository.list_question_ids(ids[-1], 4)[1]) == 1
+    assert repository.list_question_ids(-1, 10, use='Exam', subjects=['Subject 1', 'Subject 1'])[1] == [2, 4, 6]
+    with pytest.raises(ValueError, match="use you provide is not available"):
+        repository.list_question_ids(-1, 10, use='Quiz')
+
+    chunks = list(repository.iter_question_rows(subjects=['Subject 0'], chunk_size=1))
+    assert [[row['question'] for row in chunk] for chunk in chunks] == [['Question 0'], ['Question 2']]
+    with pytest.raises(ValueError, match="subjects you provide are not available"):
+        repository.iter_question_rows(subjects=['Unknown'])
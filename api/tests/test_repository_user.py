@@ -0,0 +1,34 @@
+import pytest
+from models import User
+from repository.user import UserRepository
+
+
+@pytest.fixture
+def users_file(tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text(
+        "id,name,password\n"
+        "0,admin,$2b$12$hashedadmin\n"
+        "1,alice,$2b$12$hashedalice\n"
+    )
+    return path
+
+def test_get(users_file):
+    repository = UserRepository(str(users_file))
+    user = repository.get("alice")
+    assert user == User(id=1, name="alice", password="$2b$12$hashedalice")
+    assert repository.get("unknown") is None
+    assert len(repository) == 2
+
+def test_add(users_file):
+    repository = UserRepository(str(users_file))
+    repository.add(User(id=2, name="bob", password="$2b$12$hashedbob"))
+    assert repository.get("bob").id == 2
+    assert [user.name for user in repository] == ["admin", "alice", "bob"]
+
+def test_load_many_users(tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text("id,name,password\n" + "".join(f"{i},user{i},$2b$12$hash{i}\n" for i in range(20000)))
+    repository = UserRepository(str(path))
+    assert len(repository) == 20000
+    assert repository.get("user19999").id == 19999
@@ -0,0 +1,89 @@
+import itertools
+import json
+import threading
+from contextlib import contextmanager
+import pandas as pd
+import pytest
+from models import CSVQuestion
+from repository.question import CSVQuestionRepository
+from repository.sqlite_question import SQLiteQuestionRepository
+from response_cache import ResponseCache, etag_matches
+
+
+@pytest.fixture
+def csv_repository(tmp_path):
+    path = tmp_path / "data.csv"
+    pd.DataFrame([make_question(f'Question {i}').model_dump() for i in range(4)]).to_csv(path, index=False)
+    return CSVQuestionRepository(str(path))
+
+@pytest.fixture
+def sqlite_repository(tmp_path):
+    repository = SQLiteQuestionRepository(str(tmp_path / "questions.db"), pool_size=2)
+    repository.add_many([make_question(f'Question {i}') for i in range(4)])
+    yield repository
+    repository.close()
+
+def make_question(text, subject='Subject 1'):
+    return CSVQuestion(question=text, subject=subject, use='Exam', correct='A',
+                       responseA='A1', responseB='A2', responseC='A3', responseD='', remark='')
+
+def test_etag_matches():
+    assert etag_matches('"a", W/"b"', '"b"')
+    assert etag_matches('*', '"b"')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches(None, '"b"')
+
+@pytest.mark.parametrize("name", ["csv_repository", "sqlite_repository"])
+def test_questions_match_the_models(name, request):
+    repository = request.getfixturevalue(name)
+    cache = ResponseCache()
+    encoded = cache.questions(repository, 'Exam', ['Subject 1'], 3, seed=1)
+    expected = [q.model_dump() for q in repository.find_questions('Exam', ['Subject 1'], 3, seed=1)]
+    assert json.loads(encoded.body) == expected
+    assert cache.questions(repository, 'Exam', ['Subject 1'], 3, seed=1) == encoded
+
+    with pytest.raises(ValueError, match="Number of questions available: 4"):
+        cache.questions(repository, 'Exam', ['Subject 1'], 5)
+
+@pytest.mark.parametrize("name", ["csv_repository", "sqlite_repository"])
+def test_questions_pin_the_repository_under_constant_writes(name, request, monkeypatch):
+    repository = request.getfixturevalue(name)
+    added = itertools.count(4)
+    pinned = []
+    get_question_rows, pin = repository.get_question_rows, repository.pinned
+
+    def write_then_read(ids):
+        # Another thread writes between every draw and the read of its rows, until pinned
+        if not pinned:
+            writer = threading.Thread(target=repository.add, args=(make_question(f'Question {next(added)}'),))
+            writer.start()
+            writer.join()
+        return get_question_rows(ids)
+
+    @contextmanager
+    def pinning():
+        with pin():
+            pinned.append(True)
+            yield
+
+    monkeypatch.setattr(repository, 'get_question_rows', write_then_read)
+    monkeypatch.setattr(repository, 'pinned', pinning)
+    encoded = ResponseCache().questions(repository, 'Exam', ['Subject 1'], 3, seed=1)
+    assert pinned == [True]
+    assert json.loads(encoded.body) == [q.model_dump() for q in repository.find_questions('Exam', ['Subject 1'], 3, seed=1)]
+
+@pytest.mark.parametrize("name", ["csv_repository", "sqlite_repository"])
+def test_mutations_invalidate_the_cache(name, request):
+    repository = request.getfixturevalue(name)
+    cache = ResponseCache()
+    subjects = cache.subjects(repository)
+    assert json.loads(subjects.body) == ['Subject 1']
+    assert cache.subjects(repository) is subjects
+
+    repository.add(make_question('Question 4', subject='Subject 2'))
+    assert json.loads(cache.subjects(repository).body) == ['Subject 1', 'Subject 2']
+    assert cache.subjects(repository).etag != subjects.etag
+
+    repository.remove(make_question('Question 4', subject='Subject 2'))
+    assert cache.subjects(repository).etag == subjects.etag
+    assert json.loads(cache.uses(repository).body) == ['Exam']
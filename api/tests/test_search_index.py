@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+from search_index import SearchIndex, fold, tokenize
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame([
+        {'question': "Qu'est-ce qu'un système distribué ?", 'responseA': 'Un réseau', 'responseB': 'Un serveur', 'remark': ''},
+        {'question': 'Docker est utilisé', 'responseA': 'pour développer rapidement', 'responseB': 'un système', 'remark': None},
+        {'question': 'Élève ou professeur', 'responseA': 'Œuvre', 'responseB': '', 'remark': 'Système'},
+    ])
+
+def test_fold_and_tokenize():
+    assert fold("Élève ÇA Œuvre") == "eleve ca oeuvre"
+    assert tokenize("Qu'est-ce qu'un système DISTRIBUÉ ?") == ['systeme', 'distribue']
+
+def test_search_ignores_accents_and_case(df):
+    index = SearchIndex.from_dataframe(df)
+    assert index.search('ELEVE', 10) == (1, [2])
+    assert index.search('oeuvre', 10) == (1, [2])
+    assert index.search('réseau', 10) == (1, [0])
+
+def test_search_requires_every_word(df):
+    index = SearchIndex.from_dataframe(df)
+    assert index.search('systeme distribue', 10) == (1, [0])
+    assert index.search('systeme inconnu', 10) == (0, [])
+    assert index.search('le la', 10) == (0, [])
+
+def test_search_ranks_question_matches_first(df):
+    index = SearchIndex.from_dataframe(df)
+    # In the question text of row 0, in an answer of row 1 and in the remark of row 2
+    total, labels = index.search('système', 10)
+    assert total == 3
+    assert labels == [0, 1, 2]
+
+def test_search_pages(df):
+    index = SearchIndex.from_dataframe(df)
+    assert index.search('systeme', 2) == (3, [0, 1])
+    assert index.search('systeme', 2, offset=2) == (3, [2])
+    assert index.search('systeme', 2, offset=3) == (3, [])
+
+def test_incremental_updates(df):
+    index = SearchIndex.from_dataframe(df, exclude=[1])
+    assert index.search('docker', 10) == (0, [])
+
+    index.add(5, {'question': 'Les volumes Docker', 'responseA': 'Oui'})
+    assert index.search('docker', 10) == (1, [5])
+    index.remove(0)
+    assert index.search('systeme', 10) == (1, [2])
+    assert len(index) == 2
+
+    with pytest.raises(ValueError, match="increasing label order"):
+        index.add(4, {'question': 'Trop tard'})
@@ -1,4 +1,10 @@
-from service.auth import AuthService, verify_password, get_user_by_name
+import asyncio
+import threading
+from unittest.mock import patch
+from service.auth import (
+    AuthService, CredentialCache, credential_cache, create_access_token, decode_access_token,
+    verify_password, get_user_by_name, update_password
+)
 
 def test_get_user_by_name():
     user = get_user_by_name("alice")
@@ -20,3 +26,69 @@ def test_is_admin():
     assert AuthService.is_admin("admin", "4dm1N") is True
     assert AuthService.is_admin("alice", "wonderland") is False
     assert AuthService.is_admin("admin", "wrongpassword") is False
+
+
+def test_credential_cache_skips_bcrypt():
+    credential_cache.clear()
+    assert AuthService.authenticate_user("bob", "builder") is True
+    with patch('service.auth.verify_password') as mock_verify_password:
+        assert AuthService.authenticate_user("bob", "builder") is True
+        mock_verify_password.assert_not_called()
+
+def test_credential_cache_rejects_other_password():
+    credential_cache.clear()
+    assert AuthService.authenticate_user("bob", "builder") is True
+    assert AuthService.authenticate_user("bob", "wrongpassword") is False
+
+def test_credential_cache_invalidated_on_password_change():
+    credential_cache.clear()
+    assert AuthService.authenticate_user("clementine", "mandarine") is True
+    try:
+        assert update_password("clementine", "orange") is True
+        assert AuthService.authenticate_user("clementine", "mandarine") is False
+        assert AuthService.authenticate_user("clementine", "orange") is True
+    finally:
+        update_password("clementine", "mandarine")
+    assert update_password("unknown", "password") is False
+
+def test_credential_cache_ttl_and_size():
+    alice, bob = get_user_by_name("alice"), get_user_by_name("bob")
+    cache = CredentialCache(ttl=0)
+    cache.add(alice, "wonderland")
+    assert cache.contains(alice, "wonderland") is False
+
+    cache = CredentialCache(max_size=1)
+    cache.add(alice, "wonderland")
+    cache.add(bob, "builder")
+    assert len(cache) == 1
+    assert cache.contains(alice, "wonderland") is False
+    assert cache.contains(bob, "builder") is True
+
+def test_access_token():
+    token = AuthService.issue_token("alice")
+    assert AuthService.verify_token(token) == "alice"
+    assert AuthService.verify_token(token, admin=True) is None
+    assert AuthService.verify_token(AuthService.issue_token("admin"), admin=True) == "admin"
+
+def test_access_token_rejects_forged_and_expired():
+    body, _, signature = create_access_token(get_user_by_name("alice")).partition(".")
+    admin_body = create_access_token(get_user_by_name("admin")).partition(".")[0]
+    assert decode_access_token(f"{admin_body}.{signature}") is None
+    assert decode_access_token(f"{body}.") is None
+    assert decode_access_token("not a token") is None
+    assert decode_access_token(create_access_token(get_user_by_name("alice"), ttl=-1)) is None
+
+
+def test_authenticate_user_async_hashes_on_the_hashing_executor():
+    credential_cache.clear()
+    threads = []
+    def spy(password, hashed):
+        threads.append(threading.current_thread().name)
+        return verify_password(password, hashed)
+    with patch("service.auth.verify_password", side_effect=spy):
+        assert asyncio.run(AuthService.authenticate_user_async("alice", "wonderland")) is True
+        assert asyncio.run(AuthService.authenticate_user_async("alice", "wonderland")) is True
+        assert asyncio.run(AuthService.is_admin_async("alice", "wonderland")) is False
+    # The second call is answered by the credential cache without hashing
+    assert len(threads) == 2
+    assert all(name.startswith("qcm-hashing") for name in threads)
@@ -1,9 +1,21 @@
+import asyncio
+import io
+import itertools
+import json
 import os
+import threading
 import pytest
+from contextlib import contextmanager
 import pandas as pd
 from unittest.mock import patch, MagicMock
-from service.question import find_questions, create_question, get_subjects, get_uses, load_dataframe
-from models import CSVQuestion
+from service.question import (
+    find_questions, create_question, create_questions, delete_question, delete_questions, get_subjects, get_uses, load_dataframe,
+    create_question_async, get_subjects_json_async, find_questions_json, generate_quiz_batch, search_questions_json,
+    find_near_duplicates, list_questions_json, export_questions
+)
+from repository.question import CSVQuestionRepository
+from models import CSVQuestion, QuestionKey, QuizSpec
+from near_duplicates import NearDuplicateError
 
 # Get the directory path of the current file
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -37,21 +49,51 @@ def sample_dataframe():
         }
     ])
 
+@pytest.fixture
+def sample_repository(tmp_path, sample_dataframe):
+    csv_path = tmp_path / "data.csv"
+    sample_dataframe.to_csv(csv_path, index=False)
+    repository = CSVQuestionRepository(str(csv_path))
+    with patch('service.question.question_repository', repository):
+        yield repository
+
+def write_before_each_row_read(repository, monkeypatch) -> list:
+    # Another thread writes between every read of ids and the read of their rows, until the
+    # repository is pinned; returns the list of pinnings
+    added = itertools.count()
+    pinned = []
+    get_question_rows, pin = repository.get_question_rows, repository.pinned
+
+    def write_then_read(ids):
+        if not pinned:
+            question = CSVQuestion(question=f'Written {next(added)}', subject='Subject 2', use='Sample Use', correct='A',
+                                   responseA='A1', responseB='A2', responseC='A3')
+            writer = threading.Thread(target=repository.add, args=(question,))
+            writer.start()
+            writer.join()
+        return get_question_rows(ids)
+
+    @contextmanager
+    def pinning():
+        with pin():
+            pinned.append(True)
+            yield
+
+    monkeypatch.setattr(repository, 'get_question_rows', write_then_read)
+    monkeypatch.setattr(repository, 'pinned', pinning)
+    return pinned
+
 def test_load_dataframe(sample_dataframe):
     with patch('pandas.read_csv', return_value=sample_dataframe):
         df = load_dataframe(CSV_FILE_PATH)
         pd.testing.assert_frame_equal(df, sample_dataframe)
 
-@patch('service.question.load_dataframe')
-def test_find_questions(mock_load_dataframe, sample_dataframe):
-    mock_load_dataframe.return_value = sample_dataframe
+def test_find_questions(sample_repository):
     questions = find_questions('Sample Use', ['Subject 1'], 1)
     assert len(questions) == 1
     assert questions[0].question in ['Sample Question 1', 'Sample Question 2']
 
-@patch('service.question.load_dataframe')
-def test_create_question(mock_load_dataframe, sample_dataframe):
-    mock_load_dataframe.return_value = sample_dataframe
+def test_create_question(sample_repository):
     new_question = CSVQuestion(
         question='New Question',
         subject='New Subject',
@@ -65,14 +107,12 @@ def test_create_question(mock_load_dataframe, sample_dataframe):
     )
 
     # Successful case
-    with patch('service.question.add_question'):
-        result = create_question(new_question)
-        assert result == new_question
+    result = create_question(new_question)
+    assert result == new_question
 
     # Failure case: duplicate question
-    with patch('csv_management.verify_question_subject_and_subject_existence', return_value=True):
-        with pytest.raises(ValueError, match="Question already exists"):
-            create_question(new_question)
+    with pytest.raises(ValueError, match="Question already exists"):
+        create_question(new_question)
 
     # Failure case: empty 'correct' field
     invalid_question = CSVQuestion(
@@ -89,14 +129,203 @@ def test_create_question(mock_load_dataframe, sample_dataframe):
     with pytest.raises(ValueError, match="Question correct answer can't be empty"):
         create_question(invalid_question)
 
-@patch('service.question.load_dataframe')
-def test_get_subjects(mock_load_dataframe, sample_dataframe):
-    mock_load_dataframe.return_value = sample_dataframe
+def test_get_subjects(sample_repository):
     subjects = get_subjects()
     assert subjects == ['Subject 1']
 
-@patch('service.question.load_dataframe')
-def test_get_uses(mock_load_dataframe, sample_dataframe):
-    mock_load_dataframe.return_value = sample_dataframe
+def test_get_uses(sample_repository):
     uses = get_uses()
     assert uses == ['Sample Use']
+
+
+def test_question_repository_serves_from_memory(sample_repository):
+    with patch('pandas.read_csv') as mock_read_csv:
+        find_questions('Sample Use', ['Subject 1'], 1)
+        get_subjects()
+        get_uses()
+        mock_read_csv.assert_not_called()
+    assert sample_repository.generation == 1
+
+def test_question_repository_reloads_on_file_change(sample_repository, sample_dataframe):
+    assert get_subjects() == ['Subject 1']
+    sample_dataframe.loc[len(sample_dataframe)] = ['Sample Question 3', 'Subject 2', 'Sample Use', 'C', 'C1', 'C2', 'C3', 'C4', '']
+    sample_dataframe.to_csv(sample_repository.path, index=False)
+    assert sample_repository.is_stale()
+    assert get_subjects() == ['Subject 1', 'Subject 2']
+    assert sample_repository.generation == 2
+
+def test_async_reads_run_on_the_event_loop_when_in_memory(sample_repository, sample_dataframe):
+    sample_repository.load()
+    with patch('pandas.read_csv') as mock_read_csv:
+        assert asyncio.run(get_subjects_json_async()).body == b'["Subject 1"]'
+        mock_read_csv.assert_not_called()
+
+    # A stale file is reloaded on the I/O executor, off the event loop
+    sample_dataframe.loc[len(sample_dataframe)] = ['Sample Question 3', 'Subject 2', 'Sample Use', 'C', 'C1', 'C2', 'C3', 'C4', '']
+    sample_dataframe.to_csv(sample_repository.path, index=False)
+    threads = []
+    loader = sample_repository._loader
+    sample_repository._loader = lambda path: threads.append(threading.current_thread().name) or loader(path)
+    assert asyncio.run(get_subjects_json_async()).body == b'["Subject 1","Subject 2"]'
+    assert threads[0].startswith('qcm-io')
+
+def test_async_writes_run_on_the_io_executor(sample_repository):
+    question = CSVQuestion(question='Sample Question 3', subject='Subject 1', use='Sample Use', correct='C',
+                           responseA='C1', responseB='C2', responseC='C3')
+    threads = []
+    with patch('service.question.question_repository.add', side_effect=lambda q: threads.append(threading.current_thread().name)):
+        asyncio.run(create_question_async(question))
+    assert threads[0].startswith('qcm-io')
+
+
+def test_create_question_updates_index_in_place(sample_repository):
+    new_question = CSVQuestion(
+        question='Sample Question 3',
+        subject='Subject 2',
+        use='Sample Use',
+        correct='C',
+        responseA='C1',
+        responseB='C2',
+        responseC='C3',
+    )
+    get_subjects()
+    with patch('pandas.read_csv') as mock_read_csv:
+        create_question(new_question)
+        questions = find_questions('Sample Use', ['Subject 2'], 1)
+        mock_read_csv.assert_not_called()
+    assert questions[0].question == 'Sample Question 3'
+    assert get_subjects() == ['Subject 1', 'Subject 2']
+    assert pd.read_csv(sample_repository.path)['question'].tolist()[-1] == 'Sample Question 3'
+
+def test_create_questions_and_compact(sample_repository):
+    new_questions = [
+        CSVQuestion(question=f'Bulk Question {i}', subject='Subject 3', use='Sample Use', correct='A',
+                    responseA='A1', responseB='A2', responseC='A3')
+        for i in range(3)
+    ]
+    assert create_questions(new_questions) == new_questions
+    assert len(find_questions('Sample Use', ['Subject 3'], 3)) == 3
+    assert not sample_repository.is_stale()
+
+    sample_repository.compact()
+    assert not sample_repository.is_stale()
+    assert pd.read_csv(sample_repository.path)['question'].tolist()[-3:] == [q.question for q in new_questions]
+
+def test_delete_question(sample_repository):
+    question = QuestionKey(question='Sample Question 1', subject='Subject 1')
+    assert delete_question(question) is True
+    assert find_questions('Sample Use', ['Subject 1'], 1)[0].question == 'Sample Question 2'
+    with pytest.raises(ValueError, match="Question does not exist"):
+        delete_question(question)
+
+    # A fresh repository replays the deletion log
+    repository = CSVQuestionRepository(sample_repository.path)
+    assert repository.index.find('Sample Question 1', 'Subject 1') is None
+    assert repository.index.count('Sample Use', ['Subject 1']) == 1
+
+def test_delete_questions_triggers_background_compaction(sample_repository):
+    sample_repository.compaction_threshold = 0.5
+    get_subjects()
+    assert delete_questions([QuestionKey(question='Sample Question 2', subject='Subject 1')]) == 1
+    sample_repository.compaction_thread.join(timeout=5)
+    assert pd.read_csv(sample_repository.path)['question'].tolist() == ['Sample Question 1']
+    assert sample_repository.tombstone_ratio() == 0
+    assert find_questions('Sample Use', ['Subject 1'], 1)[0].question == 'Sample Question 1'
+
+def test_generate_quiz_batch(sample_repository):
+    sample_repository.add_many([CSVQuestion(question=f'Extra {i}', subject='Subject 1', use='Sample Use', correct='A',
+                                            responseA='A1', responseB='A2', responseC='A3') for i in range(8)])
+    quizzes = [QuizSpec(use='Sample Use', subjects=['Subject 1'], num_questions=3, seed=i) for i in range(120)]
+    quizzes[5] = QuizSpec(use='Sample Use', subjects=['Unknown'], num_questions=3)
+    quizzes[70] = QuizSpec(use='Sample Use', subjects=['Subject 1'], num_questions=20)
+    chunks = list(generate_quiz_batch(quizzes))
+    # Streamed in chunks, one line per quiz in request order
+    assert len(chunks) == 3
+    lines = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+    assert [line['index'] for line in lines] == list(range(120))
+    assert "subjects you provide are not available" in lines[5]['error']
+    assert "Number of questions available: 10" in lines[70]['error']
+    # A seeded quiz gets the same questions as a single seeded draw
+    assert lines[9]['questions'] == json.loads(find_questions_json('Sample Use', ['Subject 1'], 3, seed=9).body)
+    assert all(len({q['question'] for q in line['questions']}) == 3 for line in lines if 'questions' in line)
+
+def test_generate_quiz_batch_follows_repository_changes(sample_repository):
+    quizzes = [QuizSpec(use='Sample Use', subjects=['Subject 1'], num_questions=2)] * 60
+    batch = generate_quiz_batch(quizzes)
+    next(batch)
+    delete_question(QuestionKey(question='Sample Question 1', subject='Subject 1'))
+    # The candidates resolved by the first chunk are not reused for the new generation
+    line = json.loads(next(batch).splitlines()[0])
+    assert line == {"index": 50, "error": "Not enough questions available for the specified criteria. Number of questions available: 1"}
+
+def test_generate_quiz_batch_is_not_starved_by_writes(sample_repository, monkeypatch):
+    pinned = write_before_each_row_read(sample_repository, monkeypatch)
+    line = json.loads(b''.join(generate_quiz_batch([QuizSpec(use='Sample Use', subjects=['Subject 1'], num_questions=2, seed=1)])))
+    assert pinned == [True]
+    assert line['questions'] == json.loads(find_questions_json('Sample Use', ['Subject 1'], 2, seed=1).body)
+
+def test_search_questions_json(sample_repository):
+    create_question(CSVQuestion(question='Échantillon ajouté', subject='Subject 1', use='Sample Use', correct='A',
+                                responseA='Sample', responseB='A2', responseC='A3'))
+    result = json.loads(search_questions_json('SAMPLE', 2).body)
+    assert (result['total'], result['offset'], result['limit']) == (3, 0, 2)
+    # Matches in the question text rank above a match in an answer only
+    assert [q['question'] for q in result['questions']] == ['Sample Question 1', 'Sample Question 2']
+    result = json.loads(search_questions_json('sample', 2, offset=2).body)
+    assert [q['question'] for q in result['questions']] == ['Échantillon ajouté']
+    assert json.loads(search_questions_json('echantillon', 10).body)['total'] == 1
+
+def test_search_questions_json_is_not_starved_by_writes(sample_repository, monkeypatch):
+    pinned = write_before_each_row_read(sample_repository, monkeypatch)
+    result = json.loads(search_questions_json('sample', 10).body)
+    assert pinned == [True]
+    assert [q['question'] for q in result['questions']] == ['Sample Question 1', 'Sample Question 2']
+
+def test_create_question_rejects_near_duplicates(sample_repository):
+    reworded = CSVQuestion(question='sample QUESTION 1 ?', subject='Subject 1', use='Sample Use', correct='A',
+                           responseA='A1', responseB='A2', responseC='A3')
+    with pytest.raises(NearDuplicateError, match="'Sample Question 1'") as error:
+        create_question(reworded)
+    assert [(row['question'], score) for row, score in error.value.duplicates] == [('Sample Question 1', 1.0)]
+    assert [(d.question.question, d.similarity) for d in find_near_duplicates(QuestionKey(question='Sample question 1!', subject='Subject 1'))] == [('Sample Question 1', 1.0)]
+
+    assert create_question(reworded, allow_near_duplicates=True) == reworded
+    assert len(find_near_duplicates(QuestionKey(question='Sample question 1!', subject='Subject 1'))) == 2
+
+def test_list_questions_json_walks_the_pages(sample_repository):
+    create_questions([CSVQuestion(question=f'Question {i}', subject='Subject 2', use='Sample Use', correct='A',
+                                  responseA='A1', responseB='A2', responseC='A3') for i in range(3)])
+    pages, cursor = [], None
+    while True:
+        page = json.loads(list_questions_json(cursor, 2).body)
+        pages.append([question['question'] for question in page['questions']])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert pages == [['Sample Question 1', 'Sample Question 2'], ['Question 0', 'Question 1'], ['Question 2']]
+
+    page = json.loads(list_questions_json(None, 10, subjects=['Subject 2']).body)
+    assert len(page['questions']) == 3 and page['next_cursor'] is None
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        list_questions_json('garbage', 2)
+
+def test_list_questions_json_is_not_starved_by_writes(sample_repository, monkeypatch):
+    pinned = write_before_each_row_read(sample_repository, monkeypatch)
+    page = json.loads(list_questions_json(None, 10, subjects=['Subject 1']).body)
+    assert pinned == [True]
+    assert [q['question'] for q in page['questions']] == ['Sample Question 1', 'Sample Question 2']
+
+def test_export_questions(sample_repository):
+    exported = b''.join(export_questions('csv'))
+    assert exported.decode('utf-8').splitlines()[0] == 'question,subject,use,correct,responseA,responseB,responseC,responseD,remark'
+    exported = pd.read_csv(io.BytesIO(exported), keep_default_na=False)
+    assert exported[['question', 'correct', 'remark']].values.tolist() == [['Sample Question 1', 'Answer 1', ''], ['Sample Question 2', 'Answer 2', '']]
+
+    lines = b''.join(export_questions('ndjson', subjects=['Subject 1'])).splitlines()
+    assert [json.loads(line)['question'] for line in lines] == ['Sample Question 1', 'Sample Question 2']
+    assert b''.join(export_questions('csv', use='Sample Use', subjects=['Subject 1'])).count(b'\n') == 3
+
+    with patch('csv_management.pyarrow', None), pytest.raises(ValueError, match="pyarrow"):
+        export_questions('parquet')
+    with pytest.raises(ValueError, match="use you provide is not available"):
+        export_questions('csv', use='Unknown')
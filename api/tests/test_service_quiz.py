@@ -0,0 +1,89 @@
+import itertools
+import threading
+from contextlib import contextmanager
+import pandas as pd
+import pytest
+from unittest.mock import patch
+from models import CSVQuestion, QuestionKey
+from repository.question import CSVQuestionRepository
+from repository.sqlite_question import SQLiteQuestionRepository
+from service.quiz import end_session, next_questions, session_store, start_session
+
+def make_question(text, subject='Subject 1'):
+    return CSVQuestion(question=text, subject=subject, use='Exam', correct='A',
+                       responseA='A1', responseB='A2', responseC='A3')
+
+@pytest.fixture(params=['csv', 'sqlite'])
+def repository(request, tmp_path):
+    questions = [make_question(f'Question {i}', subject=f'Subject {i % 2}') for i in range(10)]
+    if request.param == 'csv':
+        path = tmp_path / "data.csv"
+        pd.DataFrame([question.model_dump() for question in questions]).to_csv(path, index=False)
+        repository = CSVQuestionRepository(str(path), compaction_threshold=0.1)
+    else:
+        repository = SQLiteQuestionRepository(str(tmp_path / "questions.db"), pool_size=2)
+        repository.add_many(questions)
+    with patch('service.question.question_repository', repository):
+        yield repository
+    session_store.clear()
+
+def test_session_never_repeats_a_question(repository):
+    session = start_session('alice', 'Exam', ['Subject 0', 'Subject 1'], seed=1)
+    assert session.total == session.remaining == 10
+    drawn = []
+    for remaining in (6, 2, 0):
+        batch = next_questions('alice', session.session_id, 4)
+        assert batch.remaining == remaining
+        drawn += [question.question for question in batch.questions]
+    assert sorted(drawn) == sorted(f'Question {i}' for i in range(10))
+    assert next_questions('alice', session.session_id, 4).questions == []
+
+def test_session_follows_repository_changes(repository):
+    session = start_session('alice', 'Exam', ['Subject 0'])
+    served = {question.question for question in next_questions('alice', session.session_id, 3).questions}
+    repository.add(make_question('Question 10', subject='Subject 0'))
+    # Enough removals for the CSV repository to compact its file, which relabels the rows
+    repository.remove_many([QuestionKey(question=question, subject='Subject 0') for question in list(served)[:2]])
+    rest = next_questions('alice', session.session_id, 20)
+    assert rest.remaining == 0
+    assert served.isdisjoint(question.question for question in rest.questions)
+    assert len(rest.questions) == 3
+    assert 'Question 10' in {question.question for question in rest.questions}
+
+def test_session_is_not_starved_by_writes(repository, monkeypatch):
+    session = start_session('alice', 'Exam', ['Subject 0'], seed=1)
+    added = itertools.count()
+    pinned = []
+    get_question_rows, pin = repository.get_question_rows, repository.pinned
+
+    def write_then_read(ids):
+        # Another thread writes before every read of rows, until the repository is pinned
+        if not pinned:
+            writer = threading.Thread(target=repository.add, args=(make_question(f'Written {next(added)}', subject='Subject 2'),))
+            writer.start()
+            writer.join()
+        return get_question_rows(ids)
+
+    @contextmanager
+    def pinning():
+        with pin():
+            pinned.append(True)
+            yield
+
+    monkeypatch.setattr(repository, 'get_question_rows', write_then_read)
+    monkeypatch.setattr(repository, 'pinned', pinning)
+    batch = next_questions('alice', session.session_id, 5)
+    assert pinned == [True]
+    assert sorted(question.question for question in batch.questions) == [f'Question {i}' for i in range(0, 10, 2)]
+    assert batch.remaining == 0
+
+def test_sessions_belong_to_their_user(repository):
+    session = start_session('alice', 'Exam', ['Subject 1'])
+    assert next_questions('bob', session.session_id, 1) is None
+    assert not end_session('bob', session.session_id)
+    assert end_session('alice', session.session_id)
+    assert next_questions('alice', session.session_id, 1) is None
+
+def test_unknown_criteria_are_rejected(repository):
+    with pytest.raises(ValueError, match="subjects you provide are not available"):
+        start_session('alice', 'Exam', ['Unknown'])